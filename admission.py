@@ -0,0 +1,139 @@
+"""
+Request coalescing and admission control for expensive read endpoints
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Set
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; ``retry_after`` is in seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs concurrent calls with the same key once: the first caller computes
+    the result and the callers arriving while it runs wait for it and share
+    the result (or the exception). Nothing is kept once the call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class ConcurrencyLimiter:
+    """
+    Admits at most ``max_concurrent`` holders at once. Up to ``max_queue``
+    more wait in arrival order for at most ``queue_timeout`` seconds; beyond
+    that ``slot`` raises ``Overloaded`` right away, so under a burst the
+    excess is turned away quickly instead of slowing every request down.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32,
+                 queue_timeout: float = 5.0, retry_after: Optional[int] = None):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after if retry_after is not None else max(1, math.ceil(queue_timeout))
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        # Tickets of waiters that timed out before their turn
+        self._abandoned: Set[int] = set()
+        self._serving = 0
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._cond:
+            if self.active >= self.max_concurrent or self.waiting:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise Overloaded("Too many requests queued", self.retry_after)
+                self._wait_turn()
+            self.active += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+    def _wait_turn(self):
+        """Queue until a slot is free and every earlier waiter is in (called with the lock held)"""
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        self.waiting += 1
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while self._serving != ticket or self.active >= self.max_concurrent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timed_out += 1
+                    raise Overloaded("Timed out waiting for a free slot", self.retry_after)
+                self._cond.wait(remaining)
+        finally:
+            self.waiting -= 1
+            # Hand the turn on whether this waiter got in or gave up
+            if self._serving == ticket:
+                self._serving += 1
+            else:
+                self._abandoned.add(ticket)
+            self._skip_abandoned()
+            self._cond.notify_all()
+
+    def _skip_abandoned(self):
+        while self._serving in self._abandoned:
+            self._abandoned.discard(self._serving)
+            self._serving += 1
@@ -0,0 +1,324 @@
+"""
+Declarative alert rules compiled into flat threshold tables
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Any, Optional, Tuple
+
+from history import timestamp_to_micros
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; batches fall back to per-reading lookups
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alert_rules.json")
+
+_INF = float("inf")
+
+# An interval (low, low_closed, high, high_closed) of values on which a rule fires
+Interval = Tuple[float, bool, float, bool]
+
+
+class AlertRule:
+    """One threshold rule on a single parameter"""
+
+    __slots__ = ("id", "param", "level", "type", "message", "intervals",
+                 "hysteresis", "repeat_after")
+
+    def __init__(self, spec: Dict[str, Any], defaults: Dict[str, Any]):
+        try:
+            self.id = spec["id"]
+            self.param = spec["param"]
+            self.level = spec["level"]
+            self.type = spec["type"]
+            self.message = spec["message"]
+        except KeyError as e:
+            raise ValueError(f"Alert rule {spec.get('id', '?')} is missing {e}")
+        self.hysteresis = float(spec.get("hysteresis", defaults.get("hysteresis", 0)))
+        repeat = spec.get("repeat_after_seconds", defaults.get("repeat_after_seconds"))
+        self.repeat_after = int(repeat * 1_000_000) if repeat else None
+        self.intervals = self._intervals(spec)
+
+    def _intervals(self, spec: Dict[str, Any]) -> List[Interval]:
+        if "outside" in spec:
+            low, high = spec["outside"]
+            return [(-_INF, False, float(low), False), (float(high), False, _INF, False)]
+        low, low_closed, high, high_closed = -_INF, False, _INF, False
+        if "gt" in spec:
+            low = float(spec["gt"])
+        if "gte" in spec:
+            low, low_closed = float(spec["gte"]), True
+        if "lt" in spec:
+            high = float(spec["lt"])
+        if "lte" in spec:
+            high, high_closed = float(spec["lte"]), True
+        if low == -_INF and high == _INF:
+            raise ValueError(f"Alert rule {self.id} has no threshold (gt/gte/lt/lte/outside)")
+        return [(low, low_closed, high, high_closed)]
+
+    def held_intervals(self) -> List[Interval]:
+        """Intervals widened by the hysteresis margin: an active rule stays active inside them"""
+        h = self.hysteresis
+        return [(low - h, low_closed or h > 0, high + h, high_closed or h > 0)
+                for low, low_closed, high, high_closed in self.intervals]
+
+
+def _contains(interval: Interval, value: float) -> bool:
+    low, low_closed, high, high_closed = interval
+    above = value >= low if low_closed else value > low
+    below = value <= high if high_closed else value < high
+    return above and below
+
+
+class ThresholdTable:
+    """
+    All rules on one parameter flattened into breakpoints and segments.
+
+    The sorted, de-duplicated interval endpoints split the number line into
+    open gaps and single points. Each gets the precomputed tuple of rules
+    firing there, so looking up a value is one binary search however many
+    rules exist.
+    """
+
+    __slots__ = ("breakpoints", "segments")
+
+    def __init__(self, rule_intervals: List[Tuple[int, List[Interval]]]):
+        points = sorted({edge for _, intervals in rule_intervals
+                         for low, _, high, _ in intervals
+                         for edge in (low, high) if edge not in (-_INF, _INF)})
+        self.breakpoints = points
+        samples = []
+        for i, point in enumerate(points):
+            before = points[i - 1] if i else point - 1.0
+            samples.append((before + point) / 2 if i else before)
+            samples.append(point)
+        samples.append(points[-1] + 1.0 if points else 0.0)
+        self.segments = [
+            tuple(index for index, intervals in rule_intervals
+                  if any(_contains(interval, sample) for interval in intervals))
+            for sample in samples
+        ]
+
+    def segment(self, value: float) -> int:
+        i = bisect_left(self.breakpoints, value)
+        if i < len(self.breakpoints) and self.breakpoints[i] == value:
+            return 2 * i + 1
+        return 2 * i
+
+    def lookup(self, value: float) -> Tuple[int, ...]:
+        return self.segments[self.segment(value)]
+
+    @property
+    def nonempty(self):
+        """NumPy mask of segments that have at least one rule"""
+        return np.array([bool(rules) for rules in self.segments])
+
+    def vector_segments(self, values):
+        """Segment index for every value of a NumPy array"""
+        points = np.array(self.breakpoints, dtype=float)
+        idx = np.searchsorted(points, values, side='left')
+        exact = np.zeros(len(values), dtype=bool)
+        inside = idx < len(points)
+        exact[inside] = points[idx[inside]] == values[inside]
+        return 2 * idx + exact
+
+
+class CompiledRules:
+    """Fire and hold tables per parameter for one set of rules"""
+
+    def __init__(self, rules: List[AlertRule]):
+        self.rules = rules
+        by_param: Dict[str, List[int]] = {}
+        for index, rule in enumerate(rules):
+            by_param.setdefault(rule.param, []).append(index)
+        self.fire = {param: ThresholdTable([(i, rules[i].intervals) for i in indexes])
+                     for param, indexes in by_param.items()}
+        self.hold = {param: ThresholdTable([(i, rules[i].held_intervals()) for i in indexes])
+                     for param, indexes in by_param.items()}
+
+    def matches(self, data: Dict[str, Any]) -> Tuple[List[int], set]:
+        """Rules firing on a reading's data, and rules whose hold range contains it"""
+        fired: List[int] = []
+        held = set()
+        for param, table in self.fire.items():
+            value = data.get(param)
+            if value is None:
+                continue
+            fired.extend(table.lookup(value))
+            held.update(self.hold[param].lookup(value))
+        fired.sort()
+        return fired, held
+
+
+class AlertRuleEngine:
+    """
+    Evaluates readings against rules loaded from a JSON file.
+
+    Rules may be overridden per location, fire once when they become active
+    and stay quiet while the value remains inside the rule's hysteresis
+    band, optionally repeating after ``repeat_after_seconds``. The file is
+    re-read automatically when it changes.
+    """
+
+    def __init__(self, rules_file: str = DEFAULT_RULES_FILE, reload_interval: float = 5.0):
+        self.rules_file = rules_file
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._last_check = 0.0
+        self._base: Optional[CompiledRules] = None
+        self._overrides: Dict[str, List[Dict[str, Any]]] = {}
+        self._defaults: Dict[str, Any] = {}
+        self._base_specs: List[Dict[str, Any]] = []
+        self._by_location: Dict[str, CompiledRules] = {}
+        # location -> rule id -> timestamp (micros) of the last alert raised
+        self._active: Dict[str, Dict[str, int]] = {}
+        self.reload()
+
+    def reload(self) -> bool:
+        """Load and compile the rules file; keeps the current rules if it is invalid"""
+        try:
+            mtime = os.stat(self.rules_file).st_mtime_ns
+            with open(self.rules_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            defaults = config.get("defaults", {})
+            specs = config.get("rules", [])
+            overrides = config.get("overrides", {})
+            base = CompiledRules([AlertRule(spec, defaults) for spec in specs])
+            by_location = {location: CompiledRules(self._merge(specs, changes, defaults))
+                           for location, changes in overrides.items()}
+        except (OSError, ValueError, TypeError) as e:
+            logger.error("⚠️ Error loading alert rules from %s, keeping current rules: %s", self.rules_file, e)
+            return False
+
+        with self._lock:
+            self._mtime = mtime
+            self._defaults = defaults
+            self._base_specs = specs
+            self._overrides = overrides
+            self._base = base
+            self._by_location = by_location
+        logger.info("📏 Loaded %d alert rules (%d location overrides)", len(specs), len(overrides))
+        return True
+
+    @staticmethod
+    def _merge(specs: List[Dict[str, Any]], changes: List[Dict[str, Any]],
+               defaults: Dict[str, Any]) -> List[AlertRule]:
+        """Apply per-location changes (matched by rule id) to the base rule specs"""
+        merged = {spec["id"]: dict(spec) for spec in specs}
+        for change in changes:
+            rule_id = change["id"]
+            spec = merged.get(rule_id, {})
+            if any(key in change for key in ("gt", "gte", "lt", "lte", "outside")):
+                # A new threshold replaces the old one rather than combining with it
+                for key in ("gt", "gte", "lt", "lte", "outside"):
+                    spec.pop(key, None)
+            spec.update(change)
+            merged[rule_id] = spec
+        return [AlertRule(spec, defaults) for spec in merged.values() if spec.get("enabled", True)]
+
+    def maybe_reload(self):
+        """Reload the rules file if it changed (checked at most every reload_interval)"""
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.rules_file).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            # Remember it even if the reload fails, so a broken file is reported once
+            self._mtime = mtime
+            self.reload()
+
+    def _compiled(self, location: str) -> CompiledRules:
+        return self._by_location.get(location, self._base)
+
+    def evaluate(self, reading: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Alerts raised by one reading"""
+        self.maybe_reload()
+        compiled = self._compiled(reading["location"])
+        fired, held = compiled.matches(reading["data"])
+        return self._raise(compiled, reading, fired, held)
+
+    def evaluate_batch(self, readings: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        Alerts raised by each reading of a batch, in order. Threshold lookups
+        are vectorized per parameter when NumPy is available.
+        """
+        self.maybe_reload()
+        if np is None or len(readings) < 64:
+            return [self.evaluate(reading) for reading in readings]
+
+        groups: Dict[str, List[int]] = {}
+        for i, reading in enumerate(readings):
+            groups.setdefault(reading["location"], []).append(i)
+        matches: List[Optional[Tuple[List[int], set]]] = [None] * len(readings)
+        for location, rows in groups.items():
+            compiled = self._compiled(location)
+            fired = [[] for _ in rows]
+            held = [set() for _ in rows]
+            for param, fire_table in compiled.fire.items():
+                hold_table = compiled.hold[param]
+                raw = [readings[i]["data"].get(param) for i in rows]
+                values = np.array([np.nan if v is None else v for v in raw], dtype=float)
+                present = ~np.isnan(values)
+                fire_segments = fire_table.vector_segments(values)
+                hold_segments = hold_table.vector_segments(values)
+                # Only rows landing in a segment with rules need Python-level work
+                for j in np.flatnonzero(present & hold_table.nonempty[hold_segments]):
+                    fired[j].extend(fire_table.segments[fire_segments[j]])
+                    held[j].update(hold_table.segments[hold_segments[j]])
+            for j, i in enumerate(rows):
+                fired[j].sort()
+                matches[i] = (fired[j], held[j])
+
+        return [self._raise(self._compiled(reading["location"]), reading, *match)
+                for reading, match in zip(readings, matches)]
+
+    def _raise(self, compiled: CompiledRules, reading: Dict[str, Any],
+               fired: List[int], held: set) -> List[Dict[str, Any]]:
+        """Apply hysteresis and de-duplication, and build the alert dicts"""
+        location = reading["location"]
+        timestamp = reading["timestamp"]
+        active = self._active.setdefault(location, {})
+        held_ids = {compiled.rules[i].id for i in held}
+        for rule_id in [r for r in active if r not in held_ids]:
+            del active[rule_id]
+
+        alerts = []
+        now = None
+        for index in fired:
+            rule = compiled.rules[index]
+            last = active.get(rule.id)
+            if last is not None:
+                if rule.repeat_after is None:
+                    continue
+                now = now if now is not None else timestamp_to_micros(timestamp)
+                if now - last < rule.repeat_after:
+                    continue
+            now = now if now is not None else timestamp_to_micros(timestamp)
+            active[rule.id] = now
+            value = reading["data"][rule.param]
+            alerts.append({
+                "level": rule.level,
+                "type": rule.type,
+                "message": rule.message.format(value=value),
+                "rule": rule.id,
+                "timestamp": timestamp,
+                "location": location
+            })
+        return alerts
+
+    def reset_state(self):
+        """Forget which rules are active (every condition alerts again)"""
+        self._active.clear()
@@ -0,0 +1,267 @@
+"""
+In-memory alert store indexed by time, level, type and location
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Dict, List, Any, Optional, Tuple
+
+from history import timestamp_to_micros
+
+# Alerts of one reading are numbered ``seq * ALERTS_PER_READING + k``
+ALERTS_PER_READING = 256
+
+DEFAULT_RETENTION = {"critical": 10000, "warning": 2000}
+DEFAULT_LEVEL_RETENTION = 2000
+
+def parse_retention(spec: str) -> Dict[str, int]:
+    """Parse ``"critical=10000,warning=2000"`` into per-level alert counts"""
+    retention = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        level, _, count = part.partition("=")
+        try:
+            retention[level.strip()] = int(count)
+        except ValueError:
+            raise ValueError(f"Invalid alert retention: {part!r} (expected level=count)")
+    return retention
+
+
+class _KeyIndex:
+    """
+    Alert ids of one group (a level, a location, ...) ordered by key.
+
+    Evicted alerts are removed lazily: the index keeps their ids until more
+    than half of its entries are dead, then rebuilds itself.
+    """
+
+    __slots__ = ("keys", "ids", "dead")
+
+    def __init__(self):
+        self.keys = array('q')
+        self.ids = array('q')
+        self.dead = 0
+
+    def add(self, ts: int, alert_id: int):
+        keys, ids = self.keys, self.ids
+        if not keys or (ts, alert_id) >= (keys[-1], ids[-1]):
+            keys.append(ts)
+            ids.append(alert_id)
+            return
+        i = bisect_right(keys, ts)
+        while i > 0 and keys[i - 1] == ts and ids[i - 1] > alert_id:
+            i -= 1
+        keys.insert(i, ts)
+        ids.insert(i, alert_id)
+
+    def compact(self, alive: Dict[int, Any]):
+        if self.dead * 2 <= len(self.ids):
+            return
+        pairs = [(k, i) for k, i in zip(self.keys, self.ids) if i in alive]
+        self.keys = array('q', (k for k, _ in pairs))
+        self.ids = array('q', (i for _, i in pairs))
+        self.dead = 0
+
+
+class AlertStore:
+    """
+    Alerts kept in memory, newest ``retention[level]`` per level, so a burst
+    of warnings cannot push critical alerts out.
+
+    Every alert is indexed by time overall and per level, type, location,
+    (level, location) and (location, type). A query walks the most selective index backwards from
+    its cursor, so its cost follows the size of the page rather than the
+    number of stored alerts. Alerts are identified by the sequence number of
+    the reading that raised them; a page never splits one reading's alerts.
+    """
+
+    def __init__(self, retention: Optional[Dict[str, int]] = None,
+                 default_retention: int = DEFAULT_LEVEL_RETENTION):
+        self.retention = dict(DEFAULT_RETENTION if retention is None else retention)
+        self.default_retention = default_retention
+        self.clear()
+
+    def clear(self):
+        self._alerts: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+        self._indexes: Dict[tuple, _KeyIndex] = {}
+        self._by_level: Dict[str, deque] = {}
+        # reading seq -> [alerts it raised, alerts still stored]
+        self._by_seq: Dict[int, List[int]] = {}
+        # Newest (timestamp micros, id) evicted per level: older alerts of that level are gone
+        self._evicted: Dict[str, Tuple[int, int]] = {}
+        # Alerts older than this were never loaded (e.g. only a tail was restored)
+        self._floor: Optional[Tuple[int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self._alerts)
+
+    def _index_names(self, alert: Dict[str, Any]) -> Tuple[tuple, ...]:
+        level, location, alert_type = alert.get("level"), alert.get("location"), alert.get("type")
+        return (("all",), ("level", level), ("type", alert_type), ("location", location),
+                ("level_location", level, location), ("location_type", location, alert_type))
+
+    def add(self, seq: int, alerts: List[Dict[str, Any]]):
+        """Store the alerts raised by the reading with sequence number ``seq``"""
+        alerts = alerts[:ALERTS_PER_READING]
+        if not alerts:
+            return
+        self._by_seq[seq] = [len(alerts), len(alerts)]
+        for k, alert in enumerate(alerts):
+            alert_id = seq * ALERTS_PER_READING + k
+            ts = timestamp_to_micros(alert["timestamp"])
+            self._alerts[alert_id] = (ts, alert)
+            for name in self._index_names(alert):
+                index = self._indexes.get(name)
+                if index is None:
+                    index = self._indexes[name] = _KeyIndex()
+                index.add(ts, alert_id)
+            level = alert.get("level")
+            kept = self._by_level.get(level)
+            if kept is None:
+                kept = self._by_level[level] = deque()
+            kept.append(alert_id)
+            limit = self.retention.get(level, self.default_retention)
+            while len(kept) > limit:
+                self._evict(level, kept.popleft())
+
+    def _evict(self, level: str, alert_id: int):
+        ts, alert = self._alerts.pop(alert_id)
+        key = (ts, alert_id)
+        if level not in self._evicted or key > self._evicted[level]:
+            self._evicted[level] = key
+        seq = alert_id // ALERTS_PER_READING
+        counts = self._by_seq[seq]
+        counts[1] -= 1
+        if not counts[1]:
+            del self._by_seq[seq]
+        for name in self._index_names(alert):
+            index = self._indexes[name]
+            index.dead += 1
+            index.compact(self._alerts)
+
+    def for_seq(self, seq: int) -> List[Dict[str, Any]]:
+        """Alerts raised by one reading"""
+        counts = self._by_seq.get(seq)
+        if counts is None:
+            return []
+        base = seq * ALERTS_PER_READING
+        entries = (self._alerts.get(base + k) for k in range(counts[0]))
+        return [entry[1] for entry in entries if entry is not None]
+
+    def horizon(self, level: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        """
+        ``(timestamp micros, reading seq)`` at or below which the store may
+        be missing alerts of ``level`` (any level when None), because they
+        were evicted or never loaded. None when it holds every such alert.
+        """
+        keys = [self._floor] if self._floor is not None else []
+        if level is not None:
+            if level in self._evicted:
+                keys.append(self._evicted[level])
+        else:
+            keys.extend(self._evicted.values())
+        if not keys:
+            return None
+        ts, alert_id = max(keys)
+        return ts, alert_id // ALERTS_PER_READING
+
+    def page(self, level: Optional[str] = None, location: Optional[str] = None,
+             alert_type: Optional[str] = None, since: Optional[int] = None,
+             until: Optional[int] = None, limit: int = 10,
+             before: Optional[Tuple[int, int]] = None,
+             above: Optional[Tuple[int, int]] = None
+             ) -> Tuple[List[Tuple[int, int, Dict[str, Any]]], bool]:
+        """
+        Newest-first page of matching alerts, returned oldest first as
+        ``(timestamp micros, reading seq, alert)``.
+
+        ``since``/``until`` bound the timestamp (micros, ``until`` exclusive).
+        ``before`` and ``above`` are ``(timestamp micros, reading seq)``
+        bounds: only alerts of readings strictly between them are returned.
+        The flag tells whether older matches remain in the store.
+        """
+        # The most selective index covering the filters; the rest are checked per alert
+        if level is not None and location is not None:
+            name = ("level_location", level, location)
+        elif location is not None and alert_type is not None:
+            name, alert_type = ("location_type", location, alert_type), None
+        elif location is not None:
+            name = ("location", location)
+        elif level is not None:
+            name = ("level", level)
+        elif alert_type is not None:
+            name, alert_type = ("type", alert_type), None
+        else:
+            name = ("all",)
+        index = self._indexes.get(name)
+        if index is None:
+            return [], False
+
+        keys, ids = index.keys, index.ids
+        lo = 0 if since is None else bisect_left(keys, since)
+        if above is not None and (since is None or above[0] >= since):
+            above_ts, last_id = above[0], (above[1] + 1) * ALERTS_PER_READING - 1
+            lo = bisect_right(keys, above_ts, lo)
+            while lo > 0 and keys[lo - 1] == above_ts and ids[lo - 1] > last_id:
+                lo -= 1
+        hi = len(keys) if until is None else bisect_left(keys, until, lo)
+        if before is not None:
+            before_ts, before_seq = before
+            first_id = before_seq * ALERTS_PER_READING
+            hi = min(hi, bisect_right(keys, before_ts, lo))
+            while hi > lo and keys[hi - 1] == before_ts and ids[hi - 1] >= first_id:
+                hi -= 1
+
+        alerts = self._alerts
+        result = []
+        last_seq = None
+        more = False
+        for i in range(hi - 1, lo - 1, -1):
+            entry = alerts.get(ids[i])
+            # Skip evicted alerts the index still holds, and other types
+            if entry is None or (alert_type is not None and entry[1].get("type") != alert_type):
+                continue
+            seq = ids[i] // ALERTS_PER_READING
+            if len(result) >= limit and seq != last_seq:
+                # A live match beyond the page: only then is there a next page
+                more = True
+                break
+            # Finish the last reading's alerts before stopping
+            result.append((entry[0], seq, entry[1]))
+            last_seq = seq
+        result.reverse()
+        return result, more
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Every stored alert, oldest first, with its reading's ``seq`` (for snapshots)"""
+        index = self._indexes.get(("all",))
+        if index is None:
+            return []
+        result = []
+        for alert_id in index.ids:
+            entry = self._alerts.get(alert_id)
+            if entry is not None:
+                result.append({**entry[1], "seq": alert_id // ALERTS_PER_READING})
+        return result
+
+    def load(self, alerts: List[Dict[str, Any]], partial: bool = False):
+        """
+        Replace the contents with snapshot alerts. Alerts saved without a
+        ``seq`` get placeholder ones ordered before every reading. With
+        ``partial=True`` older alerts exist elsewhere (e.g. in a database).
+        """
+        self.clear()
+        groups: Dict[int, List[Dict[str, Any]]] = {}
+        for i, alert in enumerate(alerts):
+            alert = dict(alert)
+            seq = alert.pop("seq", None)
+            if seq is None:
+                seq = i - len(alerts)
+            groups.setdefault(seq, []).append(alert)
+        for seq, group in groups.items():
+            self.add(seq, group)
+        if partial and alerts:
+            index = self._indexes[("all",)]
+            self._floor = (index.keys[0], index.ids[0])
@@ -0,0 +1,140 @@
+"""
+Streaming anomaly and drift detection against each location's own baseline
+"""
+
+import math
+from typing import Dict, List, Any, Optional, Tuple
+
+# Positions in a per-(location, parameter) state list
+_N, _MEAN, _M2, _EWMA, _CUSUM_HIGH, _CUSUM_LOW, _FLAGS = range(7)
+# Bits of _FLAGS: an alert of that kind is active and is not raised again until it clears
+_SPIKE_ACTIVE, _DRIFT_ACTIVE = 1, 2
+
+
+class AnomalyDetector:
+    """
+    Online detector keeping O(1) statistics per location and parameter.
+
+    Each series has a Welford running mean and variance (its baseline), an
+    exponentially weighted moving average (its current level) and a
+    two-sided CUSUM of the standardized deviations from the baseline.
+
+    - A reading more than ``z_threshold`` standard deviations from the
+      baseline raises a spike alert.
+    - A CUSUM beyond ``cusum_threshold`` raises a drift alert: the values
+      have been consistently above (or below) normal for a while, even if no
+      single reading stood out.
+
+    Nothing is raised until a series has ``warmup`` readings. An alert is
+    not repeated while its condition persists; a spike clears once readings
+    are back within half the threshold, a drift once the EWMA is back near
+    the baseline.
+    """
+
+    def __init__(self, warmup: int = 30, z_threshold: float = 4.0, ewma_alpha: float = 0.1,
+                 cusum_slack: float = 0.5, cusum_threshold: float = 10.0, min_std: float = 0.01):
+        self.warmup = warmup
+        self.z_threshold = z_threshold
+        self.ewma_alpha = ewma_alpha
+        self.cusum_slack = cusum_slack
+        self.cusum_threshold = cusum_threshold
+        # Floor for the baseline deviation, so a constant series (e.g. E.coli
+        # always 0) does not turn every change into an infinite z-score
+        self.min_std = min_std
+        # location -> parameter -> state list
+        self._series: Dict[str, Dict[str, List[float]]] = {}
+
+    def update(self, reading: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Fold a reading into its location's statistics; returns the alerts it raised"""
+        location = reading["location"]
+        series = self._series.get(location)
+        if series is None:
+            series = self._series[location] = {}
+        alerts = []
+        for param, value in reading["data"].items():
+            if value is None:
+                continue
+            state = series.get(param)
+            if state is None:
+                series[param] = [1, float(value), 0.0, float(value), 0.0, 0.0, 0]
+                continue
+            alert = self._update(state, param, float(value))
+            if alert is not None:
+                kind, message = alert
+                alerts.append({
+                    "level": "warning",
+                    "type": "anomaly",
+                    "message": message,
+                    "rule": f"{param}_{kind}",
+                    "timestamp": reading["timestamp"],
+                    "location": location
+                })
+        return alerts
+
+    def _update(self, state: List[float], param: str, value: float) -> Optional[Tuple[str, str]]:
+        """Update one series; returns ``(kind, message)`` when it raises an alert"""
+        n, mean = state[_N], state[_MEAN]
+        std = max(math.sqrt(state[_M2] / (n - 1)) if n > 1 else 0.0,
+                  self.min_std, 0.01 * abs(mean))
+        z = (value - mean) / std
+        alpha = self.ewma_alpha
+        state[_EWMA] += alpha * (value - state[_EWMA])
+
+        spike = abs(z) > self.z_threshold
+        # Welford's update of the baseline
+        n += 1
+        delta = value - mean
+        mean += delta / n
+        state[_N], state[_MEAN] = n, mean
+        state[_M2] += delta * (value - mean)
+
+        # Clipped, so one spike alone cannot trip the CUSUM
+        clipped = max(-self.z_threshold, min(z, self.z_threshold))
+        state[_CUSUM_HIGH] = max(0.0, state[_CUSUM_HIGH] + clipped - self.cusum_slack)
+        state[_CUSUM_LOW] = max(0.0, state[_CUSUM_LOW] - clipped - self.cusum_slack)
+
+        flags = int(state[_FLAGS])
+        if flags & _SPIKE_ACTIVE and abs(z) < self.z_threshold / 2:
+            flags &= ~_SPIKE_ACTIVE
+        if flags & _DRIFT_ACTIVE and abs(state[_EWMA] - mean) < self.cusum_slack * std:
+            flags &= ~_DRIFT_ACTIVE
+
+        alert = None
+        if n >= self.warmup:
+            if spike and not flags & _SPIKE_ACTIVE:
+                flags |= _SPIKE_ACTIVE
+                alert = ("spike", f"Unusual {param} reading: {value:g} "
+                                  f"(baseline {mean:.3g} ± {std:.2g}, z={z:+.1f})")
+            elif max(state[_CUSUM_HIGH], state[_CUSUM_LOW]) > self.cusum_threshold:
+                direction = "above" if state[_CUSUM_HIGH] > state[_CUSUM_LOW] else "below"
+                state[_CUSUM_HIGH] = state[_CUSUM_LOW] = 0.0
+                if not flags & _DRIFT_ACTIVE:
+                    flags |= _DRIFT_ACTIVE
+                    alert = ("drift", f"{param} drifting {direction} baseline: recent average "
+                                      f"{state[_EWMA]:.3g} vs {mean:.3g} ± {std:.2g}")
+        state[_FLAGS] = flags
+        return alert
+
+    def baseline(self, location: str) -> Dict[str, Dict[str, float]]:
+        """Current statistics of every parameter at a location"""
+        result = {}
+        for param, state in self._series.get(location, {}).items():
+            n = state[_N]
+            result[param] = {
+                "count": int(n),
+                "mean": state[_MEAN],
+                "std": math.sqrt(state[_M2] / (n - 1)) if n > 1 else 0.0,
+                "ewma": state[_EWMA],
+            }
+        return result
+
+    def reset(self):
+        self._series.clear()
+
+    def to_dict(self) -> Dict[str, Dict[str, List[float]]]:
+        return {location: {param: list(state) for param, state in series.items()}
+                for location, series in self._series.items()}
+
+    def load(self, state: Dict[str, Dict[str, List[float]]]):
+        self._series = {location: {param: list(values) for param, values in series.items()}
+                        for location, series in state.items()}
@@ -8,11 +8,17 @@ from flask_cors import CORS
 import threading
 import kisa_utils as kutils 
 
+import logging
 import time
+from logging_config import configure_logging
 from water_sensor_simulator import WaterSensorSimulator
 from data_store import DataStore
 
 from flask import Flask, jsonify, request
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
 # Enable CORS for local dev, Docker, and production deployments
@@ -33,11 +39,16 @@ CORS(
 
 # Initialize components
 simulator = WaterSensorSimulator(noise_level=0.05)
-data_store = DataStore("sensor_data.json")
+# Read-only until it holds the writer lock, so it can run next to app.py
+data_store = DataStore("sensor_data.json", follower=True)
 
 def update_sensor_data():
     """Background task to update sensor data every 60 seconds"""
     while True:
+        if not data_store.try_become_writer():
+            # Another process (e.g. the gunicorn app) is generating readings
+            time.sleep(60)
+            continue
         try:
             # Generate a new reading (scenario will be randomly selected)
             reading = simulator.generate_reading()
@@ -45,22 +56,12 @@ def update_sensor_data():
             # Store the reading
             data_store.add_reading(reading)
             
-            # Print status
-            print("\n📊 New reading generated:")
-            print(f"   Location: {reading['location']}")
-            print(f"   Status: {reading['name']}")
-            print(f"   Time: {reading['timestamp']}")
-            print(f"   Readings:")
-            print(f"     • pH: {reading['data']['ph']:.1f}")
-            print(f"     • Turbidity: {reading['data']['turbidity_ntu']:.1f} NTU")
-            print(f"     • E.coli: {reading['data']['e_coli_ctu_100ml']} CFU/100mL")
-            print(f"     • Chlorine: {reading['data']['residual_chlorine_mg_l']:.2f} mg/L")
-            print("-" * 80)
+            logger.debug("📊 New reading at %s (%s): pH %.1f, turbidity %.1f NTU",
+                         reading['location'], reading['name'],
+                         reading['data']['ph'], reading['data']['turbidity_ntu'])
             
-        except Exception as e:
-            print(f"⚠️ Error updating sensor data: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("⚠️ Error updating sensor data")
         
         time.sleep(60)  # Wait for 60 seconds before next update
 
@@ -75,7 +76,7 @@ def get_latest_reading():
         reading = data_store.get_latest_reading()
         return jsonify(reading)
     except Exception as e:
-        print(f"⚠️ Error getting latest reading: {e}")
+        logger.exception("⚠️ Error getting latest reading")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/historical', methods=['GET'])
@@ -85,7 +86,7 @@ def get_historical_readings():
         readings = data_store.get_historical_readings()
         return jsonify(readings)
     except Exception as e:
-        print(f"⚠️ Error getting historical readings: {e}")
+        logger.exception("⚠️ Error getting historical readings")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/alerts', methods=['GET'])
@@ -95,7 +96,7 @@ def get_alerts():
         alerts = data_store.get_alerts()
         return jsonify(alerts)
     except Exception as e:
-        print(f"⚠️ Error getting alerts: {e}")
+        logger.exception("⚠️ Error getting alerts")
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
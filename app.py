@@ -8,11 +8,32 @@ from flask_cors import CORS
 import threading
 import kisa_utils as kutils 
 
+import logging
+import math
+import os
 import time
+from logging_config import configure_logging
 from water_sensor_simulator import WaterSensorSimulator
 from data_store import DataStore
+from storage import create_backend
+from alert_rules import AlertRuleEngine, DEFAULT_RULES_FILE
+from alert_store import AlertStore, parse_retention
+from anomaly import AnomalyDetector
+from scheduler import ReadingScheduler, default_sensors, load_sensors
+
+import json
+from typing import Optional
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from admission import ConcurrencyLimiter, Overloaded, SingleFlight
+from response_cache import ResponseCache
+from ingest import ReadingInbox, ReadingSchema, parse_bulk_body
+import wire_format
+import metrics
+import export
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
-from flask import Flask, jsonify, request
 app = Flask(__name__)
 
 # Enable CORS for local dev, Docker, and production deployments
@@ -22,8 +43,8 @@ CORS(
         r"/api/*": {
             "origins": "*",  # Allow all origins for easier deployment (adjust for production security if needed)
             "methods": ["GET", "POST", "OPTIONS"],
-            "allow_headers": ["Accept", "Content-Type", "Authorization", "Cache-Control"],
-            "expose_headers": ["Content-Type"],
+            "allow_headers": ["Accept", "Content-Type", "Authorization", "Cache-Control", "If-None-Match", "Last-Event-ID"],
+            "expose_headers": ["Content-Type", "Content-Encoding", "X-Next-Cursor", "ETag"],
             "supports_credentials": False,
         }
     },
@@ -32,47 +53,233 @@ CORS(
 # Remove custom CORS header injection; Flask-CORS will set the correct single-origin header
 
 # Initialize components
-simulator = WaterSensorSimulator(noise_level=0.05)
-data_store = DataStore("sensor_data.json")
+simulator = WaterSensorSimulator(
+    noise_level=0.05,
+    seed=int(os.environ["SIMULATOR_SEED"]) if os.environ.get("SIMULATOR_SEED") else None,
+)
+HISTORY_CAPACITY = int(os.environ.get("HISTORY_CAPACITY", "1000"))
 
-def update_sensor_data():
-    """Background task to update sensor data for all locations every 60 seconds"""
+def exit_on_load_error(error: Exception):
+    """Stop this worker when its history cannot be loaded, so that it is restarted"""
+    logger.critical("💥 Cannot load the stored history (%s); exiting so the worker restarts", error)
+    logging.shutdown()
+    os._exit(1)
+
+# Every gunicorn worker serves reads from its own copy of the store; only the
+# worker holding the writer lock generates and persists readings.
+data_store = DataStore(
+    "sensor_data.json",
+    backend=create_backend("sensor_data.json", history_capacity=HISTORY_CAPACITY),
+    follower=True,
+    history_capacity=HISTORY_CAPACITY,
+    rules=AlertRuleEngine(os.environ.get("ALERT_RULES_FILE", DEFAULT_RULES_FILE)),
+    anomalies=AnomalyDetector(
+        z_threshold=float(os.environ.get("ANOMALY_Z_THRESHOLD", "4")),
+        cusum_threshold=float(os.environ.get("ANOMALY_CUSUM_THRESHOLD", "10")),
+    ),
+    # Alerts kept in memory per level, e.g. "critical=10000,warning=2000"
+    alerts=AlertStore(parse_retention(os.environ["ALERT_RETENTION"])
+                      if os.environ.get("ALERT_RETENTION") else None),
+    # Boot from the small head file; the full history loads in the background
+    lazy_load=True,
+    on_load_error=exit_on_load_error,
+    # Coalesce writes made within this window into one append, off the request path
+    flush_interval=float(os.environ.get("FLUSH_INTERVAL_SECONDS", "0.2")),
+)
+
+# Serialized GET responses, reused until the data store version changes
+response_cache = ResponseCache()
+# Identical requests arriving while a response is being built wait for that build
+response_builds = SingleFlight()
+# Bounds how many responses are built at once; cache hits are never queued
+build_limiter = ConcurrencyLimiter(
+    max_concurrent=int(os.environ.get("READ_CONCURRENCY", "4")),
+    max_queue=int(os.environ.get("READ_QUEUE_LIMIT", "32")),
+    queue_timeout=float(os.environ.get("READ_QUEUE_TIMEOUT_SECONDS", "5")),
+)
+
+# Uploaded readings are validated in whichever worker receives them; workers
+# other than the writer spool accepted batches for the writer to store
+reading_schema = ReadingSchema()
+reading_inbox = ReadingInbox("sensor_data.json.inbox")
+
+def cached_json(build, readings: bool = False):
+    """
+    Serve ``build()`` as JSON, reusing the serialized body while the data is
+    unchanged. ``build`` returns the payload, or ``(payload, headers)``.
+    Answers ``If-None-Match`` with 304 when the client already has it.
+
+    Bodies are compressed when the client accepts it. With ``readings=True``
+    the payload is a list of readings that can also be served in the
+    columnar or MessagePack format, chosen from the ``Accept`` header.
+
+    Concurrent identical requests share one build, and builds wait for a
+    slot of ``build_limiter``; when it is saturated the answer is 503 with
+    ``Retry-After``.
+    """
+    version = data_store.version
+    mimetype = wire_format.JSON
+    if readings:
+        mimetype = request.accept_mimetypes.best_match(wire_format.response_mimetypes(),
+                                                       default=wire_format.JSON)
+    encoding = wire_format.negotiate_encoding(request.accept_encodings)
+    key = f"{request.full_path}|{mimetype}|{encoding}"
+    entry = response_cache.get(key, version)
+    if entry is None:
+        def build_entry():
+            with build_limiter.slot():
+                result = build()
+                payload, headers = result if isinstance(result, tuple) else (result, None)
+                headers = dict(headers or {})
+                headers['Content-Type'] = mimetype
+                body = wire_format.encode(payload, mimetype, dumps=app.json.dumps)
+                if encoding and len(body) >= wire_format.MIN_COMPRESS_BYTES:
+                    body = wire_format.compress(body, encoding)
+                    headers['Content-Encoding'] = encoding
+            return response_cache.put(key, version, body, headers)
+
+        try:
+            entry = response_builds.do((key, version), build_entry)
+        except Overloaded as e:
+            return overloaded_response(e)
+
+    if request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body)
+        response.headers.update(entry.headers)
+    response.set_etag(entry.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.update(('Accept', 'Accept-Encoding') if readings else ('Accept-Encoding',))
+    return response
+
+def overloaded_response(error: Overloaded):
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def wait_for_writer_role(retry_seconds: float = 5.0):
+    """Block until this process is elected as the single data writer"""
+    data_store.wait_until_ready()
+    while not data_store.try_become_writer():
+        time.sleep(retry_seconds)
+    logger.info("✍️ Worker %d is now the data writer", os.getpid())
+
+# How often the writer looks for batches spooled by other workers
+INBOX_POLL_SECONDS = 1.0
+
+def drain_reading_inbox():
+    """Background task in the writer storing batches uploaded to other workers"""
     while True:
         try:
-            # Generate readings for all 7 locations
-            all_scenarios = ["clean", "turbid", "contaminated", "industrial", "reservoir", "pump_kurambiro", "pump_lubigi"]
-            
-            print(f"\n📊 Generating readings for all {len(all_scenarios)} locations:")
-            print("=" * 80)
-            
-            for scenario in all_scenarios:
-                # Generate a reading for this specific scenario
-                reading = simulator.generate_reading(scenario)
-                
-                # Store the reading
-                data_store.add_reading(reading)
-                
-                # Print status for this location
-                print(f"📍 {reading['location']}:")
-                print(f"   Status: {reading['name']}")
-                print(f"   pH: {reading['data']['ph']:.1f} | Turbidity: {reading['data']['turbidity_ntu']:.1f} NTU")
-                print(f"   E.coli: {reading['data']['e_coli_ctu_100ml']} CFU/100mL | Chlorine: {reading['data']['residual_chlorine_mg_l']:.2f} mg/L")
-                print("-" * 40)
-            
-            print(f"✅ Generated readings for all {len(all_scenarios)} locations")
-            print("=" * 80)
-            
-        except Exception as e:
-            print(f"⚠️ Error updating sensor data: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        time.sleep(60)  # Wait for 60 seconds before next update
+            for name, readings in reading_inbox.drain():
+                # The batch file is deleted next, so it must be on disk first
+                alerts = data_store.add_readings(readings, wait=True)
+                logger.info("📥 Stored %d uploaded readings from %s (%d alerts)", len(readings), name, len(alerts))
+        except Exception:
+            logger.exception("⚠️ Error storing uploaded readings")
+        time.sleep(INBOX_POLL_SECONDS)
+
+def create_sensor_scheduler() -> ReadingScheduler:
+    """Sensors from SENSORS_FILE, or one per simulator scenario every 60 seconds"""
+    sensors_file = os.environ.get("SENSORS_FILE")
+    sensors = load_sensors(sensors_file) if sensors_file else default_sensors()
+    return ReadingScheduler(sensors, simulator, store_scheduled_readings,
+                            max_workers=int(os.environ.get("SENSOR_WORKERS", "8")))
+
+def store_scheduled_readings(readings):
+    """Store one batch of due readings with a single append"""
+    alerts = data_store.add_readings(readings)
+    logger.debug("📊 Stored %d scheduled readings (%d alerts)", len(readings), len(alerts))
+
+sensor_scheduler = None
+
+def update_sensor_data():
+    """Background task that runs the sensor scheduler once this worker is the writer"""
+    global sensor_scheduler
+    wait_for_writer_role()
+    threading.Thread(target=drain_reading_inbox, daemon=True).start()
+    if os.environ.get("SIMULATE_SENSORS", "1") == "0":
+        # Readings only arrive through the API (real gateways, benchmarks)
+        logger.info("⏸️ Sensor simulation disabled")
+        return
+    try:
+        sensor_scheduler = create_sensor_scheduler()
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("⚠️ Error loading sensors, using the default ones: %s", e)
+        sensor_scheduler = ReadingScheduler(default_sensors(), simulator, store_scheduled_readings)
+    logger.info("⏱️ Scheduling %d sensors", len(sensor_scheduler.sensors))
+    sensor_scheduler.run()
 
 # Start the background data update thread
 update_thread = threading.Thread(target=update_sensor_data, daemon=True)
 update_thread.start()
 
+# Metrics describe this worker only; each gunicorn worker serves its own /metrics
+REQUEST_SECONDS = metrics.Histogram("wq_http_request_seconds", "Time to handle an HTTP request",
+                                    ["method", "route", "status"])
+metrics.Gauge("wq_ready", "1 once the full history is loaded").set_function(
+    lambda: data_store.ready)
+metrics.Gauge("wq_writer", "1 if this worker is the data writer").set_function(
+    lambda: data_store.is_writer)
+metrics.Gauge("wq_history_readings", "Readings held in the in-memory history").set_function(
+    lambda: len(data_store.history))
+metrics.Gauge("wq_alert_buffer_alerts", "Alerts held in memory").set_function(
+    lambda: len(data_store.alerts))
+metrics.Gauge("wq_pending_writes", "Entries applied in memory but not yet persisted").set_function(
+    lambda: data_store.dirty_count)
+metrics.Counter("wq_response_cache_hits", "GET responses served from the cache").set_function(
+    lambda: response_cache.hits)
+metrics.Counter("wq_response_cache_misses", "GET responses that had to be built").set_function(
+    lambda: response_cache.misses)
+storage_bytes = metrics.Counter("wq_storage_bytes_written", "Bytes written to storage by this worker")
+if hasattr(data_store.backend, "bytes_written"):
+    storage_bytes.set_function(
+        lambda: data_store.backend.bytes_written +
+        (data_store.backend.segments.bytes_written if getattr(data_store.backend, "segments", None) else 0))
+
+metrics.Counter("wq_coalesced_requests", "Requests served by another request's response build").set_function(
+    lambda: response_builds.coalesced)
+metrics.Gauge("wq_response_builds_active", "Responses being built").set_function(
+    lambda: build_limiter.active)
+metrics.Gauge("wq_response_builds_queued", "Requests waiting for a response build slot").set_function(
+    lambda: build_limiter.waiting)
+metrics.Counter("wq_rejected_requests", "Requests answered 503 because response builds were saturated").set_function(
+    lambda: build_limiter.rejected + build_limiter.timed_out)
+
+def scheduler_stat(key: str):
+    return lambda: sensor_scheduler.stats[key] if sensor_scheduler is not None else 0
+
+metrics.Gauge("wq_scheduler_sensors", "Sensors scheduled by this worker").set_function(
+    scheduler_stat("sensors"))
+metrics.Counter("wq_scheduler_ticks", "Sensor readings produced on schedule").set_function(
+    scheduler_stat("ticks"))
+metrics.Counter("wq_scheduler_missed_ticks", "Sensor ticks skipped because the scheduler fell behind").set_function(
+    scheduler_stat("missed_ticks"))
+metrics.Counter("wq_scheduler_errors", "Sensor readings that failed to be produced or stored").set_function(
+    scheduler_stat("errors"))
+metrics.Gauge("wq_scheduler_max_lag_seconds", "Largest delay past a sensor's deadline").set_function(
+    scheduler_stat("max_lag_seconds"))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(
+            time.perf_counter() - started)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Counters, gauges and histograms in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint to prevent 404 errors"""
@@ -82,67 +289,394 @@ def root():
         "endpoints": {
             "latest": "/api/latest",
             "historical": "/api/historical", 
+            "export": "/api/export",
             "alerts": "/api/alerts",
-            "all_locations": "/api/all-locations"
+            "aggregates": "/api/aggregates",
+            "summary": "/api/summary",
+            "all_locations": "/api/all-locations",
+            "location_history": "/api/locations/<name>/history",
+            "stream": "/api/stream",
+            "events": "/api/events",
+            "bulk_upload": "/api/readings/bulk",
+            "health": "/api/health",
+            "ready": "/api/ready",
+            "metrics": "/metrics"
         },
         "status": "active",
-        "description": "Generates data for 7 locations every 60 seconds"
+        "description": "Generates data for every configured sensor on its own schedule"
     })
 
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Liveness probe: 200 as soon as the worker serves from its head file"""
+    if data_store.load_error is not None:
+        return jsonify({"status": "error", "error": str(data_store.load_error)}), 503
+    return jsonify({"status": "ok", "ready": data_store.ready})
+
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: 503 until the full history has been loaded"""
+    body = {
+        "ready": data_store.ready,
+        "writer": data_store.is_writer,
+        "readings_loaded": len(data_store.history),
+        "persistence": {**data_store.persistence_stats, "dirty": data_store.dirty_count}
+    }
+    segments = getattr(data_store.backend, "segments", None)
+    if segments is not None:
+        body["segments"] = segments.stats()
+    if sensor_scheduler is not None:
+        body["scheduler"] = sensor_scheduler.summary()
+    return jsonify(body), 200 if body["ready"] else 503
+
 @app.route('/api/latest', methods=['GET'])
 def get_latest_reading():
     """Get the latest sensor reading"""
     try:
-        reading = data_store.get_latest_reading()
-        return jsonify(reading)
+        return cached_json(data_store.get_latest_reading)
     except Exception as e:
-        print(f"⚠️ Error getting latest reading: {e}")
+        logger.exception("⚠️ Error getting latest reading")
         return jsonify({"error": str(e)}), 500
 
+# Upper bound on readings accepted by one bulk upload
+BULK_MAX_READINGS = 10000
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+
+@app.route('/api/readings/bulk', methods=['POST'])
+def bulk_upload_readings():
+    """
+    Upload readings in bulk, as a JSON array or NDJSON (one per line).
+
+    Every reading is validated on its own; invalid ones are reported by
+    index in ``errors`` without failing the rest. The writer stores the
+    batch with a single log append and answers once it is fsynced (200);
+    other workers fsync it to the inbox for the writer (202).
+    """
+    try:
+        items = parse_bulk_body(request.get_data(cache=False), request.content_type)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request body: {e}"}), 400
+    if not items:
+        return jsonify({"error": "No readings in request body"}), 400
+    if len(items) > BULK_MAX_READINGS:
+        return jsonify({"error": f"At most {BULK_MAX_READINGS} readings per request"}), 413
+
+    readings, errors = reading_schema.validate_many(items)
+    result = {
+        "received": len(items),
+        "accepted": len(readings),
+        "rejected": len(errors),
+        "errors": errors
+    }
+    if not readings:
+        return jsonify(result), 400
+
+    try:
+        if data_store.is_writer:
+            result["alerts"] = len(data_store.add_readings(readings, wait=True))
+            result["status"] = "stored"
+            return jsonify(result), 200
+        reading_inbox.put(readings)
+        result["status"] = "queued"
+        return jsonify(result), 202
+    except Exception as e:
+        logger.exception("⚠️ Error storing uploaded readings")
+        return jsonify({"error": str(e)}), 500
+
+# Upper bound on readings returned by one /api/historical page
+MAX_PAGE_SIZE = 1000
+
+def limit_arg(default: int, maximum: Optional[int] = MAX_PAGE_SIZE) -> int:
+    """The ``limit`` query parameter, capped at ``maximum``; ValueError unless a positive integer"""
+    value = request.args.get('limit')
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        raise ValueError(f"'limit' must be a positive integer: {value}")
+    return min(limit, maximum) if maximum is not None else limit
+
+def timeout_arg(default: float, maximum: float) -> float:
+    """The ``timeout`` query parameter in seconds, clamped to [0, maximum]; ValueError unless a finite number"""
+    value = request.args.get('timeout')
+    if value is None:
+        return default
+    try:
+        timeout = float(value)
+    except ValueError:
+        timeout = math.nan
+    if not math.isfinite(timeout):
+        raise ValueError(f"'timeout' must be a finite number of seconds: {value}")
+    return min(max(timeout, 0.0), maximum)
+
 @app.route('/api/historical', methods=['GET'])
 def get_historical_readings():
-    """Get historical readings"""
+    """
+    Get historical readings.
+
+    Supports ``from``/``to`` (ISO timestamps), ``location``, ``params``
+    (comma-separated parameter names), ``limit`` and ``cursor``. The cursor
+    for the next, older page is returned in the ``X-Next-Cursor`` header.
+    Send ``Accept: application/vnd.waterquality.columnar+json`` (or
+    ``application/msgpack``) for the compact columnar layout.
+    """
+    try:
+        params = request.args.get('params')
+        limit = limit_arg(100)
+
+        def build():
+            readings, next_cursor = data_store.query_readings(
+                since=request.args.get('from'),
+                until=request.args.get('to'),
+                location=request.args.get('location'),
+                params=[p.strip() for p in params.split(',') if p.strip()] if params else None,
+                limit=limit,
+                cursor=request.args.get('cursor'),
+            )
+            return readings, ({'X-Next-Cursor': next_cursor} if next_cursor else None)
+
+        return cached_json(build, readings=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("⚠️ Error getting historical readings")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_readings():
+    """
+    Stream stored readings as CSV, NDJSON or Parquet (``format``), oldest
+    first. Supports ``from``/``to``, ``location`` and ``params`` like
+    ``/api/historical``. The body is sent in chunks as it is produced, so
+    memory stays bounded whatever the size of the export.
+    """
     try:
-        readings = data_store.get_historical_readings()
-        return jsonify(readings)
+        fmt = request.args.get('format', 'csv')
+        params = request.args.get('params')
+        params = [p.strip() for p in params.split(',') if p.strip()] if params else None
+        readings = data_store.iter_readings(
+            since=request.args.get('from'),
+            until=request.args.get('to'),
+            location=request.args.get('location'),
+            params=params,
+        )
+        chunks = export.export_chunks(readings, fmt, params or data_store.history.parameters)
+        content_type, extension = export.FORMATS[fmt]
+        return Response(stream_with_context(chunks), content_type=content_type, headers={
+            'Content-Disposition': f'attachment; filename="water-quality.{extension}"',
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"⚠️ Error getting historical readings: {e}")
+        logger.exception("⚠️ Error exporting readings")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/aggregates', methods=['GET'])
+def get_aggregates():
+    """
+    Get rolled-up statistics (min/max/mean/count/p95) per location.
+
+    Supports ``resolution`` (1m, 1h or 1d), ``location``, ``from``/``to`` and
+    ``params`` (comma-separated parameter names).
+    """
+    try:
+        params = request.args.get('params')
+        resolution = request.args.get('resolution', '1h')
+
+        def build():
+            buckets = data_store.get_aggregates(
+                resolution=resolution,
+                location=request.args.get('location'),
+                since=request.args.get('from'),
+                until=request.args.get('to'),
+                params=[p.strip() for p in params.split(',') if p.strip()] if params else None,
+            )
+            return {
+                "resolution": resolution,
+                "locations": buckets
+            }
+
+        return cached_json(build)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("⚠️ Error getting aggregates")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/alerts', methods=['GET'])
 def get_alerts():
-    """Get recent alerts"""
+    """
+    Get recent alerts.
+
+    Supports ``level``, ``location``, ``type``, ``since``/``until`` (ISO
+    timestamps), ``limit`` (default 10) and ``cursor``. The cursor for the
+    next, older page is returned in the ``X-Next-Cursor`` header.
+    """
     try:
-        alerts = data_store.get_alerts()
-        return jsonify(alerts)
+        limit = limit_arg(10)
+
+        def build():
+            alerts, next_cursor = data_store.query_alerts(
+                level=request.args.get('level'),
+                location=request.args.get('location'),
+                alert_type=request.args.get('type'),
+                since=request.args.get('since'),
+                until=request.args.get('until'),
+                limit=limit,
+                cursor=request.args.get('cursor'),
+            )
+            return alerts, ({'X-Next-Cursor': next_cursor} if next_cursor else None)
+
+        return cached_json(build)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"⚠️ Error getting alerts: {e}")
+        logger.exception("⚠️ Error getting alerts")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/summary', methods=['GET'])
+def get_summary():
+    """
+    Get the status of every location: latest values, water quality index,
+    worst active alert level, trends and time since the last reading.
+    Maintained as readings arrive; not cached because the ages change.
+    """
+    try:
+        return jsonify(data_store.get_summary())
+    except Exception as e:
+        logger.exception("⚠️ Error getting location summary")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/all-locations', methods=['GET'])
 def get_all_locations():
     """Get latest readings from all locations"""
     try:
-        # Get the last 7 readings (one for each location)
-        all_readings = data_store.get_historical_readings(limit=7)
-        
-        # Group by location to get the latest from each
-        location_data = {}
-        for reading in all_readings:
-            location = reading.get('location', 'Unknown')
-            if location not in location_data:
-                location_data[location] = reading
-        
-        # Convert to list format
-        result = list(location_data.values())
-        
+        def build():
+            result = list(data_store.get_latest_by_location().values())
+            return {
+                "locations": result,
+                "count": len(result),
+                "timestamp": max((r['timestamp'] for r in result), default=None)
+            }
+
+        return cached_json(build)
+    except Exception as e:
+        logger.exception("⚠️ Error getting all locations")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/locations/<path:name>/history', methods=['GET'])
+def get_location_history(name):
+    """Get recent readings for one location (or scenario key)"""
+    try:
+        limit = limit_arg(100, maximum=None)
+
+        def build():
+            readings = data_store.get_location_history(name, limit=limit)
+            if readings is None:
+                readings = data_store.get_scenario_history(name, limit=limit)
+            if readings is None:
+                raise LookupError(f"Unknown location: {name}")
+            return {
+                "location": name,
+                "readings": readings,
+                "count": len(readings)
+            }
+
+        return cached_json(build)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        logger.exception("⚠️ Error getting location history")
+        return jsonify({"error": str(e)}), 500
+
+# Streams are closed after this long; EventSource clients reconnect with
+# Last-Event-ID, so no worker is held by one client indefinitely.
+STREAM_MAX_SECONDS = 300
+STREAM_KEEPALIVE_SECONDS = 15
+
+def _event_filters():
+    """Parse the location/level/events filters shared by the event endpoints"""
+    levels = {l for l in request.args.get('level', '').split(',') if l}
+    kinds = {k.rstrip('s') for k in request.args.get('events', '').split(',') if k}
+    return request.args.get('location'), levels or None, kinds or None
+
+def _parse_event_id(value, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    """
+    Server-Sent Events stream of new readings and alerts.
+
+    Filters: ``location``, ``level`` (comma-separated alert levels) and
+    ``events`` (``readings``, ``alerts`` or both). Reconnecting clients send
+    ``Last-Event-ID`` and get everything they missed that is still in the
+    history buffer.
+    """
+    location, levels, kinds = _event_filters()
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    cursor = _parse_event_id(last_id, data_store.last_seq)
+
+    def generate(cursor):
+        yield "retry: 5000\n\n"
+        started = time.monotonic()
+        last_sent = started
+        while time.monotonic() - started < STREAM_MAX_SECONDS:
+            version = data_store.version
+            events, cursor = data_store.get_events_since(cursor, location, levels, kinds)
+            for seq, kind, payload in events:
+                yield f"id: {seq}\nevent: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            now = time.monotonic()
+            if events:
+                last_sent = now
+            elif now - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = now
+            data_store.wait_for_change(version, timeout=STREAM_KEEPALIVE_SECONDS)
+
+    return Response(
+        stream_with_context(generate(cursor)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/events', methods=['GET'])
+def poll_events():
+    """
+    Long-poll alternative to /api/stream.
+
+    Returns events after ``since`` (an event id), waiting up to ``timeout``
+    seconds (max 30) for new ones. Same filters as /api/stream.
+    """
+    try:
+        location, levels, kinds = _event_filters()
+        timeout = timeout_arg(25.0, 30.0)
+        cursor = _parse_event_id(request.args.get('since'), data_store.last_seq)
+        deadline = time.monotonic() + timeout
+        while True:
+            version = data_store.version
+            events, cursor = data_store.get_events_since(cursor, location, levels, kinds)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                break
+            data_store.wait_for_change(version, timeout=min(remaining, 1.0))
+
         return jsonify({
-            "locations": result,
-            "count": len(result),
-            "timestamp": result[0]['timestamp'] if result else None
+            "events": [{"id": seq, "event": kind, "data": payload} for seq, kind, payload in events],
+            "last_event_id": cursor
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"⚠️ Error getting all locations: {e}")
+        logger.exception("⚠️ Error polling events")
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
@@ -0,0 +1,354 @@
+"""
+Offline benchmarks for the simulator, the data store and the API
+
+Runs entirely in-process (Flask test client, temporary data directory), so it
+needs no network access and never touches the real data files. Results are
+written as JSON; with ``--baseline`` they are compared with an earlier run and
+the exit status is 1 when a metric got worse by more than ``--tolerance``.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --baseline bench.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Iterator, Optional
+
+from logging_config import configure_logging
+from water_sensor_simulator import WaterSensorSimulator
+
+DEFAULT_ENDPOINTS = ["/api/latest", "/api/historical", "/api/all-locations"]
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """p50/p90/p99/mean/max of request latencies, in milliseconds"""
+    values = sorted(seconds)
+    if not values:
+        return {}
+
+    def pct(q: float) -> float:
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+    return {
+        "p50_ms": pct(0.50),
+        "p90_ms": pct(0.90),
+        "p99_ms": pct(0.99),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+def history_batches(simulator: WaterSensorSimulator, count: int) -> Iterator[List[Dict[str, Any]]]:
+    """Time-ordered readings for ``count`` minutes of history ending now, in batches"""
+    ticks = -(-count // len(simulator.SCENARIOS))
+    start = datetime.now() - timedelta(minutes=ticks)
+    remaining = count
+    for batch in simulator.backfill(start, start + timedelta(minutes=ticks), 60):
+        if remaining <= 0:
+            return
+        yield batch[:remaining]
+        remaining -= len(batch)
+
+
+def bench_generate(simulator: WaterSensorSimulator, count: int) -> Dict[str, Any]:
+    scenarios = list(simulator.SCENARIOS)
+    started = time.perf_counter()
+    for i in range(count):
+        simulator.generate_reading(scenarios[i % len(scenarios)])
+    elapsed = time.perf_counter() - started
+    return {
+        "readings": count,
+        "readings_per_second": round(count / elapsed, 1),
+        "us_per_reading": round(elapsed / count * 1e6, 2),
+    }
+
+
+def bench_add_reading(simulator: WaterSensorSimulator, workdir: str, sizes: List[int],
+                      count: int, flush_interval: float, backend: str) -> List[Dict[str, Any]]:
+    """``add_reading`` throughput with the history buffer already holding ``size`` readings"""
+    from data_store import DataStore
+    from storage import SqliteBackend
+
+    results = []
+    scenarios = list(simulator.SCENARIOS)
+    for size in sizes:
+        json_file = os.path.join(workdir, f"store-{backend}-{size}.json")
+        store = DataStore(
+            json_file,
+            backend=SqliteBackend(json_file[:-5] + ".db", history_limit=size) if backend == "sqlite" else None,
+            follower=True, history_capacity=size, flush_interval=flush_interval)
+        if not store.try_become_writer():
+            raise RuntimeError(f"Could not become the writer of {json_file}")
+        for batch in history_batches(simulator, size):
+            store.add_readings(batch)
+        store.flush()
+
+        readings = [simulator.generate_reading(scenarios[i % len(scenarios)]) for i in range(count)]
+        started = time.perf_counter()
+        for reading in readings:
+            store.add_reading(reading)
+        # Count the time to get everything on disk, not only into the queue
+        store.flush()
+        elapsed = time.perf_counter() - started
+        results.append({
+            "backend": backend,
+            "history_size": size,
+            "readings": count,
+            "flush_interval": flush_interval,
+            "readings_per_second": round(count / elapsed, 1),
+            "us_per_reading": round(elapsed / count * 1e6, 2),
+        })
+        print(f"⏱️ add_reading with {size} readings of history: "
+              f"{results[-1]['readings_per_second']:.0f}/s")
+    return results
+
+
+def bench_check_alerts(simulator: WaterSensorSimulator, count: int) -> Dict[str, Any]:
+    """Cost of evaluating one reading: threshold rules, baseline anomalies, and both"""
+    from alert_rules import AlertRuleEngine
+    from anomaly import AnomalyDetector
+
+    readings = list(history_batches(simulator, count))
+    readings = [reading for batch in readings for reading in batch]
+    result = {"readings": len(readings)}
+    rules = AlertRuleEngine()
+    anomalies = AnomalyDetector()
+    for name, evaluate in (("rules", rules.evaluate),
+                           ("anomalies", anomalies.update),
+                           ("rules_batch", None)):
+        started = time.perf_counter()
+        if evaluate is None:
+            rules.reset_state()
+            rules.evaluate_batch(readings)
+        else:
+            for reading in readings:
+                evaluate(reading)
+        result[f"{name}_us_per_reading"] = round((time.perf_counter() - started) / len(readings) * 1e6, 2)
+    result["check_alerts_us_per_reading"] = round(
+        result["rules_us_per_reading"] + result["anomalies_us_per_reading"], 2)
+    return result
+
+
+def bench_http(endpoints: List[str], clients: int, requests_per_client: int,
+               history: int, ingest_rate: float, accept_encoding: Optional[str]) -> Dict[str, Any]:
+    """
+    Latency of GET endpoints under ``clients`` concurrent test clients, while
+    readings optionally arrive at ``ingest_rate`` per second (invalidating the
+    response cache as in production).
+    """
+    os.environ["SIMULATE_SENSORS"] = "0"
+    os.environ.setdefault("HISTORY_CAPACITY", str(max(history, 1000)))
+    # The app keeps its files relative to the working directory, set by ``run``
+    import app as api
+
+    store = api.data_store
+    store.wait_until_ready()
+    deadline = time.monotonic() + 30
+    while not store.is_writer:
+        if time.monotonic() > deadline:
+            raise RuntimeError("The API worker did not become the writer")
+        time.sleep(0.05)
+    for batch in history_batches(api.simulator, history):
+        store.add_readings(batch)
+    store.flush()
+
+    stop = threading.Event()
+    ingested = [0]
+
+    def ingest():
+        scenarios = list(api.simulator.SCENARIOS)
+        while not stop.wait(1.0 / ingest_rate):
+            store.add_reading(api.simulator.generate_reading(scenarios[ingested[0] % len(scenarios)]))
+            ingested[0] += 1
+
+    ingest_thread = None
+    if ingest_rate > 0:
+        ingest_thread = threading.Thread(target=ingest, daemon=True)
+        ingest_thread.start()
+
+    headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+    results = {}
+    try:
+        for endpoint in endpoints:
+            latencies: List[List[float]] = [[] for _ in range(clients)]
+            errors = [0] * clients
+            sizes = [0] * clients
+
+            def client(index: int):
+                test_client = api.app.test_client()
+                test_client.get(endpoint, headers=headers)  # warm-up
+                own = latencies[index]
+                for _ in range(requests_per_client):
+                    started = time.perf_counter()
+                    response = test_client.get(endpoint, headers=headers)
+                    body = response.get_data()
+                    own.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        errors[index] += 1
+                    sizes[index] = len(body)
+
+            threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            total = clients * requests_per_client
+            results[endpoint] = {
+                "requests": total,
+                "errors": sum(errors),
+                "response_bytes": max(sizes),
+                "requests_per_second": round(total / elapsed, 1),
+                **latency_summary([value for own in latencies for value in own]),
+            }
+            print(f"⏱️ GET {endpoint}: p50 {results[endpoint]['p50_ms']} ms, "
+                  f"p99 {results[endpoint]['p99_ms']} ms")
+    finally:
+        stop.set()
+        if ingest_thread is not None:
+            ingest_thread.join()
+        store.flush()
+    return {
+        "clients": clients,
+        "history": history,
+        "ingest_rate": ingest_rate,
+        "ingested": ingested[0],
+        "accept_encoding": accept_encoding,
+        "endpoints": results,
+    }
+
+
+def _flatten(value: Any, prefix: str = "") -> Iterator[tuple]:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from _flatten(item, f"{prefix}[{index}]")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than ``tolerance`` (a fraction)"""
+    old = dict(_flatten(baseline.get("results", {})))
+    regressions = []
+    for path, value in _flatten(results["results"]):
+        before = old.get(path)
+        if not before:
+            continue
+        name = path.rsplit(".", 1)[-1]
+        if name.endswith("_per_second"):
+            change = (before - value) / before
+        elif name.endswith("_ms") or "_us_per_" in name or name.startswith("us_per_"):
+            change = (value - before) / before
+        else:
+            continue
+        if change > tolerance:
+            regressions.append(f"{path}: {before} -> {value} ({change:+.0%} worse)")
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> Dict[str, Any]:
+    simulator = WaterSensorSimulator(seed=args.seed)
+    results: Dict[str, Any] = {}
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="wq-bench-") as workdir:
+        # Everything (including the app's relative data files) lives in workdir
+        os.chdir(workdir)
+        try:
+            print("⏱️ generate_reading")
+            results["generate_reading"] = bench_generate(simulator, args.generate)
+            print("⏱️ check_alerts")
+            results["check_alerts"] = bench_check_alerts(simulator, args.alerts)
+            results["add_reading"] = []
+            for backend in args.backends:
+                results["add_reading"].extend(bench_add_reading(
+                    simulator, workdir, args.sizes, args.add, args.flush_interval, backend))
+            if args.endpoints:
+                results["http"] = bench_http(args.endpoints, args.clients, args.requests,
+                                             args.history, args.ingest_rate, args.accept_encoding)
+        finally:
+            os.chdir(previous)
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulator, data store and API offline")
+    parser.add_argument("--output", help="Write the JSON results here (default stdout)")
+    parser.add_argument("--baseline", help="Earlier results to compare with; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline as a fraction (default 0.25)")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes for a fast smoke run")
+    parser.add_argument("--seed", type=int, default=42, help="Simulator seed (default 42)")
+    parser.add_argument("--generate", type=int, default=20000, help="Readings for generate_reading")
+    parser.add_argument("--alerts", type=int, default=20000, help="Readings for alert evaluation")
+    parser.add_argument("--add", type=int, default=2000, help="Readings added per history size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="History sizes for add_reading (default 1000 10000 50000)")
+    parser.add_argument("--backends", nargs="+", default=["json"], choices=["json", "sqlite"],
+                        help="Storage backends for add_reading (default json)")
+    parser.add_argument("--flush-interval", type=float, default=0.2,
+                        help="Persister flush interval; 0 writes every reading synchronously")
+    parser.add_argument("--endpoints", nargs="*", default=DEFAULT_ENDPOINTS,
+                        help="GET endpoints to load-test (none to skip)")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent API clients (default 8)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per client and endpoint")
+    parser.add_argument("--history", type=int, default=1000, help="Readings loaded before the API test")
+    parser.add_argument("--ingest-rate", type=float, default=10.0,
+                        help="Readings per second added during the API test (default 10)")
+    parser.add_argument("--accept-encoding", default=None, help="Accept-Encoding sent by the clients")
+    if "--quick" in sys.argv:
+        # Explicit options still win over the quick defaults
+        parser.set_defaults(generate=2000, alerts=2000, add=500, sizes=[1000, 5000], requests=50)
+    args = parser.parse_args()
+    configure_logging()
+
+    # Keep stdout for the JSON document; progress and app logging go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+        regressions = []
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                regressions = compare(report, json.load(f), args.tolerance)
+            report["regressions"] = regressions
+
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(document + "\n")
+    else:
+        print(document)
+    for regression in regressions:
+        print(f"❌ Regression: {regression}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
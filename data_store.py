@@ -2,176 +2,824 @@
 Data store for water quality sensor readings
 """
 
-import json
-import os
+import atexit
+import heapq
+import logging
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, Iterator, List, Any, Optional, Tuple
+
+from alert_rules import AlertRuleEngine
+from alert_store import AlertStore
+from anomaly import AnomalyDetector
+from history import ReadingHistory, TimeIndex, timestamp_to_micros
+from metrics import Counter, Histogram
+from rollups import RollupEngine
+from storage import AppendLogBackend, WriterLock
+from summary import LocationSummary
+
+logger = logging.getLogger(__name__)
+
+ADD_SECONDS = Histogram("wq_add_reading_seconds",
+                        "Time to evaluate, apply and queue new readings", ["method"])
+READINGS_ADDED = Counter("wq_readings_added", "Readings added by this worker")
+ALERTS_FIRED = Counter("wq_alerts_fired", "Alerts raised by new readings", ["level", "type"])
+STORAGE_WRITE_SECONDS = Histogram("wq_storage_write_seconds",
+                                  "Time spent writing to storage", ["operation"])
+STORAGE_WRITE_ERRORS = Counter("wq_storage_write_errors", "Failed storage writes", ["operation"])
 
 class DataStore:
-    def __init__(self, json_file: str = "sensor_data.json"):
+    def __init__(self, json_file: str = "sensor_data.json", backend=None,
+                 follower: bool = False, refresh_interval: float = 1.0,
+                 history_capacity: int = 1000, rules: Optional[AlertRuleEngine] = None,
+                 lazy_load: bool = False, flush_interval: float = 0.0,
+                 anomalies: Optional[AnomalyDetector] = None,
+                 alerts: Optional[AlertStore] = None,
+                 summary: Optional[LocationSummary] = None,
+                 on_load_error: Optional[Callable[[Exception], None]] = None):
+        """
+        Create a data store.
+
+        With ``follower=True`` the store starts read-only and keeps itself up to
+        date from the storage written by another process. A follower becomes
+        the single writer by winning ``try_become_writer``. Otherwise the
+        constructor takes the writer lock itself and raises RuntimeError when
+        another process holds it.
+
+        ``history_capacity`` bounds how many readings are kept in the
+        columnar history buffer. ``rules`` is the alert rule engine; by
+        default rules are loaded from ``alert_rules.json``. ``anomalies`` is
+        the detector comparing readings with each location's own baseline.
+        ``alerts`` holds the raised alerts with their per-level retention.
+        ``summary`` is the per-location status kept up to date for dashboards.
+
+        With ``lazy_load=True`` the constructor only reads the backend's small
+        head file (latest readings and a short tail) and loads the full
+        history in a background thread; ``ready`` tells when it is done. If
+        that load fails the store never becomes ready: the error is kept in
+        ``load_error`` and passed to ``on_load_error``, which can stop the
+        process so that it is restarted.
+
+        With ``flush_interval > 0`` the writer persists from a background
+        thread: changes made within that many seconds are coalesced into one
+        storage append, so ingest never waits for the disk. Otherwise every
+        change is written before ``add_reading`` returns.
+        """
+        if not follower and lazy_load:
+            raise ValueError("A writer must load its full history first; "
+                             "use follower=True and try_become_writer with lazy_load")
         self.json_file = json_file
+        self.backend = backend if backend is not None else AppendLogBackend(json_file)
+        # Read-only until the writer lock is held
+        self.follower = True
+        self.refresh_interval = refresh_interval
+        self._writer_lock = WriterLock(f"{json_file}.lock")
+        self._lock = threading.RLock()
+        # Notified whenever data changes, for clients waiting on new events
+        self._changed = threading.Condition(self._lock)
+        self._last_refresh = time.monotonic()
+        self.history = ReadingHistory(history_capacity)
+        # Secondary indexes over the history buffer
+        self._by_time = TimeIndex()
+        self._by_location: Dict[str, TimeIndex] = {}
+        self._by_scenario: Dict[str, TimeIndex] = {}
+        self._latest_by_location: Dict[str, Dict[str, Any]] = {}
+        self.rollups = RollupEngine()
+        self.rules = rules if rules is not None else AlertRuleEngine()
+        self.anomalies = anomalies if anomalies is not None else AnomalyDetector()
+        self.alerts = alerts if alerts is not None else AlertStore()
+        self.summary = summary if summary is not None else LocationSummary()
+        # Bumped on every change; lets callers cache derived responses
+        self._version = 0
         self.data = {
-            "latest_reading": None,
-            "historical_readings": [],
-            "alerts": []
+            "latest_reading": None
+        }
+        self.flush_interval = flush_interval
+        # Log entries applied in memory but not yet written to storage
+        self._pending: List[Dict[str, Any]] = []
+        # (seq, reading) evicted from memory but not yet in the backend's segments
+        self._unarchived: List[Tuple[int, Dict[str, Any]]] = []
+        self._archives = getattr(self.backend, "segments", None) is not None
+        # Serializes writes to storage; always taken before self._lock
+        self._flush_lock = threading.Lock()
+        self._flush_wakeup = threading.Event()
+        self._persister: Optional[threading.Thread] = None
+        self.persistence_stats = {
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_flush_seconds": None,
+            "last_flush_entries": 0,
+            "last_compaction_seconds": None,
         }
-        self._load_data()
+        self._ready = threading.Event()
+        self.load_error: Optional[Exception] = None
+        self._on_load_error = on_load_error
+        if not follower and not self._writer_lock.try_acquire():
+            raise RuntimeError(f"Another process is writing to {json_file}; "
+                               "open it with follower=True")
+        if lazy_load:
+            self._load_head()
+            threading.Thread(target=self._load_in_background, daemon=True, name="history-loader").start()
+        else:
+            self._load_data()
+        if not follower:
+            self.try_become_writer()
+
+    def _load_head(self):
+        """Serve the latest readings right away, before the full history is loaded"""
+        load_head = getattr(self.backend, "load_head", None)
+        head = load_head() if load_head is not None else None
+        if head is None:
+            return
+        snapshot, entries = head
+        with self._lock:
+            self._restore(snapshot)
+            for entry in entries:
+                self._replay(entry)
+        logger.info("⚡ Loaded %d recent readings from the head file", len(self.history))
 
     def _load_data(self):
-        """Load existing data from JSON file"""
-        # Default structure
-        default_data = {
-            "latest_reading": None,
-            "historical_readings": [],
-            "alerts": []
+        """Load the last snapshot and replay any log entries written after it"""
+        started = time.monotonic()
+        try:
+            # Parse outside the lock so readers keep being served meanwhile
+            snapshot, entries = self.backend.load()
+            with self._lock:
+                self._restore(snapshot)
+                for entry in entries:
+                    self._replay(entry)
+        except Exception as e:
+            logger.error("⚠️ Error loading historical readings: %s", e)
+            raise
+        self._last_refresh = time.monotonic()
+        self._ready.set()
+        logger.info("📊 Loaded %d historical readings in %.2fs",
+                    len(self.history), time.monotonic() - started)
+
+    def _load_in_background(self):
+        try:
+            self._load_data()
+        except Exception as e:
+            self.load_error = e
+            if self._on_load_error is not None:
+                self._on_load_error(e)
+
+    @property
+    def ready(self) -> bool:
+        """Whether the full history has been loaded"""
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until the full history is loaded; False on timeout"""
+        return self._ready.wait(timeout)
+
+    def _restore(self, snapshot: Dict[str, Any]):
+        """Replace the in-memory data with a loaded snapshot"""
+        self._version += 1
+        readings = snapshot.get("historical_readings") or []
+        next_seq = snapshot.get("history_seq", len(readings))
+        self.history.reset(next_seq - len(readings))
+        self._by_time = TimeIndex()
+        self._by_location = {}
+        self._by_scenario = {}
+        self._latest_by_location = dict(snapshot.get("latest_by_location") or {})
+        seqs = [self._add_to_history(reading) for reading in readings]
+        self._unarchived = [item for item in self._unarchived if item[0] < self.history.start_seq]
+        if "rollups" in snapshot:
+            # Backends saving closed buckets separately load them as "rollup_buckets"
+            self.rollups.load(snapshot["rollups"], snapshot.get("rollup_buckets"))
+        else:
+            # Older snapshots carry no rollups; seed them from the history
+            self.rollups.clear()
+            for seq in seqs:
+                if seq in self.history:
+                    self._add_to_rollups(seq, self.history.get(seq)["data"])
+        if "anomaly_baselines" in snapshot:
+            self.anomalies.load(snapshot["anomaly_baselines"])
+        else:
+            self.anomalies.reset()
+            for reading in readings:
+                self.anomalies.update(reading)
+        self.data = {
+            "latest_reading": snapshot.get("latest_reading")
         }
-        
-        if os.path.exists(self.json_file):
-            try:
-                with open(self.json_file, 'r', encoding='utf-8') as f:
-                    loaded_data = json.load(f)
-                    # Merge loaded data with default structure to ensure all keys exist
-                    self.data = {**default_data, **loaded_data}
-                print(f"📊 Loaded {len(self.data['historical_readings'])} historical readings")
-            except (json.JSONDecodeError, KeyError) as e:
-                print(f"⚠️ Error loading data file, starting fresh: {e}")
-                self.data = default_data
+        # A database keeps older alerts than those loaded into memory
+        self.alerts.load(snapshot.get("alerts") or [], partial=hasattr(self.backend, "query_alerts"))
+        if snapshot.get("location_summary") is not None:
+            self.summary.load(snapshot["location_summary"])
         else:
-            print("📝 Creating new data store")
-            self.data = default_data
+            self.summary.reset()
+            for seq, reading in zip(seqs, readings):
+                self.summary.update(reading, self.alerts.for_seq(seq))
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """Build the full persisted representation of the current data"""
+        return {
+            "latest_reading": self.data["latest_reading"],
+            "historical_readings": self.history.to_list(),
+            # Copies: the snapshot is serialized outside the lock
+            "alerts": self.alerts.to_list(),
+            "history_seq": self.history.next_seq,
+            "latest_by_location": dict(self._latest_by_location),
+            # Closed buckets go through save_rollups when the backend has it
+            "rollups": self.rollups.to_dict(closed=not hasattr(self.backend, "save_rollups")),
+            "anomaly_baselines": self.anomalies.to_dict(),
+            "location_summary": self.summary.to_dict()
+        }
 
     def _save_data(self):
-        """Save current data to JSON file"""
-        try:
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"⚠️ Error saving data: {e}")
+        """Write a full snapshot of the current data"""
+        with STORAGE_WRITE_SECONDS.labels("compact").time():
+            self._compact(self._snapshot(), self._take_rollup_changes(rewrite=True))
+
+    def _take_rollup_changes(self, rewrite: bool = False):
+        """
+        Closed rollup buckets to save with the next snapshot, as
+        ``(changed, full)`` for ``backend.save_rollups``; None when the
+        backend keeps them in the snapshot (called with the lock held).
+        """
+        if not hasattr(self.backend, "save_rollups"):
+            return None
+        changed = self.rollups.take_changed()
+        if rewrite or self.backend.rollup_rewrite_due:
+            return [], self.rollups.closed_rows()
+        return changed, None
+
+    def _compact(self, state: Dict[str, Any], rollup_changes):
+        """Save the closed rollup buckets, then the snapshot whose open buckets follow them"""
+        if rollup_changes is not None:
+            changed, full = rollup_changes
+            try:
+                self.backend.save_rollups(changed, full)
+            except Exception:
+                with self._lock:
+                    self.rollups.mark_changed(changed if full is None else full)
+                raise
+        self.backend.compact(state)
+
+    def _queue(self, entries: List[Dict[str, Any]]):
+        """Hand applied entries to the persistence path (called with the lock held)"""
+        self._pending.extend(entries)
+        self._flush_wakeup.set()
+
+    def flush(self) -> bool:
+        """
+        Write pending entries to storage with one append, compacting into a new
+        snapshot when the backend asks for it. On failure the entries stay
+        pending and are retried by the next flush. Returns True on success.
+        """
+        with self._flush_lock:
+            with self._lock:
+                entries, self._pending = self._pending, []
+                evicted, self._unarchived = self._unarchived, []
+            if not entries and not evicted:
+                return True
+
+            stats = self.persistence_stats
+            started = time.monotonic()
+            try:
+                if entries:
+                    self.backend.append(entries)
+            except Exception as e:
+                with self._lock:
+                    self._pending[:0] = entries
+                    self._unarchived[:0] = evicted
+                stats["flush_errors"] += 1
+                STORAGE_WRITE_ERRORS.labels("append").inc()
+                logger.error("⚠️ Error writing %d entries to storage, will retry: %s", len(entries), e)
+                return False
+            stats["flushes"] += 1
+            stats["last_flush_entries"] = len(entries)
+            stats["last_flush_seconds"] = time.monotonic() - started
+            STORAGE_WRITE_SECONDS.labels("append").observe(stats["last_flush_seconds"])
+
+            if evicted:
+                try:
+                    with STORAGE_WRITE_SECONDS.labels("archive").time():
+                        self.backend.archive(evicted)
+                except Exception as e:
+                    with self._lock:
+                        self._unarchived[:0] = evicted
+                    stats["flush_errors"] += 1
+                    STORAGE_WRITE_ERRORS.labels("archive").inc()
+                    logger.error("⚠️ Error archiving %d evicted readings, will retry: %s", len(evicted), e)
+                    # A snapshot now would drop them from the log before they are archived
+                    return False
+
+            if self.backend.needs_compaction():
+                with self._lock:
+                    state = self._snapshot()
+                    rollup_changes = self._take_rollup_changes()
+                    # The snapshot already covers changes still pending; don't log them too
+                    covered, self._pending = self._pending, []
+                started = time.monotonic()
+                try:
+                    self._compact(state, rollup_changes)
+                    stats["last_compaction_seconds"] = time.monotonic() - started
+                    STORAGE_WRITE_SECONDS.labels("compact").observe(stats["last_compaction_seconds"])
+                except Exception as e:
+                    with self._lock:
+                        self._pending[:0] = covered
+                    stats["flush_errors"] += 1
+                    STORAGE_WRITE_ERRORS.labels("compact").inc()
+                    logger.error("⚠️ Error saving data snapshot: %s", e)
+            return True
+
+    @property
+    def dirty_count(self) -> int:
+        """Entries applied in memory but not yet persisted"""
+        return len(self._pending)
+
+    def _persist_loop(self):
+        """Background writer: coalesce changes for ``flush_interval`` seconds, then flush"""
+        while True:
+            self._flush_wakeup.wait()
+            time.sleep(self.flush_interval)
+            self._flush_wakeup.clear()
+            if not self.flush():
+                # Storage is failing; back off before retrying
+                time.sleep(max(1.0, self.flush_interval))
+                self._flush_wakeup.set()
+
+    def _start_persister(self):
+        if self.flush_interval <= 0 or self._persister is not None:
+            return
+        self._persister = threading.Thread(target=self._persist_loop, daemon=True,
+                                           name="persister")
+        self._persister.start()
+        # Write whatever is still pending when the process exits cleanly
+        atexit.register(self.flush)
+
+    def _refresh(self):
+        """Pick up readings persisted by the writer process (followers only)"""
+        if not self.follower or not self._ready.is_set():
+            return
+        now = time.monotonic()
+        if now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+        with self._lock:
+            snapshot, entries = self.backend.poll()
+            if snapshot is not None:
+                self._restore(snapshot)
+            for entry in entries:
+                self._replay(entry)
+            if self._unarchived:
+                # The writer archives what it evicts; keep only what it has not yet
+                archived_upto = self.backend.archived_upto
+                self._unarchived = [item for item in self._unarchived if item[0] > archived_upto]
+
+    def _require_writer(self):
+        if self.follower:
+            raise RuntimeError("DataStore is read-only in this process; another process is the writer")
+
+    def try_become_writer(self) -> bool:
+        """Try to take over as the single writer for this data file"""
+        if not self._ready.is_set():
+            # Writing before the full history is loaded would lose it
+            return False
+        if not self.follower:
+            return True
+        if not self._writer_lock.try_acquire():
+            return False
+        with self._lock:
+            # Catch up with everything the previous writer persisted
+            self._last_refresh = 0.0
+            self._refresh()
+            self.backend.prepare_for_writing()
+            self.follower = False
+        self._start_persister()
+        return True
+
+    @property
+    def is_writer(self) -> bool:
+        return not self.follower
+
+    @property
+    def version(self) -> int:
+        """Counter that changes whenever the stored data changes"""
+        self._refresh()
+        return self._version
 
     def add_reading(self, reading: Dict[str, Any]):
         """Add a new sensor reading"""
+        self._require_writer()
+        with ADD_SECONDS.labels("add_reading").time(), self._lock:
+            alerts = self._check_alerts(reading)
+            seq = self._apply(reading, alerts)
+            # Persisted as a single log append; folded into a snapshot periodically
+            self._queue([{"seq": seq, "reading": reading, "alerts": alerts}])
+        READINGS_ADDED.inc()
+        self._count_alerts(alerts)
+        if self._persister is None:
+            self.flush()
+
+    def add_readings(self, readings: List[Dict[str, Any]], wait: bool = False) -> List[Dict[str, Any]]:
+        """
+        Add a batch of sensor readings with a single storage append.
+        Returns the alerts the batch raised.
+
+        With ``wait=True`` it returns only once the batch is written to
+        storage, even with a background persister, and raises IOError when
+        the write fails (the batch stays pending and is retried).
+        """
+        self._require_writer()
+        with ADD_SECONDS.labels("add_readings").time(), self._lock:
+            entries = []
+            raised = []
+            for reading, alerts in zip(readings, self.rules.evaluate_batch(readings)):
+                alerts = alerts + self.anomalies.update(reading)
+                seq = self._apply(reading, alerts)
+                entries.append({"seq": seq, "reading": reading, "alerts": alerts})
+                raised.extend(alerts)
+            self._queue(entries)
+        READINGS_ADDED.inc(len(readings))
+        self._count_alerts(raised)
+        if self._persister is None or wait:
+            if not self.flush() and wait:
+                raise IOError(f"Could not write {len(readings)} readings to storage")
+        return raised
+
+    @staticmethod
+    def _count_alerts(alerts: List[Dict[str, Any]]):
+        for alert in alerts:
+            ALERTS_FIRED.labels(alert["level"], alert.get("type")).inc()
+
+    def _apply(self, reading: Dict[str, Any], alerts: List[Dict[str, Any]]) -> int:
+        """Apply a reading and its alerts to the in-memory data; returns its sequence number"""
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
         # Update latest reading
         self.data["latest_reading"] = reading
 
-        # Add to historical readings (keep last 1000 readings)
-        self.data["historical_readings"].append(reading)
-        if len(self.data["historical_readings"]) > 1000:
-            self.data["historical_readings"] = self.data["historical_readings"][-1000:]
-
-        # Check for alerts
-        self._check_alerts(reading)
-
-        # Save to file
-        self._save_data()
-
-    def _check_alerts(self, reading: Dict[str, Any]):
-        """Check reading for alert conditions"""
-        data = reading["data"]
-        timestamp = reading["timestamp"]
-        alerts = []
-
-        # Critical alerts
-        if data["e_coli_ctu_100ml"] > 100:
-            alerts.append({
-                "level": "critical",
-                "type": "biological",
-                "message": f"High E.coli levels detected: {data['e_coli_ctu_100ml']} CFU/100mL"
-            })
-
-        if data["turbidity_ntu"] > 30:
-            alerts.append({
-                "level": "critical",
-                "type": "physical",
-                "message": f"Critical turbidity levels: {data['turbidity_ntu']} NTU"
-            })
-
-        if data["ph"] < 5 or data["ph"] > 9:
-            alerts.append({
-                "level": "critical",
-                "type": "chemical",
-                "message": f"pH out of safe range: {data['ph']}"
-            })
-
-        if data["total_coliforms_ctu_100ml"] > 50:
-            alerts.append({
-                "level": "critical",
-                "type": "biological",
-                "message": f"High total coliforms: {data['total_coliforms_ctu_100ml']} CFU/100mL"
-            })
-
-        # Warning alerts
-        if data["turbidity_ntu"] > 10 and data["turbidity_ntu"] <= 30:
-            alerts.append({
-                "level": "warning",
-                "type": "physical",
-                "message": f"Elevated turbidity: {data['turbidity_ntu']} NTU"
-            })
-
-        if data["residual_chlorine_mg_l"] < 0.2:
-            alerts.append({
-                "level": "warning",
-                "type": "chemical",
-                "message": f"Low residual chlorine: {data['residual_chlorine_mg_l']} mg/L"
-            })
-
-        if data["ph"] < 6.5 or data["ph"] > 8.5:
-            alerts.append({
-                "level": "warning",
-                "type": "chemical",
-                "message": f"pH outside optimal range: {data['ph']}"
-            })
-
-        if data["iron_fe_mg_l"] > 0.3:
-            alerts.append({
-                "level": "warning",
-                "type": "chemical",
-                "message": f"High iron content: {data['iron_fe_mg_l']} mg/L"
-            })
-
-        if data["manganese_mn_mg_l"] > 0.1:
-            alerts.append({
-                "level": "warning",
-                "type": "chemical",
-                "message": f"Elevated manganese: {data['manganese_mn_mg_l']} mg/L"
-            })
-
-        if data["ammonia_nh3_mg_l"] > 0.5:
-            alerts.append({
-                "level": "warning",
-                "type": "chemical",
-                "message": f"High ammonia levels: {data['ammonia_nh3_mg_l']} mg/L"
-            })
-
-        # Add alerts with timestamp and location
-        for alert in alerts:
-            alert["timestamp"] = timestamp
-            alert["location"] = reading["location"]
-            self.data["alerts"].append(alert)
+        seq = self._add_to_history(reading)
+        self._add_to_rollups(seq, reading["data"])
+
+        self.alerts.add(seq, alerts)
+        self.summary.update(reading, alerts)
+        return seq
+
+    def _replay(self, entry: Dict[str, Any]):
+        """Apply a stored log entry; its alerts were already evaluated by the writer"""
+        self.anomalies.update(entry["reading"])
+        self._apply(entry["reading"], entry.get("alerts", []))
 
-        # Keep last 100 alerts
-        if len(self.data["alerts"]) > 100:
-            self.data["alerts"] = self.data["alerts"][-100:]
+    def _add_to_rollups(self, seq: int, data: Dict[str, Any]):
+        """Fold a stored reading into the rollup buckets"""
+        _, _, location = self.history.source(seq)
+        self.rollups.add(location, self.history.timestamp_micros(seq), data)
+
+    def _add_to_history(self, reading: Dict[str, Any]) -> int:
+        """Append a reading to the history buffer and its indexes"""
+        history = self.history
+        evicted_source = None
+        if len(history) == history.capacity:
+            evicted_source = history.source(history.start_seq)
+            if self._archives:
+                self._unarchived.append((history.start_seq, history.get(history.start_seq)))
+
+        # Oldest reading is overwritten once the buffer is full
+        seq, _ = history.append(reading)
+        timestamp = history.timestamp_micros(seq)
+        location = reading["location"]
+        self._by_time.add(timestamp, seq)
+        self._by_location.setdefault(location, TimeIndex()).add(timestamp, seq)
+        self._by_scenario.setdefault(reading.get("scenario"), TimeIndex()).add(timestamp, seq)
+
+        latest = self._latest_by_location.get(location)
+        if latest is None or latest["timestamp"] <= reading["timestamp"]:
+            self._latest_by_location[location] = reading
+
+        if evicted_source is not None:
+            scenario, _, old_location = evicted_source
+            self._by_time.prune(history.start_seq)
+            self._by_location[old_location].prune(history.start_seq)
+            self._by_scenario[scenario].prune(history.start_seq)
+        return seq
+
+    def _check_alerts(self, reading: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Check reading for threshold alerts and departures from its location's baseline"""
+        return self.rules.evaluate(reading) + self.anomalies.update(reading)
 
     def get_latest_reading(self) -> Optional[Dict[str, Any]]:
         """Get the most recent sensor reading"""
+        self._refresh()
         return self.data["latest_reading"]
 
     def get_historical_readings(self, limit: int = 100) -> List[Dict[str, Any]]:
         """Get historical readings with optional limit"""
-        readings = self.data["historical_readings"]
-        return readings[-limit:] if limit else readings
+        self._refresh()
+        if hasattr(self.backend, "query_archive") and (not limit or limit > len(self.history)):
+            return self.query_readings(limit=limit)[0]
+        with self._lock:
+            return self.history.latest(limit)
+
+    def query_readings(self, since: Optional[str] = None, until: Optional[str] = None,
+                       location: Optional[str] = None, params: Optional[List[str]] = None,
+                       limit: int = 100, cursor: Optional[str] = None):
+        """
+        Query readings by time range and location, newest page first.
+
+        ``since``/``until`` are ISO timestamps (``until`` exclusive), ``params``
+        projects each reading onto a subset of parameters. Returns the page of
+        readings (oldest first) and a cursor for the next, older page, or None
+        when there is nothing further. Raises ValueError for bad arguments.
+        """
+        since_micros = timestamp_to_micros(since) if since else None
+        until_micros = timestamp_to_micros(until) if until else None
+        before = None
+        if cursor:
+            try:
+                cursor_ts, cursor_seq = cursor.split(":")
+                before = (int(cursor_ts), int(cursor_seq))
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+        if params is not None:
+            unknown = [p for p in params if p not in self.history.parameters]
+            if unknown:
+                raise ValueError(f"Unknown parameters: {', '.join(unknown)}")
+
+        self._refresh()
+        with self._lock:
+            index = self._by_time if location is None else self._by_location.get(location)
+            page, more = [], False
+            if index is not None:
+                seqs, more = index.page(self.history.start_seq, since_micros, until_micros,
+                                        limit, before)
+                page = [(self.history.timestamp_micros(seq), seq, self.history.get(seq, params))
+                        for seq in seqs]
+            evicted_below = self.history.start_seq
+            buffered = self._buffered(since_micros, until_micros, location, params, before)
+
+        archive = getattr(self.backend, "query_archive", None)
+        if archive is not None and evicted_below > 0:
+            # Readings evicted from memory are still on disk; merge both tiers
+            cold, cold_more = archive(evicted_below, since_micros, until_micros, location,
+                                      params, limit, before)
+            archived = {seq for _, seq, _ in cold}
+            cold += [row for row in buffered if row[1] not in archived]
+            page = sorted(page + cold, key=lambda item: item[:2])
+            if limit and len(page) > limit:
+                page = page[-limit:]
+                more = True
+            else:
+                more = more or cold_more
+
+        next_cursor = f"{page[0][0]}:{page[0][1]}" if more and page else None
+        return [reading for _, _, reading in page], next_cursor
+
+    def iter_readings(self, since: Optional[str] = None, until: Optional[str] = None,
+                      location: Optional[str] = None, params: Optional[List[str]] = None,
+                      chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        Stream every stored reading in a time range, oldest first, for exports.
+
+        Readings are fetched ``chunk_size`` at a time and the lock is only
+        held per chunk, so memory stays bounded however many readings match
+        and writes carry on meanwhile. Readings still in memory are merged
+        with older ones kept by the backend (``iter_archive``). Arguments are
+        validated before the first reading is produced; raises ValueError.
+        """
+        since_micros = timestamp_to_micros(since) if since else None
+        until_micros = timestamp_to_micros(until) if until else None
+        if params is not None:
+            unknown = [p for p in params if p not in self.history.parameters]
+            if unknown:
+                raise ValueError(f"Unknown parameters: {', '.join(unknown)}")
+
+        self._refresh()
+        with self._lock:
+            index = self._by_time if location is None else self._by_location.get(location)
+            # Only the sequence numbers are collected up front; readings are built per chunk
+            seqs = index.seqs(self.history.start_seq, since_micros, until_micros) if index is not None else []
+            evicted_below = self.history.start_seq
+            buffered = self._buffered(since_micros, until_micros, location, params)
+
+        def in_memory():
+            get_readings = getattr(self.backend, "get_readings", None)
+            for i in range(0, len(seqs), chunk_size):
+                chunk = seqs[i:i + chunk_size]
+                with self._lock:
+                    page = [(self.history.timestamp_micros(seq), seq, self.history.get(seq, params))
+                            for seq in chunk if seq in self.history]
+                if len(page) < len(chunk) and get_readings is not None:
+                    # Evicted from memory since the export started; read them back from storage
+                    found = {seq for _, seq, _ in page}
+                    stored = get_readings([seq for seq in chunk if seq not in found], params)
+                    page = sorted(page + [(timestamp_to_micros(r["timestamp"]), seq, r)
+                                          for seq, r in stored.items()], key=lambda item: item[:2])
+                yield from page
+
+        streams = [in_memory()]
+        archive = getattr(self.backend, "iter_archive", None)
+        if archive is not None and evicted_below > 0:
+            streams.insert(0, archive(evicted_below, since_micros, until_micros, location,
+                                      params, chunk_size))
+            streams.insert(1, iter(buffered))
+
+        def generate():
+            last_seq = None
+            for _, seq, reading in heapq.merge(*streams, key=lambda item: item[:2]):
+                # A buffered reading may have been archived since the export started
+                if seq != last_seq:
+                    yield reading
+                last_seq = seq
+
+        return generate()
+
+    def _buffered(self, since: Optional[int], until: Optional[int], location: Optional[str],
+                  params: Optional[List[str]], before: Optional[Tuple[int, int]] = None
+                  ) -> List[Tuple[int, int, Dict[str, Any]]]:
+        """Evicted readings not yet archived that match a query (called with the lock held)"""
+        rows = []
+        for seq, reading in self._unarchived:
+            ts = timestamp_to_micros(reading["timestamp"])
+            if ((since is None or ts >= since) and (until is None or ts < until)
+                    and (location is None or reading["location"] == location)
+                    and (before is None or (ts, seq) < before)):
+                if params is not None:
+                    reading = {**reading, "data": {k: v for k, v in reading["data"].items() if k in params}}
+                rows.append((ts, seq, reading))
+        return sorted(rows, key=lambda row: row[:2])
+
+    def get_aggregates(self, resolution: str = "1h", location: Optional[str] = None,
+                       since: Optional[str] = None, until: Optional[str] = None,
+                       params: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Get min/max/mean/count/p95 buckets per location at the given
+        resolution ("1m", "1h" or "1d"). Raises ValueError for bad arguments.
+        """
+        since_micros = timestamp_to_micros(since) if since else None
+        until_micros = timestamp_to_micros(until) if until else None
+        self._refresh()
+        with self._lock:
+            return self.rollups.query(resolution, location, since_micros, until_micros, params)
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """
+        Block until the data version differs from ``version`` or ``timeout``
+        seconds pass; returns the current version. Followers are only woken
+        by the timeout, after which they catch up from storage.
+        """
+        if self.follower:
+            timeout = min(timeout, self.refresh_interval)
+        with self._changed:
+            if self._version == version:
+                self._changed.wait(timeout)
+        return self.version
+
+    def get_events_since(self, seq: int, location: Optional[str] = None,
+                         levels: Optional[set] = None, kinds: Optional[set] = None,
+                         limit: int = 500):
+        """
+        Get reading and alert events for readings newer than ``seq``.
+
+        Events are ``(seq, kind, payload)`` tuples with kind "reading" or
+        "alert"; alerts carry the sequence number of the reading that raised
+        them. Events are replayed from the history buffer, so anything older
+        than the buffer is skipped. Returns the events and the last sequence
+        number examined, to pass back in as ``seq`` next time.
+        """
+        self._refresh()
+        with self._lock:
+            history = self.history
+            seq = min(seq, history.next_seq - 1)
+            start = max(seq + 1, history.start_seq)
+            stop = min(history.next_seq, start + limit)
+            want_readings = kinds is None or "reading" in kinds
+            want_alerts = kinds is None or "alert" in kinds
+
+            events = []
+            for s in range(start, stop):
+                _, _, reading_location = history.source(s)
+                if location is not None and reading_location != location:
+                    continue
+                reading = history.get(s)
+                if want_readings:
+                    events.append((s, "reading", reading))
+                for alert in self.alerts.for_seq(s) if want_alerts else ():
+                    if levels is None or alert["level"] in levels:
+                        events.append((s, "alert", alert))
+            return events, max(seq, stop - 1)
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest stored reading (-1 when empty)"""
+        self._refresh()
+        return self.history.next_seq - 1
+
+    def get_latest_by_location(self) -> Dict[str, Dict[str, Any]]:
+        """Get the most recent reading for every location"""
+        self._refresh()
+        with self._lock:
+            return dict(self._latest_by_location)
+
+    def get_location_history(self, location: str, limit: int = 100) -> Optional[List[Dict[str, Any]]]:
+        """Get the most recent readings for one location, or None if it is unknown"""
+        if hasattr(self.backend, "query_archive"):
+            readings, _ = self.query_readings(location=location, limit=limit)
+            return readings or None
+        return self._indexed_history(self._by_location, location, limit)
+
+    def get_scenario_history(self, scenario: str, limit: int = 100) -> Optional[List[Dict[str, Any]]]:
+        """Get the most recent readings for one scenario, or None if it is unknown"""
+        return self._indexed_history(self._by_scenario, scenario, limit)
+
+    def _indexed_history(self, indexes: Dict[str, TimeIndex], key: str,
+                         limit: int) -> Optional[List[Dict[str, Any]]]:
+        self._refresh()
+        with self._lock:
+            index = indexes.get(key)
+            if index is None:
+                return None
+            return [self.history.get(seq) for seq in index.seqs(self.history.start_seq, limit=limit)]
+
+    def get_summary(self) -> Dict[str, Any]:
+        """Status of every location: latest values, water quality index, active alerts and trends"""
+        self._refresh()
+        with self._lock:
+            locations = self.summary.entries()
+        return {
+            "locations": locations,
+            "count": len(locations),
+            "timestamp": max((entry["last_reading"] for entry in locations), default=None)
+        }
 
     def get_alerts(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get recent alerts with optional limit"""
-        alerts = self.data["alerts"]
-        return alerts[-limit:] if limit else alerts
+        """Get the most recent alerts, oldest first"""
+        alerts, _ = self.query_alerts(limit=limit)
+        return alerts
+
+    def query_alerts(self, level: Optional[str] = None, location: Optional[str] = None,
+                     alert_type: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None, limit: int = 10,
+                     cursor: Optional[str] = None):
+        """
+        Query alerts by level, location, type and time range, newest page first.
+
+        ``since``/``until`` are ISO timestamps (``until`` exclusive). Returns
+        the page of alerts (oldest first) and a cursor for the next, older
+        page, or None when there is nothing further. A page holds at least
+        ``limit`` alerts when that many match, and never splits the alerts of
+        one reading. Raises ValueError for bad arguments.
+        """
+        since_micros = timestamp_to_micros(since) if since else None
+        until_micros = timestamp_to_micros(until) if until else None
+        before = None
+        if cursor:
+            try:
+                cursor_ts, cursor_seq = cursor.split(":")
+                before = (int(cursor_ts), int(cursor_seq))
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+        if limit <= 0:
+            raise ValueError(f"Invalid limit: {limit}")
+
+        archive = getattr(self.backend, "query_alerts", None)
+        self._refresh()
+        with self._lock:
+            # Below the horizon memory may be missing alerts the database still has
+            horizon = self.alerts.horizon(level) if archive is not None else None
+            page, more = self.alerts.page(level, location, alert_type, since_micros,
+                                          until_micros, limit, before, horizon)
+
+        if horizon is not None and not more:
+            # Alerts evicted from memory are still on disk; the two tiers
+            # meet at the horizon, so the older page goes first
+            cold, more = archive(max(limit - len(page), 1), level, location, alert_type,
+                                 since_micros, until_micros, before, horizon)
+            if len(page) < limit:
+                page = cold + page
+            else:
+                more = bool(cold)
+
+        next_cursor = f"{page[0][0]}:{page[0][1]}" if more and page else None
+        return [alert for _, _, alert in page], next_cursor
 
     def clear_data(self):
         """Clear all stored data"""
-        self.data = {
-            "latest_reading": None,
-            "historical_readings": [],
-            "alerts": []
-        }
-        self._save_data()
+        self._require_writer()
+        with self._flush_lock, self._lock:
+            self._pending = []
+            self._unarchived = []
+            self.data = {
+                "latest_reading": None
+            }
+            self.alerts.clear()
+            self.history.reset(self.history.next_seq)
+            self._by_time = TimeIndex()
+            self._by_location = {}
+            self._by_scenario = {}
+            self._latest_by_location = {}
+            self.rollups.clear()
+            self.rules.reset_state()
+            self.anomalies.reset()
+            self.summary.reset()
+            if hasattr(self.backend, "clear"):
+                self.backend.clear()
+            self._version += 1
+            self._save_data()
 
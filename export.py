@@ -0,0 +1,199 @@
+"""
+Streaming export of stored readings to CSV, NDJSON or Parquet
+"""
+
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Any, Sequence
+
+from water_sensor_simulator import WaterSensorSimulator
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional; CSV and NDJSON are always available
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+# format -> (content type, file extension)
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+SOURCE_COLUMNS = ("timestamp", "location", "scenario", "name")
+
+# Readings encoded per yielded chunk (per row group for Parquet)
+DEFAULT_ROWS_PER_CHUNK = 1000
+
+
+def export_chunks(readings: Iterable[Dict[str, Any]], fmt: str, params: Sequence[str],
+                  rows_per_chunk: int = DEFAULT_ROWS_PER_CHUNK) -> Iterator[bytes]:
+    """
+    Encode ``readings`` as ``fmt``, yielding bytes every ``rows_per_chunk``
+    readings, so memory does not grow with the export. ``params`` are the
+    parameter columns of the CSV and Parquet output. Raises ValueError for an
+    unknown format, or Parquet without ``pyarrow``, before anything is read.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt} (expected one of {', '.join(FORMATS)})")
+    if fmt == "parquet" and pa is None:
+        raise ValueError("Parquet export needs the pyarrow package")
+    encoder = {"csv": _csv_chunks, "ndjson": _ndjson_chunks, "parquet": _parquet_chunks}[fmt]
+    return encoder(readings, list(params), rows_per_chunk)
+
+
+def _batches(readings: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for reading in readings:
+        batch.append(reading)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv_chunks(readings, params, rows_per_chunk) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(SOURCE_COLUMNS + tuple(params))
+    for batch in _batches(readings, rows_per_chunk):
+        for reading in batch:
+            data = reading["data"]
+            writer.writerow([reading.get(column) for column in SOURCE_COLUMNS] +
+                            [data.get(param) for param in params])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header of an empty export
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _ndjson_chunks(readings, params, rows_per_chunk) -> Iterator[bytes]:
+    for batch in _batches(readings, rows_per_chunk):
+        yield "".join(json.dumps(reading, ensure_ascii=False, separators=(',', ':')) + "\n"
+                      for reading in batch).encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file collecting what ``ParquetWriter`` writes until drained"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_chunks(readings, params, rows_per_chunk) -> Iterator[bytes]:
+    integer = WaterSensorSimulator.INTEGER_PARAMETERS
+    schema = pa.schema(
+        [("timestamp", pa.timestamp("us")), ("location", pa.string()),
+         ("scenario", pa.string()), ("name", pa.string())] +
+        [(param, pa.int64() if param in integer else pa.float64()) for param in params])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        # One row group per batch
+        for batch in _batches(readings, rows_per_chunk):
+            columns = {
+                "timestamp": [datetime.fromisoformat(r["timestamp"]) for r in batch],
+                "location": [r["location"] for r in batch],
+                "scenario": [r.get("scenario") for r in batch],
+                "name": [r.get("name") for r in batch],
+            }
+            for param in params:
+                columns[param] = [r["data"].get(param) for r in batch]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def main():
+    import argparse
+    import os
+    import sys
+    from data_store import DataStore
+    from logging_config import configure_logging
+    from storage import create_backend
+
+    parser = argparse.ArgumentParser(description="Export stored readings as CSV, NDJSON or Parquet")
+    parser.add_argument("--format", choices=list(FORMATS), default="csv", help="Output format (default csv)")
+    parser.add_argument("--from", dest="since", default=None, help="ISO timestamp of the first reading")
+    parser.add_argument("--to", dest="until", default=None, help="ISO timestamp to stop before")
+    parser.add_argument("--location", default=None, help="Only readings from this location")
+    parser.add_argument("--params", default=None, help="Comma-separated parameters to include")
+    parser.add_argument("--output", "-o", default=None, help="Output file (default stdout)")
+    parser.add_argument("--data-file", default="sensor_data.json", help="Data store file")
+    parser.add_argument("--sqlite-file", default=None, help="Read from this SQLite database instead")
+    parser.add_argument("--history-capacity", type=int,
+                        default=int(os.environ.get("HISTORY_CAPACITY", "1000")),
+                        help="Readings the data store keeps in memory (default HISTORY_CAPACITY or 1000)")
+    args = parser.parse_args()
+    configure_logging()
+
+    # Same storage as the server, so readings archived in segments are exported too
+    backend = create_backend(args.data_file, args.history_capacity, args.sqlite_file)
+    # Read-only: exporting never takes the writer role
+    store = DataStore(args.data_file, backend=backend, follower=True,
+                      history_capacity=args.history_capacity)
+    params = [p.strip() for p in args.params.split(",") if p.strip()] if args.params else None
+    exported = 0
+
+    def counted(readings):
+        nonlocal exported
+        for reading in readings:
+            exported += 1
+            yield reading
+
+    try:
+        readings = store.iter_readings(args.since, args.until, args.location, params)
+        chunks = export_chunks(counted(readings), args.format, params or store.history.parameters)
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    logger.info("📤 Exported %d readings as %s", exported, args.format)
+
+
+if __name__ == '__main__':
+    main()
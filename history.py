@@ -0,0 +1,255 @@
+"""
+Compact, columnar ring buffer for historical sensor readings
+"""
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+
+from water_sensor_simulator import WaterSensorSimulator
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_NAN = float("nan")
+
+
+def timestamp_to_micros(timestamp: str) -> int:
+    """Convert an ISO timestamp to integer microseconds (local wall-clock time)"""
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def micros_to_timestamp(micros: int) -> str:
+    """Convert integer microseconds back to the ISO timestamp format readings use"""
+    return (_EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+class ReadingHistory:
+    """
+    Fixed-capacity ring buffer holding readings column by column.
+
+    Each parameter is stored in its own preallocated ``array('d')``, timestamps
+    as integer microseconds, and the repeated scenario/name/location strings
+    are interned into a small table referenced by index. Every reading gets a
+    monotonically increasing sequence number; dicts are only rebuilt when a
+    caller asks for them.
+    """
+
+    def __init__(self, capacity: int = 1000,
+                 parameters: Tuple[str, ...] = WaterSensorSimulator.PARAMETERS,
+                 integer_parameters=WaterSensorSimulator.INTEGER_PARAMETERS):
+        if capacity <= 0:
+            raise ValueError("History capacity must be positive")
+        self.capacity = capacity
+        self.parameters = tuple(parameters)
+        self._integer = frozenset(integer_parameters)
+        self._columns = {p: array('d', [_NAN]) * capacity for p in self.parameters}
+        self._timestamps = array('q', [0]) * capacity
+        self._sources = array('I', [0]) * capacity
+        self._source_table: List[Tuple[str, str, str]] = []
+        self._source_ids: Dict[Tuple[str, str, str], int] = {}
+        # Parameters outside the known schema, kept per sequence number
+        self._extras: Dict[int, Dict[str, Any]] = {}
+        self.start_seq = 0
+        self.next_seq = 0
+
+    def __len__(self) -> int:
+        return self.next_seq - self.start_seq
+
+    def reset(self, start_seq: int = 0):
+        """Drop all readings; numbering continues from ``start_seq``"""
+        self._extras.clear()
+        self.start_seq = start_seq
+        self.next_seq = start_seq
+
+    def _intern(self, reading: Dict[str, Any]) -> int:
+        key = (reading.get("scenario"), reading.get("name"), reading["location"])
+        source_id = self._source_ids.get(key)
+        if source_id is None:
+            source_id = len(self._source_table)
+            self._source_table.append(key)
+            self._source_ids[key] = source_id
+        return source_id
+
+    def append(self, reading: Dict[str, Any]) -> Tuple[int, Optional[int]]:
+        """Store a reading; returns its sequence number and the evicted one, if any"""
+        seq = self.next_seq
+        evicted = None
+        if len(self) == self.capacity:
+            evicted = self.start_seq
+            self.start_seq += 1
+            self._extras.pop(evicted, None)
+
+        slot = seq % self.capacity
+        data = reading["data"]
+        stored = 0
+        for param, column in self._columns.items():
+            value = data.get(param)
+            if value is None:
+                column[slot] = _NAN
+            else:
+                column[slot] = value
+                stored += 1
+        if stored != len(data):
+            extras = {k: v for k, v in data.items() if k not in self._columns}
+            if extras:
+                self._extras[seq] = extras
+        self._timestamps[slot] = timestamp_to_micros(reading["timestamp"])
+        self._sources[slot] = self._intern(reading)
+        self.next_seq = seq + 1
+        return seq, evicted
+
+    def __contains__(self, seq: int) -> bool:
+        return self.start_seq <= seq < self.next_seq
+
+    def timestamp_micros(self, seq: int) -> int:
+        """Timestamp of a stored reading, in microseconds"""
+        return self._timestamps[seq % self.capacity]
+
+    def source(self, seq: int) -> Tuple[str, str, str]:
+        """(scenario, name, location) of a stored reading"""
+        return self._source_table[self._sources[seq % self.capacity]]
+
+    def value(self, seq: int, param: str) -> Optional[float]:
+        """A single parameter of a stored reading, or None if it was not reported"""
+        value = self._columns[param][seq % self.capacity]
+        if math.isnan(value):
+            return None
+        return int(value) if param in self._integer else value
+
+    def get(self, seq: int, params: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Materialize a stored reading as a dict, optionally only some parameters"""
+        if seq not in self:
+            raise KeyError(seq)
+        slot = seq % self.capacity
+        scenario, name, location = self._source_table[self._sources[slot]]
+        data = {}
+        for param in (self.parameters if params is None else params):
+            column = self._columns.get(param)
+            if column is None:
+                continue
+            value = column[slot]
+            if value != value:  # NaN: not reported
+                continue
+            data[param] = int(value) if param in self._integer else value
+        extras = self._extras.get(seq)
+        if extras:
+            data.update(extras if params is None else {k: v for k, v in extras.items() if k in params})
+        return {
+            'scenario': scenario,
+            'name': name,
+            'location': location,
+            'timestamp': micros_to_timestamp(self._timestamps[slot]),
+            'data': data
+        }
+
+    def iter_seqs(self, start: Optional[int] = None, stop: Optional[int] = None) -> Iterator[int]:
+        """Sequence numbers of stored readings, oldest first"""
+        start = self.start_seq if start is None else max(start, self.start_seq)
+        stop = self.next_seq if stop is None else min(stop, self.next_seq)
+        return iter(range(start, stop))
+
+    def latest(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """The most recent ``limit`` readings (all if falsy), oldest first"""
+        start = self.next_seq - limit if limit else None
+        return [self.get(seq) for seq in self.iter_seqs(start)]
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """All stored readings as dicts, oldest first"""
+        return self.latest()
+
+
+class TimeIndex:
+    """
+    Sequence numbers of one group of readings (e.g. a location), ordered by
+    timestamp.
+
+    Readings normally arrive in time order, so adding is an append; late
+    readings are inserted with a binary search. Entries that have been
+    evicted from the history buffer are dropped lazily from the front.
+    """
+
+    __slots__ = ("_keys", "_seqs", "_start")
+
+    def __init__(self):
+        self._keys = array('q')
+        self._seqs = array('q')
+        self._start = 0
+
+    def __len__(self) -> int:
+        return len(self._seqs) - self._start
+
+    def add(self, timestamp_micros: int, seq: int):
+        """Index a reading by its timestamp"""
+        keys = self._keys
+        if len(keys) == self._start or timestamp_micros >= keys[-1]:
+            keys.append(timestamp_micros)
+            self._seqs.append(seq)
+        else:
+            i = bisect_right(keys, timestamp_micros, self._start)
+            keys.insert(i, timestamp_micros)
+            self._seqs.insert(i, seq)
+
+    def prune(self, min_seq: int):
+        """Forget leading entries older than ``min_seq`` (evicted from history)"""
+        seqs = self._seqs
+        start = self._start
+        while start < len(seqs) and seqs[start] < min_seq:
+            start += 1
+        if start > 1024 and start * 2 > len(seqs):
+            del self._keys[:start]
+            del seqs[:start]
+            start = 0
+        self._start = start
+
+    def latest_seq(self, min_seq: int) -> Optional[int]:
+        """Sequence number of the newest live entry"""
+        for i in range(len(self._seqs) - 1, self._start - 1, -1):
+            if self._seqs[i] >= min_seq:
+                return self._seqs[i]
+        return None
+
+    def seqs(self, min_seq: int, since: Optional[int] = None, until: Optional[int] = None,
+             limit: Optional[int] = None) -> List[int]:
+        """
+        Live sequence numbers with ``since <= timestamp < until``, oldest first.
+
+        With ``limit`` only the newest ``limit`` matches are returned.
+        """
+        return self.page(min_seq, since, until, limit)[0]
+
+    def page(self, min_seq: int, since: Optional[int] = None, until: Optional[int] = None,
+             limit: Optional[int] = None,
+             before: Optional[Tuple[int, int]] = None) -> Tuple[List[int], bool]:
+        """
+        Newest-first page of live sequence numbers, returned oldest first.
+
+        ``before`` is a ``(timestamp, seq)`` position from a previous page;
+        only entries strictly older than it are returned. The flag tells
+        whether older matches remain beyond this page.
+        """
+        keys = self._keys
+        seqs = self._seqs
+        lo = self._start if since is None else bisect_left(keys, since, self._start)
+        hi = len(keys) if until is None else bisect_left(keys, until, lo)
+        if before is not None:
+            before_ts, before_seq = before
+            hi = min(hi, bisect_right(keys, before_ts, lo))
+            # Entries sharing the cursor timestamp sort by insertion order
+            while hi > lo and keys[hi - 1] == before_ts and seqs[hi - 1] >= before_seq:
+                hi -= 1
+        result = []
+        i = hi - 1
+        while i >= lo:
+            if seqs[i] >= min_seq:
+                if limit and len(result) == limit:
+                    break
+                result.append(seqs[i])
+            i -= 1
+        more = any(seqs[j] >= min_seq for j in range(i, lo - 1, -1)) if i >= lo else False
+        result.reverse()
+        return result, more
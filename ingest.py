@@ -0,0 +1,186 @@
+"""
+Validation and spooling of readings uploaded in bulk by sensor gateways
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+
+from history import micros_to_timestamp, timestamp_to_micros
+from water_sensor_simulator import WaterSensorSimulator
+
+logger = logging.getLogger(__name__)
+
+
+class ReadingSchema:
+    """
+    Validator for readings in the ``generate_reading`` format, compiled once
+    from the simulator's parameter set.
+
+    Parameters may be a subset of the known ones (a gateway may lack some
+    probes) but unknown parameters, non-numeric or non-finite values, and
+    values outside physical limits are rejected.
+    """
+
+    # Physical limits; every other parameter is a non-negative quantity
+    LIMITS = {
+        'ph': (0.0, 14.0),
+        'temperature_c': (-10.0, 100.0),
+    }
+
+    def __init__(self, scenarios: Dict[str, Any] = WaterSensorSimulator.SCENARIOS,
+                 integer_parameters=WaterSensorSimulator.INTEGER_PARAMETERS):
+        # param -> (must be integral, low, high)
+        self.checks: Dict[str, Tuple[bool, float, float]] = {}
+        for scenario in scenarios.values():
+            for param in scenario['ranges']:
+                low, high = self.LIMITS.get(param, (0.0, math.inf))
+                self.checks[param] = (param in integer_parameters, low, high)
+
+    def validate(self, item: Any) -> Dict[str, Any]:
+        """Return a normalized copy of a reading, or raise ValueError"""
+        if not isinstance(item, dict):
+            raise ValueError("Reading must be a JSON object")
+
+        location = item.get('location')
+        if not isinstance(location, str) or not location.strip():
+            raise ValueError("'location' must be a non-empty string")
+        for key in ('scenario', 'name'):
+            if item.get(key) is not None and not isinstance(item[key], str):
+                raise ValueError(f"'{key}' must be a string")
+
+        timestamp = item.get('timestamp')
+        if not isinstance(timestamp, str):
+            raise ValueError("'timestamp' must be an ISO 8601 string")
+        try:
+            timestamp = micros_to_timestamp(timestamp_to_micros(timestamp))
+        except (ValueError, OverflowError):
+            # OverflowError: a UTC offset that moves the time outside the year range
+            raise ValueError(f"Invalid timestamp: {timestamp}")
+
+        data = item.get('data')
+        if not isinstance(data, dict) or not data:
+            raise ValueError("'data' must be a non-empty object")
+        checks = self.checks
+        for param, value in data.items():
+            check = checks.get(param)
+            if check is None:
+                raise ValueError(f"Unknown parameter: {param}")
+            integral, low, high = check
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"'{param}' must be a number")
+            if not math.isfinite(value) or not low <= value <= high:
+                raise ValueError(f"'{param}' out of range [{low}, {high}]: {value}")
+            if integral and value != int(value):
+                raise ValueError(f"'{param}' must be an integer")
+
+        return {
+            'scenario': item.get('scenario'),
+            'name': item.get('name') or location,
+            'location': location,
+            'timestamp': timestamp,
+            'data': {param: int(value) if checks[param][0] else value
+                     for param, value in data.items()}
+        }
+
+    def validate_many(self, items: List[Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Split items into valid readings and ``{"index", "error"}`` entries"""
+        readings, errors = [], []
+        for index, item in enumerate(items):
+            if isinstance(item, ParseError):
+                errors.append({"index": index, "error": str(item)})
+                continue
+            try:
+                readings.append(self.validate(item))
+            except ValueError as e:
+                errors.append({"index": index, "error": str(e)})
+        return readings, errors
+
+
+class ParseError(ValueError):
+    """An NDJSON line that is not valid JSON; reported against its index"""
+
+
+def parse_bulk_body(body: bytes, content_type: Optional[str] = None) -> List[Any]:
+    """
+    Decode a bulk upload: a JSON array, or NDJSON (one reading per line).
+
+    A malformed NDJSON line becomes a ``ParseError`` item so the rest of the
+    batch still goes through; a malformed JSON array fails as a whole.
+    """
+    text = body.decode('utf-8')
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    ndjson = mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+    if not ndjson and text.lstrip().startswith('['):
+        items = json.loads(text)
+        if not isinstance(items, list):
+            raise ValueError("Expected a JSON array of readings")
+        return items
+
+    items = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError as e:
+            items.append(ParseError(f"Invalid JSON: {e}"))
+    return items
+
+
+class ReadingInbox:
+    """
+    Directory of validated batches waiting for the writer process.
+
+    Workers that are not the writer spool accepted batches here (written to
+    a temporary name, fsynced and renamed, so the writer never sees a
+    partial file); the writer drains them in arrival order. A batch file is
+    removed only after it has been stored, so a crash in between may ingest
+    it twice but never loses it.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._counter = 0
+
+    def put(self, readings: List[Dict[str, Any]]) -> str:
+        """Spool a batch; returns its name"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._counter += 1
+        name = f"{time.time_ns():020d}-{os.getpid()}-{self._counter}.ndjson"
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + "\n"
+                            for r in readings))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        return name
+
+    def pending(self) -> List[str]:
+        """Names of spooled batches, oldest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(n for n in names if n.endswith('.ndjson') and not n.startswith('.'))
+
+    def drain(self) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Yield ``(name, readings)`` for each spooled batch. The file is deleted
+        when the consumer asks for the next batch (i.e. after storing it).
+        """
+        for name in self.pending():
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    readings = [json.loads(line) for line in f if line.strip()]
+            except (OSError, ValueError) as e:
+                logger.error("⚠️ Skipping unreadable inbox batch %s: %s", name, e)
+                os.replace(path, path + ".bad")
+                continue
+            yield name, readings
+            os.remove(path)
@@ -0,0 +1,106 @@
+"""
+Structured, level-controlled and rate-limited logging setup
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+_STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most ``burst`` records per call site (logger and line) in
+    each ``window`` seconds. Records above the limit are dropped and counted;
+    the next record let through from that call site reports how many were
+    suppressed. Errors and above are never dropped.
+    """
+
+    def __init__(self, burst: int = 10, window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        # (logger, line) -> [window start, records in window, suppressed]
+        self._sites: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.ERROR:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [now, 0, 0]
+            if now - site[0] >= self.window:
+                site[0], site[1] = now, 0
+            if site[1] >= self.burst:
+                site[2] += 1
+                return False
+            site[1] += 1
+            if site[2]:
+                record.suppressed = site[2]
+                site[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any ``extra=`` fields as top-level keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines, noting suppressed repeats"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(process)d] %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" ({suppressed} similar messages suppressed)"
+        return line
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None,
+                      rate_limit: Optional[int] = None):
+    """
+    Configure the root logger once per process from arguments or
+    ``LOG_LEVEL`` (default INFO), ``LOG_FORMAT`` (``text`` or ``json``) and
+    ``LOG_RATE_LIMIT`` (records per call site per minute, 0 for no limit).
+    """
+    root = logging.getLogger()
+    if any(getattr(h, "_water_quality", False) for h in root.handlers):
+        return
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "text")).lower()
+    if rate_limit is None:
+        rate_limit = int(os.environ.get("LOG_RATE_LIMIT", "10"))
+
+    handler = logging.StreamHandler()
+    handler._water_quality = True
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    handler.addFilter(RateLimitFilter(rate_limit))
+    root.addHandler(handler)
+    root.setLevel(level)
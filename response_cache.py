@@ -0,0 +1,61 @@
+"""
+Cache of serialized API responses keyed by the data store version
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class CachedResponse:
+    """Serialized response body with its strong ETag and extra headers"""
+
+    __slots__ = ("version", "body", "etag", "headers")
+
+    def __init__(self, version: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        self.version = version
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.headers = headers or {}
+
+
+class ResponseCache:
+    """
+    Small LRU cache of serialized responses.
+
+    Entries are tagged with the data version they were built from; an entry
+    whose version no longer matches is treated as a miss, so bumping the
+    version invalidates everything at once.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, version: int) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, version: int, body: bytes,
+            headers: Optional[Dict[str, str]] = None) -> CachedResponse:
+        entry = CachedResponse(version, body, headers)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
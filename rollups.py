@@ -0,0 +1,401 @@
+"""
+Incrementally maintained rollups (min/max/mean/count/p95) of sensor readings
+"""
+
+import logging
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+from history import micros_to_timestamp
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+LATE_READINGS = Counter("wq_rollup_late_readings",
+                        "Late readings for already closed rollup buckets, by outcome",
+                        ["outcome"])
+
+# (name, bucket width in seconds, buckets kept per location)
+RESOLUTIONS = (
+    ("1m", 60, 1440),
+    ("1h", 3600, 720),
+    ("1d", 86400, 365),
+)
+
+# Layout of one closed bucket inside a parameter's stats array
+_STATS = ("count", "min", "max", "mean", "p95")
+_STRIDE = len(_STATS)
+_NAN = float("nan")
+# Stats of a bucket in which a parameter was not reported
+_EMPTY = array('d', [0.0] + [_NAN] * (_STRIDE - 1))
+
+# A closed bucket as persisted: (resolution, location, start micros, {param: stats})
+BucketRow = Tuple[str, str, int, Dict[str, List[float]]]
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate in O(1) memory (the P-square algorithm of
+    Jain & Chlamtac). Exact for the first five values.
+    """
+
+    __slots__ = ("p", "count", "q", "n", "dn")
+
+    def __init__(self, p: float = 0.95):
+        self.p = p
+        self.count = 0
+        self.q: List[float] = []
+        self.n = [0, 1, 2, 3, 4]
+        # Desired marker positions are (count - 1) * dn
+        self.dn = (0.0, p / 2, p, (1 + p) / 2, 1.0)
+
+    def add(self, x: float):
+        self.count += 1
+        q = self.q
+        if self.count <= 5:
+            insort(q, x)
+            return
+
+        n = self.n
+        if x < q[0]:
+            q[0] = x
+            first = 1
+        elif x >= q[4]:
+            q[4] = x
+            first = 4
+        else:
+            first = bisect_right(q, x)
+        for i in range(first, 5):
+            n[i] += 1
+
+        scale = self.count - 1
+        dn = self.dn
+        for i in (1, 2, 3):
+            ni = n[i]
+            d = scale * dn[i] - ni
+            if (d >= 1 and n[i + 1] - ni > 1) or (d <= -1 and n[i - 1] - ni < -1):
+                d = 1 if d > 0 else -1
+                qi = q[i]
+                qp = qi + d / (n[i + 1] - n[i - 1]) * (
+                    (ni - n[i - 1] + d) * (q[i + 1] - qi) / (n[i + 1] - ni)
+                    + (n[i + 1] - ni - d) * (qi - q[i - 1]) / (ni - n[i - 1])
+                )
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = qi + d * (q[i + d] - qi) / (n[i + d] - ni)
+                q[i] = qp
+                n[i] = ni + d
+
+    def value(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            # Linear interpolation between the closest ranks
+            pos = self.p * (self.count - 1)
+            lo = int(pos)
+            hi = min(lo + 1, self.count - 1)
+            return self.q[lo] + (self.q[hi] - self.q[lo]) * (pos - lo)
+        return self.q[2]
+
+    def to_list(self) -> list:
+        return [self.count, list(self.q), list(self.n)]
+
+    @classmethod
+    def from_list(cls, state: list, p: float = 0.95) -> "P2Quantile":
+        sketch = cls(p)
+        # Older states also carry the desired positions, now derived from count
+        sketch.count, sketch.q, sketch.n = state[:3]
+        return sketch
+
+
+class _Accumulator:
+    """Running statistics for one parameter in the open bucket"""
+
+    __slots__ = ("count", "min", "max", "total", "sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.total = 0.0
+        self.sketch = P2Quantile(0.95)
+
+    def add(self, value: float):
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total += value
+        self.sketch.add(value)
+
+    def stats(self) -> Tuple[float, float, float, float, float]:
+        return (self.count, self.min, self.max, self.total / self.count, self.sketch.value())
+
+
+class _Series:
+    """Closed buckets of one resolution and location, plus the open bucket"""
+
+    __slots__ = ("width", "retention", "starts", "stats", "open_start", "open", "changed")
+
+    def __init__(self, width: int, retention: int):
+        self.width = width
+        self.retention = retention
+        self.starts = array('q')
+        self.stats: Dict[str, array] = {}
+        self.open_start: Optional[int] = None
+        self.open: Dict[str, _Accumulator] = {}
+        # Starts of closed buckets not yet handed out by take_changed
+        self.changed: Set[int] = set()
+
+    def add(self, timestamp_micros: int, data: Dict[str, Any]):
+        start = timestamp_micros - timestamp_micros % self.width
+        if self.open_start is None or start > self.open_start:
+            self._close()
+            self.open_start = start
+        elif start < self.open_start:
+            self._merge_late(start, data)
+            return
+        for param, value in data.items():
+            if value is None:
+                continue
+            acc = self.open.get(param)
+            if acc is None:
+                acc = self.open[param] = _Accumulator()
+            acc.add(value)
+
+    def _close(self):
+        """Freeze the open bucket into the compact closed-bucket arrays"""
+        if self.open_start is None or not self.open:
+            return
+        index = len(self.starts)
+        self.starts.append(self.open_start)
+        for param, acc in self.open.items():
+            column = self.stats.get(param)
+            if column is None:
+                column = self.stats[param] = _EMPTY * index
+            column.extend(acc.stats())
+        for param, column in self.stats.items():
+            if len(column) < _STRIDE * (index + 1):
+                column.extend(_EMPTY)
+        self.changed.add(self.open_start)
+        self.open = {}
+
+        # Trim in batches so dropping old buckets stays amortized O(1)
+        excess = len(self.starts) - self.retention
+        if excess > max(16, self.retention // 4):
+            del self.starts[:excess]
+            for column in self.stats.values():
+                del column[:_STRIDE * excess]
+
+    def _merge_late(self, start: int, data: Dict[str, Any]):
+        """
+        Fold a late reading into an already closed bucket, creating the bucket
+        when nothing was reported in it yet. Count, min, max and mean stay
+        exact; the p95 estimate is left as it was. Readings older than every
+        retained bucket are dropped and counted.
+        """
+        i = bisect_left(self.starts, start)
+        if i == len(self.starts) or self.starts[i] != start:
+            if i < len(self.starts) + 1 - self.retention:
+                LATE_READINGS.labels("dropped").inc()
+                logger.debug("🕰️ Dropping late reading for %s: older than the %d buckets kept",
+                             micros_to_timestamp(start), self.retention)
+                return
+            self.starts.insert(i, start)
+            for column in self.stats.values():
+                column[i * _STRIDE:i * _STRIDE] = _EMPTY
+            LATE_READINGS.labels("created").inc()
+        else:
+            LATE_READINGS.labels("merged").inc()
+        self.changed.add(start)
+        for param, value in data.items():
+            if value is None:
+                continue
+            column = self.stats.get(param)
+            if column is None:
+                column = self.stats[param] = _EMPTY * len(self.starts)
+            base = i * _STRIDE
+            count = column[base]
+            if count == 0:
+                column[base:base + _STRIDE] = array('d', [1, value, value, value, value])
+                continue
+            column[base] = count + 1
+            column[base + 1] = min(column[base + 1], value)
+            column[base + 2] = max(column[base + 2], value)
+            column[base + 3] += (value - column[base + 3]) / (count + 1)
+
+    def buckets(self, since: Optional[int], until: Optional[int],
+                params: Optional[List[str]]) -> List[Dict[str, Any]]:
+        first = max(0, len(self.starts) - self.retention)
+        lo = first if since is None else max(first, bisect_left(self.starts, since - since % self.width))
+        hi = len(self.starts) if until is None else bisect_left(self.starts, until, lo)
+        names = list(self.stats) if params is None else [p for p in params if p in self.stats]
+        result = []
+        for i in range(lo, hi):
+            base = i * _STRIDE
+            stats = {}
+            for param in names:
+                values = self.stats[param][base:base + _STRIDE]
+                if values[0]:
+                    stats[param] = dict(zip(_STATS, values))
+                    stats[param]["count"] = int(values[0])
+            result.append({"bucket": micros_to_timestamp(self.starts[i]), "stats": stats})
+
+        open_start = self.open_start
+        if (self.open and (since is None or open_start + self.width > since)
+                and (until is None or open_start < until)):
+            stats = {}
+            for param, acc in self.open.items():
+                if params is None or param in params:
+                    stats[param] = dict(zip(_STATS, acc.stats()))
+            result.append({"bucket": micros_to_timestamp(open_start), "stats": stats})
+        return result
+
+    def _row(self, i: int) -> Dict[str, List[float]]:
+        """Stats of closed bucket ``i`` for the parameters it has"""
+        base = i * _STRIDE
+        return {p: c[base:base + _STRIDE].tolist() for p, c in self.stats.items() if c[base]}
+
+    def closed_rows(self) -> List[Tuple[int, Dict[str, List[float]]]]:
+        first = max(0, len(self.starts) - self.retention)
+        return [(self.starts[i], self._row(i)) for i in range(first, len(self.starts))]
+
+    def take_changed(self) -> List[Tuple[int, Dict[str, List[float]]]]:
+        """Closed buckets added or updated since the last call"""
+        first = max(0, len(self.starts) - self.retention)
+        rows = []
+        for start in sorted(self.changed):
+            i = bisect_left(self.starts, start, first)
+            if i < len(self.starts) and self.starts[i] == start:
+                rows.append((start, self._row(i)))
+        self.changed.clear()
+        return rows
+
+    def load_closed(self, rows: List[Tuple[int, Dict[str, List[float]]]]):
+        """Replace the closed buckets with persisted ones, sorted by start"""
+        rows = rows[-self.retention:]
+        self.starts = array('q', (start for start, _ in rows))
+        params = {p for _, stats in rows for p in stats}
+        self.stats = {p: array('d') for p in params}
+        for _, stats in rows:
+            for param, column in self.stats.items():
+                column.extend(array('d', stats[param]) if param in stats else _EMPTY)
+
+    def to_dict(self, closed: bool = True) -> Dict[str, Any]:
+        state = {
+            "open_start": self.open_start,
+            "open": {p: [a.count, a.min, a.max, a.total, a.sketch.to_list()]
+                     for p, a in self.open.items()},
+        }
+        if closed:
+            first = max(0, len(self.starts) - self.retention)
+            state["starts"] = self.starts[first:].tolist()
+            state["stats"] = {p: c[first * _STRIDE:].tolist() for p, c in self.stats.items()}
+        return state
+
+    def load(self, state: Dict[str, Any]):
+        if "starts" in state:
+            self.starts = array('q', state["starts"])
+            self.stats = {p: array('d', values) for p, values in state["stats"].items()}
+            # Not in the incremental store yet
+            self.changed = set(self.starts)
+        self.open_start = state["open_start"]
+        self.open = {}
+        for param, (count, lo, hi, total, sketch) in state["open"].items():
+            acc = _Accumulator()
+            acc.count, acc.min, acc.max, acc.total = count, lo, hi, total
+            acc.sketch = P2Quantile.from_list(sketch)
+            self.open[param] = acc
+
+
+class RollupEngine:
+    """
+    Per-location, per-parameter rollups at 1-minute, 1-hour and 1-day
+    resolution, updated incrementally as readings arrive.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        # Widths are kept in microseconds to match history timestamps
+        self.resolutions = {name: (width * 1_000_000, retention)
+                            for name, width, retention in resolutions}
+        self._series: Dict[str, Dict[str, _Series]] = {name: {} for name in self.resolutions}
+
+    def add(self, location: str, timestamp_micros: int, data: Dict[str, Any]):
+        """Fold one reading into every resolution"""
+        for name, (width, retention) in self.resolutions.items():
+            series = self._series[name].get(location)
+            if series is None:
+                series = self._series[name][location] = _Series(width, retention)
+            series.add(timestamp_micros, data)
+
+    def query(self, resolution: str = "1h", location: Optional[str] = None,
+              since: Optional[int] = None, until: Optional[int] = None,
+              params: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Buckets per location; ``since``/``until`` are timestamps in microseconds"""
+        if resolution not in self.resolutions:
+            raise ValueError(f"Unknown resolution: {resolution}. Available: {list(self.resolutions)}")
+        series_by_location = self._series[resolution]
+        locations = list(series_by_location) if location is None else [location]
+        return {loc: series_by_location[loc].buckets(since, until, params)
+                for loc in locations if loc in series_by_location}
+
+    def clear(self):
+        self._series = {name: {} for name in self.resolutions}
+
+    def to_dict(self, closed: bool = True) -> Dict[str, Any]:
+        """
+        State for ``load``. With ``closed=False`` only the open buckets are
+        included, for callers persisting closed buckets through
+        ``take_changed`` instead, so the state stays small however long the
+        retention.
+        """
+        return {name: {loc: series.to_dict(closed) for loc, series in by_location.items()}
+                for name, by_location in self._series.items()}
+
+    def take_changed(self) -> List[BucketRow]:
+        """Closed buckets added or updated since the last call (late readings update them)"""
+        return [(name, loc, start, stats)
+                for name, by_location in self._series.items()
+                for loc, series in by_location.items()
+                for start, stats in series.take_changed()]
+
+    def mark_changed(self, rows: List[BucketRow]):
+        """Hand buckets from ``take_changed`` out again, e.g. after a failed write"""
+        for name, loc, start, _ in rows:
+            series = self._series.get(name, {}).get(loc)
+            if series is not None:
+                series.changed.add(start)
+
+    def closed_rows(self) -> List[BucketRow]:
+        """Every retained closed bucket"""
+        return [(name, loc, start, stats)
+                for name, by_location in self._series.items()
+                for loc, series in by_location.items()
+                for start, stats in series.closed_rows()]
+
+    def load(self, state: Dict[str, Any], closed_rows: Optional[List[BucketRow]] = None):
+        """
+        Restore rollups saved with ``to_dict``, plus the closed buckets
+        persisted from ``take_changed`` when the state has none. Buckets at or
+        after a series' open bucket are newer than the state and are left for
+        the readings replayed after it to rebuild.
+        """
+        self.clear()
+        closed: Dict[Tuple[str, str], Dict[int, Dict[str, List[float]]]] = {}
+        for name, loc, start, stats in closed_rows or ():
+            # Later rows replace earlier ones for the same bucket
+            closed.setdefault((name, loc), {})[start] = stats
+        for name, by_location in state.items():
+            if name not in self.resolutions:
+                continue
+            width, retention = self.resolutions[name]
+            for loc, series_state in by_location.items():
+                series = _Series(width, retention)
+                buckets = closed.get((name, loc))
+                if buckets:
+                    open_start = series_state.get("open_start")
+                    series.load_closed(sorted((start, stats) for start, stats in buckets.items()
+                                              if open_start is None or start < open_start))
+                series.load(series_state)
+                self._series[name][loc] = series
@@ -0,0 +1,259 @@
+"""
+Per-sensor reading scheduler with drift-free deadlines
+"""
+
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any, Optional
+
+import kisa_utils as kutils
+
+from ingest import ReadingSchema
+from metrics import Histogram
+from water_sensor_simulator import WaterSensorSimulator
+
+logger = logging.getLogger(__name__)
+
+CYCLE_SECONDS = Histogram("wq_generation_cycle_seconds",
+                          "Time to produce and store one batch of due sensor readings")
+
+
+class SensorSpec:
+    """
+    One simulated (or proxied) sensor: where it is, what water it sees and
+    how often it reports. ``produce`` replaces the simulator for sensors whose
+    readings come from elsewhere (e.g. polled from a device).
+    """
+
+    __slots__ = ("id", "scenario", "location", "interval", "jitter", "produce")
+
+    def __init__(self, id: str, scenario: str, location: str, interval: float = 60.0,
+                 jitter: float = 0.0, produce: Optional[Callable[[], Dict[str, Any]]] = None):
+        if interval <= 0:
+            raise ValueError(f"Sensor {id}: interval must be positive")
+        if not 0 <= jitter < interval / 2:
+            raise ValueError(f"Sensor {id}: jitter must be in [0, interval / 2)")
+        self.id = id
+        self.scenario = scenario
+        self.location = location
+        self.interval = interval
+        self.jitter = jitter
+        self.produce = produce
+
+
+def http_producer(url: str, location: str, scenario: str, timeout: float = 5.0,
+                  schema: Optional[ReadingSchema] = None) -> Callable[[], Dict[str, Any]]:
+    """
+    Producer polling a gateway for a sensor's current reading: ``url``
+    answers with one reading in the bulk upload format. ``location`` and
+    ``scenario`` fill in what the gateway leaves out, the time of the poll
+    stands in for a missing timestamp, and the reading is validated.
+    """
+    schema = schema if schema is not None else ReadingSchema()
+
+    def produce() -> Dict[str, Any]:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            item = json.load(response)
+        if not isinstance(item, dict):
+            raise ValueError(f"{url} did not return a JSON object")
+        item.setdefault('location', location)
+        item.setdefault('scenario', scenario)
+        item.setdefault('timestamp', kutils.dates.currentTimestamp())
+        return schema.validate(item)
+
+    return produce
+
+
+def default_sensors(interval: float = 60.0) -> List[SensorSpec]:
+    """One sensor per simulator scenario, as the original fixed loop had"""
+    return [SensorSpec(key, key, scenario["location"], interval)
+            for key, scenario in WaterSensorSimulator.SCENARIOS.items()]
+
+
+def load_sensors(path: str) -> List[SensorSpec]:
+    """
+    Read sensor definitions from a JSON file: a list of objects with
+    ``scenario``, ``location``, ``interval_seconds`` and ``jitter_seconds``.
+    An entry with ``count`` expands into that many sensors; ``{i}`` in its
+    ``location`` (and ``id``) is replaced by the sensor number.
+
+    An entry with ``url`` is a proxied sensor whose readings are polled from
+    that gateway URL (``{i}`` replaced too, ``timeout_seconds`` default 5)
+    instead of simulated; the scenario is then only recorded with them.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    entries = config["sensors"] if isinstance(config, dict) else config
+    sensors = []
+    schema = ReadingSchema()
+    for entry in entries:
+        scenario = entry["scenario"]
+        if scenario not in WaterSensorSimulator.SCENARIOS:
+            raise ValueError(f"Unknown scenario in {path}: {scenario}")
+        location = entry.get("location", WaterSensorSimulator.SCENARIOS[scenario]["location"])
+        sensor_id = entry.get("id", location)
+        url = entry.get("url")
+        for i in range(1, entry.get("count", 1) + 1):
+            sensor_location = location.replace("{i}", str(i))
+            produce = None
+            if url is not None:
+                produce = http_producer(url.replace("{i}", str(i)), sensor_location, scenario,
+                                        float(entry.get("timeout_seconds", 5)), schema)
+            sensors.append(SensorSpec(
+                sensor_id.replace("{i}", str(i)),
+                scenario,
+                sensor_location,
+                float(entry.get("interval_seconds", 60)),
+                float(entry.get("jitter_seconds", 0)),
+                produce,
+            ))
+    return sensors
+
+
+class _SensorState:
+    __slots__ = ("spec", "base", "tick", "deadline")
+
+    def __init__(self, spec: SensorSpec, base: float):
+        self.spec = spec
+        self.base = base
+        self.tick = 0
+        self.deadline = base
+
+
+class ReadingScheduler:
+    """
+    Produces readings for many sensors, each on its own cadence.
+
+    Deadlines are computed from a fixed monotonic base (``base + n *
+    interval``, plus optional jitter), so the period never drifts by the time
+    spent generating or storing readings. All sensors due at the same moment
+    are produced together (proxied sensors concurrently on a thread pool) and
+    handed to ``sink`` as one batch. A sensor that falls more than a whole
+    interval behind skips the ticks it missed instead of bursting to catch up;
+    those are counted, as is the lag between a deadline and the reading.
+
+    Sensors due within ``batch_window`` seconds of each other share a batch,
+    so jittered sensors do not each cost a separate store append.
+    """
+
+    def __init__(self, sensors: List[SensorSpec], simulator: WaterSensorSimulator,
+                 sink: Callable[[List[Dict[str, Any]]], Any], max_workers: int = 8,
+                 batch_window: float = 0.05, seed: Optional[int] = None):
+        if not sensors:
+            raise ValueError("No sensors to schedule")
+        self.sensors = sensors
+        self.simulator = simulator
+        self.sink = sink
+        self.max_workers = max_workers
+        self.batch_window = batch_window
+        self._rng = random.Random(seed)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop = threading.Event()
+        self.stats = {
+            "sensors": len(sensors),
+            "ticks": 0,
+            "missed_ticks": 0,
+            "errors": 0,
+            "batches": 0,
+            "last_lag_seconds": 0.0,
+            "max_lag_seconds": 0.0,
+            "total_lag_seconds": 0.0,
+        }
+
+    def _produce(self, spec: SensorSpec) -> Dict[str, Any]:
+        if spec.produce is not None:
+            return spec.produce()
+        return self.simulator.generate_reading(spec.scenario, spec.location)
+
+    def _produce_all(self, due: List[_SensorState]) -> List[Dict[str, Any]]:
+        """Readings for every due sensor; proxied sensors run concurrently"""
+        proxied = [state for state in due if state.spec.produce is not None]
+        futures = {}
+        if proxied:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="sensor")
+            futures = {id(state): self._executor.submit(self._produce, state.spec) for state in proxied}
+
+        readings = []
+        for state in due:
+            try:
+                future = futures.get(id(state))
+                readings.append(future.result() if future else self._produce(state.spec))
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("⚠️ Error reading sensor %s: %s", state.spec.id, e)
+        return readings
+
+    def _reschedule(self, state: _SensorState, now: float):
+        """Move a sensor to its next deadline, skipping ticks it can no longer make"""
+        spec = state.spec
+        state.tick += 1
+        nominal = state.base + state.tick * spec.interval
+        if now >= nominal + spec.interval:
+            skipped = int((now - nominal) // spec.interval)
+            state.tick += skipped
+            nominal += skipped * spec.interval
+            self.stats["missed_ticks"] += skipped
+        jitter = self._rng.uniform(-spec.jitter, spec.jitter) if spec.jitter else 0.0
+        state.deadline = nominal + jitter
+
+    def run(self, start: Optional[float] = None):
+        """Run until ``stop`` is called; every sensor reports once right away"""
+        start = time.monotonic() if start is None else start
+        states = [_SensorState(spec, start) for spec in self.sensors]
+        heap = [(state.deadline, i) for i, state in enumerate(states)]
+        heapq.heapify(heap)
+        stats = self.stats
+
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if heap[0][0] > now:
+                self._stop.wait(heap[0][0] - now)
+                continue
+
+            due_indexes = []
+            horizon = now + self.batch_window
+            while heap and heap[0][0] <= horizon:
+                due_indexes.append(heapq.heappop(heap)[1])
+            due = [states[i] for i in due_indexes]
+            readings = self._produce_all(due)
+            if readings:
+                try:
+                    self.sink(readings)
+                    stats["batches"] += 1
+                except Exception as e:
+                    stats["errors"] += 1
+                    logger.error("⚠️ Error storing %d scheduled readings: %s", len(readings), e)
+
+            done = time.monotonic()
+            CYCLE_SECONDS.observe(done - now)
+            for i, state in zip(due_indexes, due):
+                lag = max(0.0, done - state.deadline)
+                stats["ticks"] += 1
+                stats["last_lag_seconds"] = lag
+                stats["total_lag_seconds"] += lag
+                if lag > stats["max_lag_seconds"]:
+                    stats["max_lag_seconds"] = lag
+                self._reschedule(state, done)
+                heapq.heappush(heap, (state.deadline, i))
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stop(self):
+        self._stop.set()
+
+    def summary(self) -> Dict[str, Any]:
+        """Counters for health endpoints, with the mean lag instead of the running total"""
+        stats = dict(self.stats)
+        total = stats.pop("total_lag_seconds")
+        stats["mean_lag_seconds"] = round(total / stats["ticks"], 6) if stats["ticks"] else 0.0
+        stats["last_lag_seconds"] = round(stats["last_lag_seconds"], 6)
+        stats["max_lag_seconds"] = round(stats["max_lag_seconds"], 6)
+        return stats
@@ -0,0 +1,359 @@
+"""
+Cold storage tier: immutable, compressed, time-partitioned segment files
+"""
+
+import glob
+import gzip
+import heapq
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Any, Optional, Tuple
+
+from history import micros_to_timestamp, timestamp_to_micros
+from storage import atomic_write
+from wire_format import from_columnar, to_columnar
+
+logger = logging.getLogger(__name__)
+
+# (timestamp micros, seq, reading)
+Row = Tuple[int, int, Dict[str, Any]]
+
+
+def _partition(reading: Dict[str, Any]) -> str:
+    """Day of a reading's timestamp, e.g. ``2026-03-01``"""
+    return reading["timestamp"][:10]
+
+
+def _project(reading: Dict[str, Any], params: Optional[List[str]]) -> Dict[str, Any]:
+    if params is None:
+        return reading
+    return {**reading, "data": {k: v for k, v in reading["data"].items() if k in params}}
+
+
+class SegmentStore:
+    """
+    Readings evicted from the in-memory history, kept on disk by day.
+
+    Readings are first appended to an open JSON-lines file per day
+    (``open-<day>.jsonl``). A day's file is sealed into an immutable gzipped
+    segment (``<day>/<first seq>-<last seq>.json.gz``, columnar layout) once
+    it holds ``segment_readings`` readings or a later day has started. The
+    manifest lists every segment with its time and sequence range and its
+    locations, so range queries open only the segments that can match.
+
+    With ``retention_days`` set, sealed segments whose newest reading is
+    older than that are deleted. One process writes (``add``); others call
+    ``refresh`` to follow its changes.
+    """
+
+    def __init__(self, directory: str, segment_readings: int = 2000,
+                 retention_days: Optional[float] = None, cached_segments: int = 8):
+        self.directory = directory
+        self.segment_readings = segment_readings
+        self.retention_days = retention_days
+        self.cached_segments = cached_segments
+        self.manifest_file = os.path.join(directory, "manifest.json")
+        self._lock = threading.Lock()
+        self._segments: List[Dict[str, Any]] = []
+        self._manifest_signature = None
+        # day -> rows of its open file, and how far that file has been read
+        self._open: Dict[str, List[Row]] = {}
+        self._open_offsets: Dict[str, int] = {}
+        # Decoded segments, most recently used last
+        self._cache: "OrderedDict[str, List[Row]]" = OrderedDict()
+        self.archived_upto = -1
+        self.bytes_written = 0
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    def _open_path(self, day: str) -> str:
+        return os.path.join(self.directory, f"open-{day}.jsonl")
+
+    def refresh(self):
+        """Pick up segments sealed and readings added by the writing process"""
+        with self._lock:
+            try:
+                st = os.stat(self.manifest_file)
+                signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+            except OSError:
+                signature = None
+            if signature != self._manifest_signature:
+                try:
+                    with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                        self._segments = json.load(f)["segments"]
+                except (OSError, ValueError, KeyError):
+                    self._segments = []
+                self._manifest_signature = signature
+            self._read_open_files()
+            self.archived_upto = max([s["max_seq"] for s in self._segments] +
+                                     [rows[-1][1] for rows in self._open.values() if rows] + [-1])
+
+    def _read_open_files(self):
+        sealed_upto: Dict[str, int] = {}
+        for segment in self._segments:
+            day = segment["partition"]
+            sealed_upto[day] = max(sealed_upto.get(day, -1), segment["max_seq"])
+        present = set()
+        for path in glob.glob(os.path.join(glob.escape(self.directory), "open-*.jsonl")):
+            day = os.path.basename(path)[len("open-"):-len(".jsonl")]
+            present.add(day)
+            offset = self._open_offsets.get(day, 0)
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    chunk = f.read()
+            except OSError:
+                continue
+            # Only whole lines; the writer may be in the middle of one
+            end = chunk.rfind(b"\n") + 1
+            rows = self._open.setdefault(day, [])
+            for line in chunk[:end].splitlines():
+                entry = json.loads(line)
+                reading = entry["reading"]
+                rows.append((timestamp_to_micros(reading["timestamp"]), entry["seq"], reading))
+            self._open_offsets[day] = offset + end
+        for day in list(self._open):
+            if day not in present:
+                # Sealed (or removed) by the writer
+                del self._open[day]
+                self._open_offsets.pop(day, None)
+            else:
+                # A crash between sealing and removing the open file leaves rows already sealed
+                self._open[day] = [row for row in self._open[day] if row[1] > sealed_upto.get(day, -1)]
+
+    def add(self, readings: List[Tuple[int, Dict[str, Any]]]):
+        """
+        Archive ``(seq, reading)`` pairs evicted from memory. Readings at or
+        below ``archived_upto`` are already archived and skipped. The open
+        files are fsynced before returning.
+        """
+        with self._lock:
+            by_day: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+            for seq, reading in sorted(readings, key=lambda item: item[0]):
+                if seq > self.archived_upto:
+                    by_day.setdefault(_partition(reading), []).append((seq, reading))
+                    self.archived_upto = seq
+            for day, items in by_day.items():
+                lines = "".join(json.dumps({"seq": seq, "reading": reading}, ensure_ascii=False,
+                                           separators=(',', ':')) + "\n" for seq, reading in items)
+                body = lines.encode('utf-8')
+                path = self._open_path(day)
+                with open(path, 'ab') as f:
+                    f.write(body)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.bytes_written += len(body)
+                self._open.setdefault(day, []).extend(
+                    (timestamp_to_micros(reading["timestamp"]), seq, reading) for seq, reading in items)
+                self._open_offsets[day] = self._open_offsets.get(day, 0) + len(body)
+
+            newest_day = max(self._open, default=None)
+            for day in sorted(self._open):
+                if day != newest_day or len(self._open[day]) >= self.segment_readings:
+                    self._seal(day)
+
+    def _seal(self, day: str):
+        """Write a day's open readings as an immutable segment (called with the lock held)"""
+        rows = self._open.get(day)
+        if not rows:
+            return
+        os.makedirs(os.path.join(self.directory, day), exist_ok=True)
+        # A large batch (e.g. a backfill) is split into several segments
+        for i in range(0, len(rows), self.segment_readings):
+            self._write_segment(day, rows[i:i + self.segment_readings])
+        expired = self._expired()
+        self._write_manifest()
+        os.remove(self._open_path(day))
+        del self._open[day]
+        self._open_offsets.pop(day, None)
+        for segment in expired:
+            try:
+                os.remove(os.path.join(self.directory, segment["file"]))
+            except OSError:
+                pass
+        logger.debug("🧊 Sealed %d readings of %s", len(rows), day)
+        if expired:
+            logger.info("🗑️ Deleted %d segments past the %s-day retention", len(expired), self.retention_days)
+
+    def _write_segment(self, day: str, rows: List[Row]):
+        seqs = [seq for _, seq, _ in rows]
+        timestamps = [ts for ts, _, _ in rows]
+        name = f"{day}/{min(seqs)}-{max(seqs)}.json.gz"
+        body = to_columnar([reading for _, _, reading in rows])
+        body["seqs"] = seqs
+        self.bytes_written += atomic_write(
+            os.path.join(self.directory, name),
+            gzip.compress(json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')))
+        self._segments.append({
+            "file": name,
+            "partition": day,
+            "min_ts": min(timestamps),
+            "max_ts": max(timestamps),
+            "min_seq": min(seqs),
+            "max_seq": max(seqs),
+            "count": len(rows),
+            "locations": sorted({reading["location"] for _, _, reading in rows}),
+        })
+
+    def _expired(self) -> List[Dict[str, Any]]:
+        """Drop segments past the retention period from the manifest; returns them"""
+        if self.retention_days is None:
+            return []
+        cutoff = timestamp_to_micros((datetime.now() - timedelta(days=self.retention_days)).isoformat())
+        expired = [s for s in self._segments if s["max_ts"] < cutoff]
+        self._segments = [s for s in self._segments if s["max_ts"] >= cutoff]
+        return expired
+
+    def _write_manifest(self):
+        self.bytes_written += atomic_write(self.manifest_file, json.dumps({"segments": self._segments}))
+        st = os.stat(self.manifest_file)
+        self._manifest_signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def clear(self):
+        """Delete every segment and open file"""
+        with self._lock:
+            files = [s["file"] for s in self._segments]
+            self._segments = []
+            self._write_manifest()
+            for name in files:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            for day in list(self._open):
+                try:
+                    os.remove(self._open_path(day))
+                except OSError:
+                    pass
+            self._open.clear()
+            self._open_offsets.clear()
+            self._cache.clear()
+
+    def _rows(self, segment: Dict[str, Any]) -> List[Row]:
+        """A segment's readings sorted by (timestamp, seq), decoded once and cached"""
+        name = segment["file"]
+        with self._lock:
+            rows = self._cache.get(name)
+            if rows is not None:
+                self._cache.move_to_end(name)
+                return rows
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                body = json.loads(gzip.decompress(f.read()))
+        except FileNotFoundError:
+            # Deleted by retention since the manifest was read
+            return []
+        readings = from_columnar(body)
+        rows = sorted(((timestamp_to_micros(r["timestamp"]), seq, r)
+                       for seq, r in zip(body["seqs"], readings)), key=lambda row: row[:2])
+        with self._lock:
+            self._cache[name] = rows
+            while len(self._cache) > self.cached_segments:
+                self._cache.popitem(last=False)
+        return rows
+
+    def _sources(self, below_seq: int, since: Optional[int], until: Optional[int],
+                 location: Optional[str]) -> List[Tuple[int, int, Any]]:
+        """
+        ``(min_ts, max_ts, segment or rows)`` of the sealed segments and open
+        days whose metadata can match; everything else is skipped unread.
+        """
+        with self._lock:
+            sources = []
+            for s in self._segments:
+                if (s["min_seq"] < below_seq and (since is None or s["max_ts"] >= since)
+                        and (until is None or s["min_ts"] < until)
+                        and (location is None or location in s["locations"])):
+                    sources.append((s["min_ts"], s["max_ts"], s))
+            for rows in self._open.values():
+                if rows:
+                    rows = sorted(rows, key=lambda row: row[:2])
+                    sources.append((rows[0][0], max(row[0] for row in rows), rows))
+        return sources
+
+    def _matching(self, source, below_seq: int, since: Optional[int], until: Optional[int],
+                  location: Optional[str], params: Optional[List[str]],
+                  before: Optional[Tuple[int, int]] = None) -> List[Row]:
+        rows = source if isinstance(source, list) else self._rows(source)
+        return [(ts, seq, _project(reading, params)) for ts, seq, reading in rows
+                if seq < below_seq and (since is None or ts >= since)
+                and (until is None or ts < until)
+                and (location is None or reading["location"] == location)
+                and (before is None or (ts, seq) < before)]
+
+    def query_archive(self, below_seq: int, since: Optional[int] = None,
+                      until: Optional[int] = None, location: Optional[str] = None,
+                      params: Optional[List[str]] = None, limit: Optional[int] = None,
+                      before: Optional[Tuple[int, int]] = None) -> Tuple[List[Row], bool]:
+        """
+        Newest-first page of archived readings with ``seq < below_seq``, as
+        ``(ts, seq, reading)`` oldest first; same arguments and ordering as
+        ``SqliteBackend.query_archive``. Segments are read newest first and
+        reading stops once no remaining segment can hold a newer match.
+        """
+        sources = self._sources(below_seq, since, until, location)
+        if before is not None:
+            sources = [s for s in sources if s[0] <= before[0]]
+        sources.sort(key=lambda s: s[1], reverse=True)
+        page: List[Row] = []
+        for _, max_ts, source in sources:
+            if limit and len(page) > limit and max_ts < page[0][0]:
+                break
+            page.extend(self._matching(source, below_seq, since, until, location, params, before))
+            page.sort(key=lambda row: row[:2])
+            if limit:
+                # One extra row tells whether there is more
+                page = page[-(limit + 1):]
+        more = bool(limit) and len(page) > limit
+        return (page[-limit:] if limit else page), more
+
+    def iter_archive(self, below_seq: int, since: Optional[int] = None,
+                     until: Optional[int] = None, location: Optional[str] = None,
+                     params: Optional[List[str]] = None, chunk_size: int = 1000) -> Iterator[Row]:
+        """
+        Archived readings with ``seq < below_seq`` as ``(ts, seq, reading)``,
+        oldest first. A segment is only decoded once the stream reaches its
+        time range, so at most the overlapping segments are held at once.
+        """
+        sources = sorted(self._sources(below_seq, since, until, location), key=lambda s: s[0])
+        heap: List[Row] = []
+        i = 0
+        while True:
+            while i < len(sources) and (not heap or sources[i][0] <= heap[0][0]):
+                for row in self._matching(sources[i][2], below_seq, since, until, location, params):
+                    heapq.heappush(heap, row)
+                i += 1
+            if not heap:
+                return
+            yield heapq.heappop(heap)
+
+    def get_readings(self, seqs: List[int],
+                     params: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        """Archived readings by sequence number; missing ones are left out"""
+        wanted = set(seqs)
+        if not wanted:
+            return {}
+        low, high = min(wanted), max(wanted)
+        result = {}
+        for _, _, source in self._sources(high + 1, None, None, None):
+            if not isinstance(source, list) and (source["max_seq"] < low or source["min_seq"] > high):
+                continue
+            rows = source if isinstance(source, list) else self._rows(source)
+            for _, seq, reading in rows:
+                if seq in wanted:
+                    result[seq] = _project(reading, params)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "segments": len(self._segments),
+                "archived_readings": sum(s["count"] for s in self._segments) +
+                                     sum(len(rows) for rows in self._open.values()),
+                "oldest": micros_to_timestamp(min(s["min_ts"] for s in self._segments))
+                          if self._segments else None,
+            }
@@ -0,0 +1,989 @@
+"""
+Storage backends for the sensor data store
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Any, Optional, Tuple, Union
+
+from history import micros_to_timestamp, timestamp_to_micros
+from water_sensor_simulator import WaterSensorSimulator
+from wire_format import from_columnar, is_columnar, to_columnar
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+# Readings and alerts kept in the head file, enough to serve recent data while booting
+HEAD_TAIL_READINGS = 100
+HEAD_TAIL_ALERTS = 100
+
+# The closed rollup buckets are rewritten in full once more than this many
+# times the rows kept at the last rewrite (and at least ROLLUP_REWRITE_MIN)
+# have been saved since, so their storage stays proportional to retention
+ROLLUP_REWRITE_FACTOR = 2
+ROLLUP_REWRITE_MIN = 1000
+
+
+def atomic_write(path: str, body: Union[str, bytes]) -> int:
+    """
+    Replace ``path`` with ``body`` crash-safely: write a temporary file,
+    fsync it, rename it over the target and fsync the directory. Readers and
+    a crash at any point see either the old or the new file, never a mix.
+    Returns the number of bytes written.
+    """
+    tmp_file = f"{path}.tmp"
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    with open(tmp_file, 'wb') as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:  # pragma: no cover - directories cannot be opened on some platforms
+        return len(body)
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+    return len(body)
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    """Read a JSON file, transparently decompressing gzip"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if raw[:2] == b"\x1f\x8b":
+        raw = gzip.decompress(raw)
+    return json.loads(raw)
+
+
+def _decode_snapshot(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """Expand readings stored in the columnar layout back into dicts"""
+    readings = snapshot.get("historical_readings")
+    if is_columnar(readings):
+        snapshot["historical_readings"] = from_columnar(readings)
+    return snapshot
+
+
+def _empty_snapshot() -> Dict[str, Any]:
+    """Return an empty data snapshot"""
+    return {
+        "latest_reading": None,
+        "historical_readings": [],
+        "alerts": []
+    }
+
+
+class AppendLogBackend:
+    """
+    Append-only JSON-lines log on top of a periodically compacted snapshot.
+
+    The snapshot lives in ``json_file`` (same layout as the legacy file plus a
+    ``generation`` counter). Every change since the snapshot is appended as one
+    line to ``<json_file>.log.<generation>``. Compaction writes a new snapshot
+    under the next generation and starts a fresh log, so each reading costs a
+    single small append instead of a full rewrite.
+
+    Snapshots store history in the columnar layout of ``wire_format`` (each
+    parameter name once) and can be gzip-compressed; both are detected on
+    load, so older plain snapshots still read fine.
+
+    The previous ``keep_snapshots`` snapshots are kept as
+    ``<json_file>.bak.<generation>`` together with their logs. If the current
+    snapshot cannot be read, the newest readable backup is loaded and the
+    logs from its generation onwards are replayed, so nothing is lost.
+
+    Closed rollup buckets are not part of the snapshot: they are appended to
+    ``<json_file>.rollups`` as they close (``save_rollups``), and that file
+    is rewritten once it has grown well beyond the buckets retained.
+
+    With ``segments`` (a ``segments.SegmentStore``), readings evicted from the
+    in-memory history are archived there instead of being dropped and are
+    queried like ``SqliteBackend``'s archive.
+    """
+
+    def __init__(self, json_file: str = "sensor_data.json", compact_every: int = 500,
+                 keep_snapshots: int = 3, compression: Optional[str] = None, segments=None):
+        self.json_file = json_file
+        self.segments = segments
+        if segments is not None:
+            # Only offered with a cold tier; DataStore looks these up with getattr
+            self.query_archive = segments.query_archive
+            self.iter_archive = segments.iter_archive
+            self.get_readings = segments.get_readings
+        self.compact_every = compact_every
+        self.keep_snapshots = keep_snapshots
+        if compression not in (None, "gzip"):
+            raise ValueError(f"Unsupported snapshot compression: {compression}")
+        self.compression = compression
+        self.generation = 0
+        self._log = None
+        # Bytes of snapshots, head files and log entries written by this process
+        self.bytes_written = 0
+        self._appended = 0
+        self._snapshot_signature = None
+        self._log_offset = 0
+        self.rollups_file = f"{json_file}.rollups"
+        # Rollup buckets read so far, by (resolution, location, start)
+        self._rollup_rows: Dict[Tuple[str, str, int], list] = {}
+        self._rollups_offset = 0
+        self._rollups_inode = None
+        self._rollup_rows_kept = 0
+        self._rollup_rows_saved = 0
+
+    def _log_path(self, generation: int) -> str:
+        return f"{self.json_file}.log.{generation}"
+
+    def _backup_path(self, generation: int) -> str:
+        return f"{self.json_file}.bak.{generation}"
+
+    def _generations(self, kind: str) -> List[int]:
+        """Generations of the existing ``log`` or ``bak`` files, ascending"""
+        generations = []
+        for path in glob.glob(f"{glob.escape(self.json_file)}.{kind}.*"):
+            suffix = path.rsplit(".", 1)[-1]
+            if suffix.isdigit():
+                generations.append(int(suffix))
+        return sorted(generations)
+
+    @property
+    def head_file(self) -> str:
+        return f"{self.json_file}.head"
+
+    @staticmethod
+    def _signature(st: os.stat_result) -> Tuple[int, int, int]:
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read_snapshot(self) -> Dict[str, Any]:
+        """Read the current snapshot, falling back to the newest readable backup"""
+        self._snapshot_signature = None
+        candidates = [self.json_file] + [self._backup_path(g)
+                                         for g in reversed(self._generations("bak"))]
+        existing = [path for path in candidates if os.path.exists(path)]
+        if not existing:
+            logger.info("📝 Creating new data store")
+            return _empty_snapshot()
+        try:
+            self._snapshot_signature = self._signature(os.stat(self.json_file))
+        except OSError:
+            pass
+
+        for path in existing:
+            try:
+                loaded_data = _decode_snapshot(_read_json(path))
+            except (OSError, ValueError, EOFError) as e:
+                logger.warning("⚠️ Cannot read snapshot %s: %s", path, e)
+                continue
+            if path != self.json_file:
+                logger.warning("♻️ Recovered from backup snapshot %s", path)
+            elif "generation" not in loaded_data:
+                logger.info("🔁 Migrating legacy data file to append-only log storage")
+            return {**_empty_snapshot(), **loaded_data}
+
+        logger.warning("⚠️ No readable snapshot, starting from the logs alone")
+        return _empty_snapshot()
+
+    def _read_log(self, generation: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """Read complete log lines from ``offset`` and advance the read offset"""
+        path = self._log_path(generation)
+        entries = []
+        self._log_offset = offset
+        if not os.path.exists(path):
+            return entries
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partial line: the writer is mid-append or crashed mid-append
+                    break
+                try:
+                    if line.strip():
+                        entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning("⚠️ Ignoring corrupt log entry at %s:%d", path, self._log_offset)
+                    break
+                self._log_offset += len(line)
+        return entries
+
+    def load(self) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Load the snapshot and the log entries written after it"""
+        snapshot = self._read_snapshot()
+        snapshot["rollup_buckets"] = self._load_rollups()
+        self.generation = snapshot.pop("generation", 0)
+        entries = self._read_log(self.generation)
+        # After recovering from a backup, later generations' logs follow on
+        for generation in self._generations("log"):
+            if generation > self.generation:
+                self.generation = generation
+                entries.extend(self._read_log(generation))
+        self._appended = len(entries)
+        if entries:
+            logger.info("📜 Replaying %d log entries", len(entries))
+        return snapshot, entries
+
+    def load_head(self) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """
+        Quickly load the small head file written with each snapshot (latest
+        readings, alerts and a short tail of history) plus the log after it.
+        Returns None when there is no usable head file.
+        """
+        try:
+            head = _decode_snapshot(_read_json(self.head_file))
+        except (OSError, ValueError, EOFError):
+            return None
+        generation = head.pop("generation", 0)
+        return {**_empty_snapshot(), **head}, self._read_log(generation)
+
+    def poll(self) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Catch up with changes made by the writer process.
+
+        Returns a full snapshot (plus its log) when the writer has compacted
+        since the last poll, otherwise only the log entries appended since.
+        """
+        try:
+            signature = self._signature(os.stat(self.json_file))
+        except OSError:
+            signature = None
+        if self.segments is not None:
+            self.segments.refresh()
+        if signature != self._snapshot_signature:
+            return self.load()
+        entries = self._read_log(self.generation, self._log_offset)
+        self._appended += len(entries)
+        return None, entries
+
+    def prepare_for_writing(self):
+        """Drop any torn tail left by a previous writer before appending"""
+        path = self._log_path(self.generation)
+        if os.path.exists(path) and os.path.getsize(path) > self._log_offset:
+            with open(path, 'r+b') as f:
+                f.truncate(self._log_offset)
+        self._truncate_rollups_tail()
+
+    def _truncate_rollups_tail(self, block: int = 4096):
+        """Cut the rollups file back to its last complete line"""
+        try:
+            f = open(self.rollups_file, 'r+b')
+        except FileNotFoundError:
+            return
+        with f:
+            size = end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - block)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                logger.warning("✂️ Dropping %d bytes of torn rollups tail from %s",
+                               size - end, self.rollups_file)
+                f.truncate(end)
+
+    def _open_log(self):
+        if self._log is None:
+            self._log = open(self._log_path(self.generation), 'a', encoding='utf-8')
+        return self._log
+
+    def append(self, entries: List[Dict[str, Any]]):
+        """Append entries to the current log and fsync once for the whole batch"""
+        log = self._open_log()
+        lines = "".join(json.dumps(e, ensure_ascii=False, separators=(',', ':')) + "\n"
+                        for e in entries)
+        log.write(lines)
+        log.flush()
+        os.fsync(log.fileno())
+        self._appended += len(entries)
+        self.bytes_written += len(lines.encode('utf-8'))
+
+    def archive(self, readings: List[Tuple[int, Dict[str, Any]]]):
+        """Move ``(seq, reading)`` pairs evicted from memory into the segments"""
+        self.segments.add(readings)
+
+    @property
+    def archived_upto(self) -> int:
+        """Highest sequence number in the segments (-1 when none)"""
+        return self.segments.archived_upto if self.segments is not None else -1
+
+    def clear(self):
+        if self.segments is not None:
+            self.segments.clear()
+
+    def needs_compaction(self) -> bool:
+        """Whether the log has grown enough to fold it into a new snapshot"""
+        return self._appended >= self.compact_every
+
+    def _load_rollups(self) -> List[list]:
+        """Closed rollup buckets saved by ``save_rollups``, reading only what is new"""
+        try:
+            st = os.stat(self.rollups_file)
+        except OSError:
+            self._rollup_rows, self._rollups_offset, self._rollups_inode = {}, 0, None
+            return []
+        if st.st_ino != self._rollups_inode or st.st_size < self._rollups_offset:
+            # Rewritten since the last read
+            self._rollup_rows, self._rollups_offset, self._rollups_inode = {}, 0, st.st_ino
+        with open(self.rollups_file, 'rb') as f:
+            f.seek(self._rollups_offset)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                row = json.loads(line)
+                self._rollup_rows[tuple(row[:3])] = row
+            except (ValueError, TypeError):
+                # e.g. a torn append that the next append ran into; skip the bucket
+                logger.warning("⚠️ Ignoring corrupt rollup bucket in %s: %.80r", self.rollups_file, line)
+        self._rollups_offset += end
+        self._rollup_rows_kept = len(self._rollup_rows)
+        return list(self._rollup_rows.values())
+
+    @property
+    def rollup_rewrite_due(self) -> bool:
+        return self._rollup_rows_saved > max(ROLLUP_REWRITE_MIN,
+                                             ROLLUP_REWRITE_FACTOR * self._rollup_rows_kept)
+
+    def save_rollups(self, changed: List[tuple], full: Optional[List[tuple]] = None):
+        """
+        Append closed rollup buckets that changed, or with ``full`` replace
+        the file with exactly those buckets.
+        """
+        rows = changed if full is None else full
+        body = "".join(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + "\n"
+                       for row in rows).encode('utf-8')
+        if full is not None:
+            self.bytes_written += atomic_write(self.rollups_file, body)
+            self._rollup_rows_kept = len(full)
+            self._rollup_rows_saved = 0
+            return
+        if not body:
+            return
+        with open(self.rollups_file, 'ab', buffering=0) as f:
+            size = f.seek(0, os.SEEK_END)
+            try:
+                if f.write(body) != len(body):
+                    raise OSError(f"Short write to {self.rollups_file}")
+                os.fsync(f.fileno())
+            except OSError:
+                # Do not leave a partial line for the next append to run into
+                f.truncate(size)
+                raise
+        self.bytes_written += len(body)
+        self._rollup_rows_saved += len(changed)
+
+    def compact(self, state: Dict[str, Any]):
+        """Write the full state as the next snapshot generation and start a new log"""
+        next_generation = self.generation + 1
+        # json.dumps uses the C encoder; json.dump to a file does not
+        body = json.dumps({**state, "generation": next_generation,
+                           "historical_readings": to_columnar(state.get("historical_readings") or [])},
+                          ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if self.compression == "gzip":
+            body = gzip.compress(body, compresslevel=1)
+        if self.keep_snapshots and os.path.exists(self.json_file):
+            self._keep_backup(self.generation)
+        self.bytes_written += atomic_write(self.json_file, body)
+        self._snapshot_signature = self._signature(os.stat(self.json_file))
+        try:
+            self._write_head(state, next_generation)
+        except OSError as e:
+            # Only slows down the next startup
+            logger.warning("⚠️ Error saving data head file: %s", e)
+
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        self.generation = next_generation
+        self._appended = 0
+        self._log_offset = 0
+        self._remove_stale_files()
+
+    def _keep_backup(self, generation: int):
+        """Keep the snapshot about to be replaced as a backup (hard link when possible)"""
+        backup = self._backup_path(generation)
+        if os.path.exists(backup):
+            os.remove(backup)
+        try:
+            os.link(self.json_file, backup)
+        except OSError:
+            shutil.copyfile(self.json_file, backup)
+
+    def _write_head(self, state: Dict[str, Any], generation: int):
+        """Write the head file read by ``load_head`` for fast startup"""
+        readings = state.get("historical_readings") or []
+        tail = readings[-HEAD_TAIL_READINGS:]
+        head = {
+            "generation": generation,
+            "latest_reading": state.get("latest_reading"),
+            "latest_by_location": state.get("latest_by_location"),
+            "location_summary": state.get("location_summary"),
+            "alerts": (state.get("alerts") or [])[-HEAD_TAIL_ALERTS:],
+            "historical_readings": to_columnar(tail),
+            "history_seq": state.get("history_seq", len(readings)),
+        }
+        self.bytes_written += atomic_write(
+            self.head_file, json.dumps(head, ensure_ascii=False, separators=(',', ':')))
+
+    def _remove_stale_files(self):
+        """Drop backups beyond ``keep_snapshots`` and logs no backup needs any more"""
+        backups = self._generations("bak")
+        kept = backups[-self.keep_snapshots:] if self.keep_snapshots else []
+        for generation in backups:
+            if generation not in kept:
+                self._remove(self._backup_path(generation))
+        oldest_needed = kept[0] if kept else self.generation
+        for generation in self._generations("log"):
+            if generation < oldest_needed:
+                self._remove(self._log_path(generation))
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class SqliteBackend:
+    """
+    SQLite database with one row per reading and per alert.
+
+    Readings keep one column per known parameter and are indexed on
+    ``(location, ts)``; alerts reference the reading that raised them. The
+    database runs in WAL mode so follower processes read while the writer
+    appends, and every batch is inserted in one transaction.
+
+    Only the newest ``history_limit`` readings and ``alert_limit`` alerts are
+    loaded at startup; older ones stay on disk and are served through
+    ``query_archive`` and ``query_alerts``. Closed rollup buckets are kept in
+    the ``rollup_buckets`` table; the open ones and the other derived state
+    are stored in a ``meta`` row on compaction.
+    Retention is by age and/or row count rather than by memory.
+    """
+
+    def __init__(self, db_file: str = "sensor_data.db", history_limit: int = 1000,
+                 retention_days: Optional[float] = None, max_readings: Optional[int] = None,
+                 compact_every: int = 500, alert_limit: int = 1000,
+                 parameters: Tuple[str, ...] = WaterSensorSimulator.PARAMETERS,
+                 integer_parameters=WaterSensorSimulator.INTEGER_PARAMETERS):
+        self.db_file = db_file
+        self.history_limit = history_limit
+        self.retention_days = retention_days
+        self.max_readings = max_readings
+        self.compact_every = compact_every
+        self.alert_limit = alert_limit
+        self.parameters = tuple(parameters)
+        self._integer = frozenset(integer_parameters)
+        self._known = frozenset(self.parameters)
+        self._columns = ", ".join(f'"{p}"' for p in self.parameters)
+        self._lock = threading.Lock()
+        self._appended = 0
+        self._last_seq = -1
+        self._epoch = None
+        self._clear_pending = False
+        self._rollup_rows_kept = 0
+        self._rollup_rows_saved = 0
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FULL syncs the WAL on every commit: one fsync per appended batch
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._create_schema()
+
+    def _create_schema(self):
+        param_columns = "".join(f', "{p}" REAL' for p in self.parameters)
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS readings (
+                seq INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                location TEXT NOT NULL,
+                scenario TEXT,
+                name TEXT,
+                extra TEXT{param_columns}
+            );
+            CREATE INDEX IF NOT EXISTS readings_location_ts ON readings (location, ts);
+            CREATE INDEX IF NOT EXISTS readings_ts ON readings (ts);
+            CREATE TABLE IF NOT EXISTS alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                reading_seq INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                location TEXT NOT NULL,
+                level TEXT NOT NULL,
+                type TEXT,
+                rule TEXT,
+                message TEXT
+            );
+            CREATE INDEX IF NOT EXISTS alerts_location_ts ON alerts (location, ts);
+            CREATE INDEX IF NOT EXISTS alerts_level_ts ON alerts (level, ts);
+            CREATE INDEX IF NOT EXISTS alerts_location_type_ts ON alerts (location, type, ts);
+            CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+            CREATE INDEX IF NOT EXISTS alerts_reading ON alerts (reading_seq);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS rollup_buckets (
+                resolution TEXT NOT NULL,
+                location TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                stats TEXT NOT NULL,
+                PRIMARY KEY (resolution, location, start)
+            );
+        """)
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _reading(self, row: tuple, params: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Rebuild a reading dict from a ``readings`` row (seq, ts, ..., parameters)"""
+        _, ts, location, scenario, name, extra = row[:6]
+        data = {}
+        for param, value in zip(self.parameters, row[6:]):
+            if value is None or (params is not None and param not in params):
+                continue
+            data[param] = int(value) if param in self._integer else value
+        if extra:
+            extras = json.loads(extra)
+            data.update(extras if params is None else {k: v for k, v in extras.items() if k in params})
+        return {
+            'scenario': scenario,
+            'name': name,
+            'location': location,
+            'timestamp': micros_to_timestamp(ts),
+            'data': data
+        }
+
+    @staticmethod
+    def _alert(row: tuple) -> Dict[str, Any]:
+        ts, location, level, alert_type, rule, message = row
+        alert = {"level": level, "type": alert_type, "message": message,
+                 "timestamp": micros_to_timestamp(ts), "location": location}
+        if rule is not None:
+            alert["rule"] = rule
+        return alert
+
+    def _entries_after(self, seq: int) -> List[Dict[str, Any]]:
+        """Readings (with their alerts) stored after ``seq``, in order"""
+        rows = self._conn.execute(
+            f"SELECT seq, ts, location, scenario, name, extra, {self._columns} "
+            "FROM readings WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+        if not rows:
+            return []
+        alerts: Dict[int, List[Dict[str, Any]]] = {}
+        for row in self._conn.execute(
+                "SELECT reading_seq, ts, location, level, type, rule, message "
+                "FROM alerts WHERE reading_seq > ? ORDER BY id", (seq,)):
+            alerts.setdefault(row[0], []).append(self._alert(row[1:]))
+        self._last_seq = rows[-1][0]
+        return [{"reading": self._reading(row), "alerts": alerts.get(row[0], [])} for row in rows]
+
+    def load(self) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Load the newest readings up to the last compaction as the snapshot,
+        and everything stored after it as entries to replay.
+        """
+        with self._lock:
+            self._epoch = self._meta("epoch")
+            state = json.loads(self._meta("state") or "{}")
+            max_seq = self._conn.execute("SELECT MAX(seq) FROM readings").fetchone()[0]
+            if max_seq is None:
+                logger.info("📝 Creating new data store")
+                self._last_seq = state.get("history_seq", 0) - 1
+                return {**_empty_snapshot(), **state, "rollup_buckets": self._load_rollups()}, []
+
+            # Without saved state the loaded window itself seeds the rollups
+            compacted = state.get("history_seq", max_seq + 1) - 1
+            rows = self._conn.execute(
+                f"SELECT seq, ts, location, scenario, name, extra, {self._columns} "
+                "FROM readings WHERE seq <= ? ORDER BY seq DESC LIMIT ?",
+                (compacted, self.history_limit)).fetchall()
+            rows.reverse()
+            # The newest alerts; older ones are served by query_alerts
+            alerts = [{**self._alert(row[1:]), "seq": row[0]} for row in self._conn.execute(
+                "SELECT reading_seq, ts, location, level, type, rule, message FROM alerts "
+                "WHERE reading_seq <= ? ORDER BY ts DESC, reading_seq DESC, id DESC LIMIT ?",
+                (compacted, self.alert_limit))][::-1]
+            historical = [self._reading(row) for row in rows]
+            snapshot = {
+                **state,
+                "historical_readings": historical,
+                "history_seq": compacted + 1,
+                "latest_reading": historical[-1] if historical else None,
+                "alerts": alerts,
+                "rollup_buckets": self._load_rollups()
+            }
+            self._last_seq = compacted
+            entries = self._entries_after(compacted)
+            self._appended = len(entries)
+            return snapshot, entries
+
+    def poll(self) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Readings the writer stored since the last poll; a full reload after a clear"""
+        with self._lock:
+            if self._meta("epoch") == self._epoch:
+                return None, self._entries_after(self._last_seq)
+        return self.load()
+
+    def prepare_for_writing(self):
+        """SQLite rolls back any transaction a crashed writer left behind"""
+
+    def append(self, entries: List[Dict[str, Any]]):
+        """Insert a batch of readings and their alerts in one transaction"""
+        reading_rows = []
+        alert_rows = []
+        for entry in entries:
+            reading = entry["reading"]
+            seq = entry["seq"]
+            ts = timestamp_to_micros(reading["timestamp"])
+            data = reading["data"]
+            extras = {k: v for k, v in data.items() if k not in self._known}
+            reading_rows.append((seq, ts, reading["location"], reading.get("scenario"),
+                                 reading.get("name"), json.dumps(extras) if extras else None,
+                                 *(data.get(p) for p in self.parameters)))
+            for alert in entry["alerts"]:
+                alert_rows.append((seq, ts, alert.get("location", reading["location"]),
+                                   alert["level"], alert.get("type"), alert.get("rule"),
+                                   alert.get("message")))
+        placeholders = ", ".join("?" * (6 + len(self.parameters)))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO readings (seq, ts, location, scenario, name, extra, "
+                    f"{self._columns}) VALUES ({placeholders})", reading_rows)
+                self._conn.executemany(
+                    "INSERT INTO alerts (reading_seq, ts, location, level, type, rule, message) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", alert_rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if reading_rows:
+                self._last_seq = max(self._last_seq, reading_rows[-1][0])
+            self._appended += len(entries)
+
+    def needs_compaction(self) -> bool:
+        """Whether enough readings arrived to save the derived state again"""
+        return self._appended >= self.compact_every
+
+    def _load_rollups(self) -> List[list]:
+        """Closed rollup buckets saved by ``save_rollups`` (called with the lock held)"""
+        rows = [[resolution, location, start, json.loads(stats)]
+                for resolution, location, start, stats in self._conn.execute(
+                    "SELECT resolution, location, start, stats FROM rollup_buckets ORDER BY start")]
+        self._rollup_rows_kept = len(rows)
+        return rows
+
+    @property
+    def rollup_rewrite_due(self) -> bool:
+        # Rows of buckets past retention are only dropped by a rewrite
+        return self._rollup_rows_saved > max(ROLLUP_REWRITE_MIN,
+                                             ROLLUP_REWRITE_FACTOR * self._rollup_rows_kept)
+
+    def save_rollups(self, changed: List[tuple], full: Optional[List[tuple]] = None):
+        """Upsert closed rollup buckets that changed, or with ``full`` replace them all"""
+        rows = changed if full is None else full
+        values = [(resolution, location, start, json.dumps(stats, separators=(',', ':')))
+                  for resolution, location, start, stats in rows]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if full is not None:
+                    self._conn.execute("DELETE FROM rollup_buckets")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO rollup_buckets (resolution, location, start, stats) "
+                    "VALUES (?, ?, ?, ?)", values)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if full is not None:
+            self._rollup_rows_kept = len(full)
+            self._rollup_rows_saved = 0
+        else:
+            self._rollup_rows_saved += len(changed)
+
+    def compact(self, state: Dict[str, Any]):
+        """Save the derived state (rollups etc.) and apply retention"""
+        # Readings themselves are already in the database
+        saved = {k: v for k, v in state.items()
+                 if k not in ("historical_readings", "alerts", "latest_reading")}
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if self._clear_pending:
+                    # Cleared together with the new state so followers never see one without the other
+                    self._conn.execute("DELETE FROM alerts")
+                    self._conn.execute("DELETE FROM readings")
+                    self._epoch = str(time.time_ns())
+                    self._set_meta("epoch", self._epoch)
+                self._set_meta("state", json.dumps(saved, ensure_ascii=False, separators=(',', ':')))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._clear_pending = False
+            self._appended = 0
+        self._apply_retention()
+
+    def _apply_retention(self):
+        """Delete readings (and their alerts) beyond the configured age or count"""
+        cutoffs = []
+        with self._lock:
+            if self.retention_days is not None:
+                # Timestamps are local wall-clock time, like the readings
+                oldest = timestamp_to_micros(
+                    (datetime.now() - timedelta(days=self.retention_days)).isoformat())
+                row = self._conn.execute("SELECT MAX(seq) FROM readings WHERE ts < ?",
+                                         (oldest,)).fetchone()
+                if row[0] is not None:
+                    cutoffs.append(row[0] + 1)
+            if self.max_readings is not None:
+                row = self._conn.execute("SELECT MAX(seq) FROM readings").fetchone()
+                if row[0] is not None:
+                    cutoffs.append(row[0] + 1 - self.max_readings)
+            if not cutoffs:
+                return
+            cutoff = max(cutoffs)
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM alerts WHERE reading_seq < ?", (cutoff,))
+            deleted = self._conn.execute("DELETE FROM readings WHERE seq < ?", (cutoff,)).rowcount
+            self._conn.execute("COMMIT")
+        if deleted:
+            logger.info("🧹 Retention removed %d readings", deleted)
+
+    def clear(self):
+        """
+        Delete every reading and alert with the next compaction; followers
+        reload from scratch when they see the new epoch.
+        """
+        self._clear_pending = True
+
+    def query_archive(self, below_seq: int, since: Optional[int] = None,
+                      until: Optional[int] = None, location: Optional[str] = None,
+                      params: Optional[List[str]] = None, limit: Optional[int] = None,
+                      before: Optional[Tuple[int, int]] = None
+                      ) -> Tuple[List[Tuple[int, int, Dict[str, Any]]], bool]:
+        """
+        Newest-first page of stored readings with ``seq < below_seq`` (those
+        no longer held in memory), as ``(ts, seq, reading)`` oldest first.
+        Same arguments and ordering as ``TimeIndex.page``.
+        """
+        clauses = ["seq < ?"]
+        args: List[Any] = [below_seq]
+        if location is not None:
+            clauses.append("location = ?")
+            args.append(location)
+        if since is not None:
+            clauses.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            args.append(until)
+        if before is not None:
+            clauses.append("(ts < ? OR (ts = ? AND seq < ?))")
+            args.extend((before[0], before[0], before[1]))
+        sql = (f"SELECT seq, ts, location, scenario, name, extra, {self._columns} FROM readings "
+               f"WHERE {' AND '.join(clauses)} ORDER BY ts DESC, seq DESC")
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        more = bool(limit) and len(rows) > limit
+        rows = rows[:limit] if limit else rows
+        rows.reverse()
+        return [(row[1], row[0], self._reading(row, params)) for row in rows], more
+
+    def iter_archive(self, below_seq: int, since: Optional[int] = None,
+                     until: Optional[int] = None, location: Optional[str] = None,
+                     params: Optional[List[str]] = None, chunk_size: int = 1000
+                     ) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """
+        Stored readings with ``seq < below_seq`` as ``(ts, seq, reading)``,
+        oldest first. Rows are fetched ``chunk_size`` at a time, each chunk
+        in its own short query continuing after the last row, so the writer
+        is never blocked for long and memory stays bounded.
+        """
+        clauses = ["seq < ?"]
+        args: List[Any] = [below_seq]
+        if location is not None:
+            clauses.append("location = ?")
+            args.append(location)
+        if since is not None:
+            clauses.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            args.append(until)
+        sql = (f"SELECT seq, ts, location, scenario, name, extra, {self._columns} FROM readings "
+               f"WHERE {' AND '.join(clauses)} AND (ts > ? OR (ts = ? AND seq > ?)) "
+               "ORDER BY ts, seq LIMIT ?")
+        after = (-2 ** 63, -1)
+        while True:
+            with self._lock:
+                rows = self._conn.execute(sql, args + [after[0], after[0], after[1], chunk_size]).fetchall()
+            for row in rows:
+                yield row[1], row[0], self._reading(row, params)
+            if len(rows) < chunk_size:
+                return
+            after = (rows[-1][1], rows[-1][0])
+
+    def get_readings(self, seqs: List[int],
+                     params: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        """Stored readings by sequence number; missing ones are left out"""
+        result = {}
+        for i in range(0, len(seqs), 500):
+            chunk = seqs[i:i + 500]
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT seq, ts, location, scenario, name, extra, {self._columns} FROM readings "
+                    f"WHERE seq IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+            for row in rows:
+                result[row[0]] = self._reading(row, params)
+        return result
+
+    def query_alerts(self, limit: int, level: Optional[str] = None,
+                     location: Optional[str] = None, alert_type: Optional[str] = None,
+                     since: Optional[int] = None, until: Optional[int] = None,
+                     before: Optional[Tuple[int, int]] = None,
+                     at_most: Optional[Tuple[int, int]] = None
+                     ) -> Tuple[List[Tuple[int, int, Dict[str, Any]]], bool]:
+        """
+        Newest-first page of stored alerts as ``(ts, reading seq, alert)``
+        oldest first, plus whether older matches remain. ``before`` and
+        ``at_most`` are ``(ts, reading seq)`` bounds, exclusive and inclusive.
+        Same arguments and ordering as ``AlertStore.page``: the alerts of the
+        last reading on the page are never split across pages.
+        """
+        clauses, args = [], []
+        for column, value in (("level", level), ("location", location), ("type", alert_type)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            args.append(until)
+        if before is not None:
+            clauses.append("(ts < ? OR (ts = ? AND reading_seq < ?))")
+            args.extend((before[0], before[0], before[1]))
+        if at_most is not None:
+            clauses.append("(ts < ? OR (ts = ? AND reading_seq <= ?))")
+            args.extend((at_most[0], at_most[0], at_most[1]))
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        select = "SELECT id, reading_seq, ts, location, level, type, rule, message FROM alerts "
+        with self._lock:
+            rows = self._conn.execute(
+                select + where + "ORDER BY ts DESC, reading_seq DESC, id DESC LIMIT ?",
+                args + [limit]).fetchall()
+            more = False
+            if rows and len(rows) == limit:
+                last_id, last_seq, last_ts = rows[-1][:3]
+                # Complete the last reading's alerts, then look for anything older
+                rest = ("AND " if clauses else "WHERE ")
+                rows += self._conn.execute(
+                    select + where + rest + "reading_seq = ? AND id < ? ORDER BY id DESC",
+                    args + [last_seq, last_id]).fetchall()
+                more = self._conn.execute(
+                    "SELECT 1 FROM alerts " + where + rest +
+                    "(ts < ? OR (ts = ? AND reading_seq < ?)) LIMIT 1",
+                    args + [last_ts, last_ts, last_seq]).fetchone() is not None
+        rows.reverse()
+        return [(row[2], row[1], self._alert(row[2:])) for row in rows], more
+
+
+def create_backend(json_file: str = "sensor_data.json", history_capacity: int = 1000,
+                   sqlite_file: Optional[str] = None):
+    """
+    Storage configured from the environment, shared by the server and the
+    command line tools: the JSON log (default) with its archive segments
+    next to ``json_file``, or SQLite when ``STORAGE_BACKEND=sqlite`` or
+    ``sqlite_file`` is given. See the README for the variables.
+    """
+    retention_days = os.environ.get("RETENTION_DAYS")
+    if sqlite_file is None and os.environ.get("STORAGE_BACKEND", "json").lower() != "sqlite":
+        # segments imports this module
+        from segments import SegmentStore
+
+        compression = os.environ.get("SNAPSHOT_COMPRESSION", "gzip").lower()
+        segments = None
+        if os.environ.get("SEGMENTS", "on").lower() != "off":
+            segments = SegmentStore(
+                os.path.splitext(json_file)[0] + ".segments",
+                segment_readings=int(os.environ.get("SEGMENT_READINGS", "2000")),
+                retention_days=float(retention_days) if retention_days else None,
+            )
+        return AppendLogBackend(json_file, compression=None if compression == "none" else compression,
+                                segments=segments)
+    max_readings = os.environ.get("RETENTION_MAX_READINGS")
+    return SqliteBackend(
+        sqlite_file or os.environ.get("SQLITE_FILE", "sensor_data.db"),
+        history_limit=history_capacity,
+        retention_days=float(retention_days) if retention_days else None,
+        max_readings=int(max_readings) if max_readings else None,
+    )
+
+
+class WriterLock:
+    """
+    Exclusive, non-blocking inter-process lock used to elect a single writer.
+
+    The lock is held for the lifetime of the process and released by the OS
+    when the process exits, so a crashed writer can be replaced by any other
+    worker polling ``try_acquire``.
+    """
+
+    def __init__(self, lock_file: str):
+        self.lock_file = lock_file
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """Try to become the writer without blocking"""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        """Give up the writer role"""
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
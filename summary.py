@@ -0,0 +1,196 @@
+"""
+Per-location status summary (latest values, water quality index, active
+alerts and trends), maintained incrementally as readings arrive
+"""
+
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from history import timestamp_to_micros
+
+# parameter -> (weight, rating curve as (value, rating 0-100) points with increasing values)
+WQI_CURVES = {
+    'e_coli_ctu_100ml': (0.16, ((0, 100), (1, 85), (10, 50), (100, 10), (1000, 0))),
+    'total_coliforms_ctu_100ml': (0.08, ((0, 100), (10, 70), (50, 30), (500, 0))),
+    'ph': (0.12, ((4, 0), (5, 20), (6.5, 80), (7.2, 100), (8.5, 80), (9, 40), (10, 0))),
+    'turbidity_ntu': (0.12, ((0, 100), (1, 95), (5, 75), (10, 55), (30, 20), (100, 0))),
+    'residual_chlorine_mg_l': (0.10, ((0, 0), (0.1, 40), (0.2, 80), (0.5, 100), (1, 100), (2, 70), (5, 0))),
+    'dissolved_oxygen_mg_l': (0.10, ((0, 0), (2, 20), (5, 70), (7, 95), (9, 100))),
+    'nitrates_no3_mg_l': (0.06, ((0, 100), (10, 85), (50, 40), (100, 0))),
+    'ammonia_nh3_mg_l': (0.06, ((0, 100), (0.2, 90), (0.5, 60), (1.5, 20), (5, 0))),
+    'iron_fe_mg_l': (0.05, ((0, 100), (0.1, 95), (0.3, 70), (1, 30), (3, 0))),
+    'manganese_mn_mg_l': (0.05, ((0, 100), (0.05, 95), (0.1, 75), (0.4, 30), (1, 0))),
+    'total_suspended_solids_mg_l': (0.05, ((0, 100), (5, 90), (20, 60), (50, 30), (150, 0))),
+    'electrical_conductivity_us_cm': (0.05, ((0, 100), (800, 90), (1500, 60), (2500, 30), (5000, 0))),
+}
+
+# Lowest index of each category, best first
+WQI_CATEGORIES = ((90, "excellent"), (70, "good"), (50, "fair"), (25, "poor"), (0, "very poor"))
+
+TREND_PARAMETERS = ('ph', 'turbidity_ntu', 'residual_chlorine_mg_l',
+                    'dissolved_oxygen_mg_l', 'e_coli_ctu_100ml')
+
+LEVEL_SEVERITY = {"info": 0, "warning": 1, "critical": 2}
+
+
+def _rating(curve: Tuple[Tuple[float, float], ...], xs: Tuple[float, ...], value: float) -> float:
+    """Piecewise-linear rating of ``value``, clamped to the curve's end points"""
+    i = bisect_right(xs, value)
+    if i == 0:
+        return curve[0][1]
+    if i == len(curve):
+        return curve[-1][1]
+    (x0, q0), (x1, q1) = curve[i - 1], curve[i]
+    return q0 + (q1 - q0) * (value - x0) / (x1 - x0)
+
+
+_CURVES = {param: (weight, curve, tuple(x for x, _ in curve))
+           for param, (weight, curve) in WQI_CURVES.items()}
+
+
+def water_quality_index(data: Dict[str, Any]) -> Optional[float]:
+    """
+    Weighted arithmetic water quality index (0 worst, 100 best) over the
+    parameters of ``WQI_CURVES`` present in ``data``; None if there are none.
+    """
+    total = weights = 0.0
+    for param, (weight, curve, xs) in _CURVES.items():
+        value = data.get(param)
+        if value is None:
+            continue
+        total += weight * _rating(curve, xs, float(value))
+        weights += weight
+    return round(total / weights, 1) if weights else None
+
+
+def wqi_category(index: Optional[float]) -> Optional[str]:
+    if index is None:
+        return None
+    for lowest, name in WQI_CATEGORIES:
+        if index >= lowest:
+            return name
+    return WQI_CATEGORIES[-1][1]
+
+
+class LocationSummary:
+    """
+    Materialized status of every location, updated in O(parameters) per
+    reading so serving it costs O(locations).
+
+    For each location it keeps the latest reading, its water quality index,
+    the alerts raised within the last ``active_seconds`` of that location's
+    readings (an alert counts as active until then; rules re-raise held
+    conditions every ``repeat_after_seconds``) and a fast and a slow EWMA of
+    each trend parameter. A parameter is rising or falling when the fast
+    average is more than ``trend_tolerance`` (relative) away from the slow
+    one. Readings older than a location's latest only contribute alerts.
+    """
+
+    def __init__(self, active_seconds: float = 3600.0, fast_alpha: float = 0.3,
+                 slow_alpha: float = 0.05, trend_tolerance: float = 0.05, trend_warmup: int = 5):
+        self.active_seconds = active_seconds
+        self.fast_alpha = fast_alpha
+        self.slow_alpha = slow_alpha
+        self.trend_tolerance = trend_tolerance
+        self.trend_warmup = trend_warmup
+        # location -> {"reading", "ts", "trend": {param: [n, fast, slow]}, "active": {key: [level, ts]}}
+        self._state: Dict[str, Dict[str, Any]] = {}
+        # location -> precomputed summary entry
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+    def update(self, reading: Dict[str, Any], alerts: List[Dict[str, Any]] = ()):
+        """Fold in one reading and the alerts it raised"""
+        location = reading["location"]
+        state = self._state.get(location)
+        if state is None:
+            state = self._state[location] = {"reading": None, "ts": None, "trend": {}, "active": {}}
+        ts = timestamp_to_micros(reading["timestamp"])
+        for alert in alerts:
+            key = alert.get("rule") or alert.get("type") or alert["level"]
+            current = state["active"].get(key)
+            if current is None or current[1] <= ts:
+                state["active"][key] = [alert["level"], ts]
+
+        if state["ts"] is None or ts >= state["ts"]:
+            state["reading"], state["ts"] = reading, ts
+            data = reading["data"]
+            trend = state["trend"]
+            for param in TREND_PARAMETERS:
+                value = data.get(param)
+                if value is None:
+                    continue
+                averages = trend.get(param)
+                if averages is None:
+                    trend[param] = [1, float(value), float(value)]
+                    continue
+                averages[0] += 1
+                averages[1] += self.fast_alpha * (value - averages[1])
+                averages[2] += self.slow_alpha * (value - averages[2])
+        self._entries[location] = self._entry(location, state)
+
+    def _entry(self, location: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        reading = state["reading"]
+        horizon = state["ts"] - self.active_seconds * 1e6
+        active = state["active"]
+        for key in [k for k, (_, ts) in active.items() if ts < horizon]:
+            del active[key]
+        worst = max((level for level, _ in active.values()),
+                    key=lambda level: LEVEL_SEVERITY.get(level, 0), default=None)
+        index = water_quality_index(reading["data"])
+        return {
+            "location": location,
+            "scenario": reading.get("scenario"),
+            "name": reading.get("name"),
+            "last_reading": reading["timestamp"],
+            "status": worst or "ok",
+            "active_alert_level": worst,
+            "active_alerts": len(active),
+            "wqi": index,
+            "wqi_category": wqi_category(index),
+            "trends": {param: self._direction(averages)
+                       for param, averages in state["trend"].items()},
+            "values": reading["data"],
+        }
+
+    def _direction(self, averages: List[float]) -> str:
+        n, fast, slow = averages
+        if n < self.trend_warmup:
+            return "steady"
+        # Small absolute floor, so series sitting at 0 (E.coli) are steady
+        tolerance = max(self.trend_tolerance * abs(slow), 0.01)
+        if fast - slow > tolerance:
+            return "rising"
+        if slow - fast > tolerance:
+            return "falling"
+        return "steady"
+
+    def entries(self, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Every location's summary by name, with the seconds since its last reading"""
+        now = now or datetime.now()
+        now_micros = timestamp_to_micros(now.isoformat())
+        return [{**entry, "seconds_since_last_reading":
+                 round((now_micros - self._state[location]["ts"]) / 1e6, 1)}
+                for location, entry in sorted(self._entries.items())]
+
+    def reset(self):
+        self._state.clear()
+        self._entries.clear()
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {location: {"reading": state["reading"],
+                           "trend": {p: list(a) for p, a in state["trend"].items()},
+                           "active": {k: list(v) for k, v in state["active"].items()}}
+                for location, state in self._state.items()}
+
+    def load(self, state: Dict[str, Dict[str, Any]]):
+        self.reset()
+        for location, saved in state.items():
+            reading = saved["reading"]
+            self._state[location] = {
+                "reading": reading,
+                "ts": timestamp_to_micros(reading["timestamp"]),
+                "trend": {p: list(a) for p, a in saved.get("trend", {}).items()},
+                "active": {k: list(v) for k, v in saved.get("active", {}).items()},
+            }
+            self._entries[location] = self._entry(location, self._state[location])
@@ -0,0 +1,70 @@
+"""
+Tests for alert rule hysteresis and repeats
+"""
+
+import json
+
+import pytest
+
+from alert_rules import AlertRuleEngine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps({
+        "defaults": {"hysteresis": 0, "repeat_after_seconds": 600},
+        "rules": [{
+            "id": "turbidity_high",
+            "param": "turbidity_ntu",
+            "gt": 10,
+            "hysteresis": 1,
+            "level": "warning",
+            "type": "physical",
+            "message": "Turbidity {value} NTU",
+        }],
+    }))
+    return AlertRuleEngine(str(rules_file))
+
+
+def rules_raised(engine, minute, turbidity, location="Kyanja Reservoir"):
+    alerts = engine.evaluate({
+        "location": location,
+        "timestamp": f"2026-03-01T12:{minute:02d}:00",
+        "data": {"turbidity_ntu": turbidity},
+    })
+    return [alert["rule"] for alert in alerts]
+
+
+def test_active_rule_stays_quiet_inside_the_hysteresis_band(engine):
+    assert rules_raised(engine, 0, 11) == ["turbidity_high"]
+    # Still above the threshold, then back under it but within the band
+    assert rules_raised(engine, 1, 12) == []
+    assert rules_raised(engine, 2, 9.5) == []
+    assert rules_raised(engine, 3, 10.5) == []
+    # Leaving the band clears it, so the next crossing alerts again
+    assert rules_raised(engine, 4, 8) == []
+    assert rules_raised(engine, 5, 10.5) == ["turbidity_high"]
+
+
+def test_active_rule_repeats_after_the_repeat_interval(engine):
+    assert rules_raised(engine, 0, 15) == ["turbidity_high"]
+    assert rules_raised(engine, 5, 15) == []
+    assert rules_raised(engine, 9, 15) == []
+    assert rules_raised(engine, 10, 15) == ["turbidity_high"]
+    assert rules_raised(engine, 15, 15) == []
+
+
+def test_rule_state_is_kept_per_location(engine):
+    assert rules_raised(engine, 0, 11) == ["turbidity_high"]
+    assert rules_raised(engine, 1, 11, location="Ggaba III Plant") == ["turbidity_high"]
+    assert rules_raised(engine, 2, 11) == []
+
+
+def test_batch_evaluation_matches_one_by_one(engine):
+    values = [11, 12, 9.5, 8, 10.5, 30, 2] * 12
+    batch = [{"location": "Kyanja Reservoir", "timestamp": f"2026-03-01T{i // 60:02d}:{i % 60:02d}:00",
+              "data": {"turbidity_ntu": v}} for i, v in enumerate(values)]
+    expected = [engine.evaluate(reading) for reading in batch]
+    engine.reset_state()
+    assert engine.evaluate_batch(batch) == expected
@@ -0,0 +1,116 @@
+"""
+Tests for the HTTP API: conditional GETs, query validation, long polling and uploads
+"""
+
+import glob
+import importlib
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    # The app keeps its data files in the working directory
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(tmp_path_factory.mktemp("app"))
+        mp.setenv("SIMULATE_SENSORS", "0")
+        app = importlib.import_module("app")
+        assert app.data_store.wait_until_ready(10)
+        assert app.data_store.try_become_writer()
+        yield app
+
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
+
+
+def logged_entries():
+    count = 0
+    for log in glob.glob("sensor_data.json.log.*"):
+        with open(log, "rb") as f:
+            count += f.read().count(b"\n")
+    return count
+
+
+def upload(client, *minutes):
+    readings = [{"location": "Kyanja Reservoir", "timestamp": f"2026-03-01T12:{m:02d}:00",
+                 "data": {"ph": 7.1, "turbidity_ntu": 2.5}} for m in minutes]
+    return client.post("/api/readings/bulk", json=readings)
+
+
+def test_bulk_upload_is_on_disk_when_acknowledged(client):
+    logged = logged_entries()
+    response = upload(client, 0, 1, 2)
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "stored"
+    assert logged_entries() == logged + 3
+
+
+def test_unchanged_response_is_answered_with_304(client):
+    upload(client, 3)
+    first = client.get("/api/latest")
+    assert first.status_code == 200 and first.headers["ETag"]
+
+    again = client.get("/api/latest", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+
+    upload(client, 4)
+    changed = client.get("/api/latest", headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != first.headers["ETag"]
+
+
+@pytest.mark.parametrize("limit", ["0", "-5", "abc", "1.5"])
+def test_limit_must_be_a_positive_integer(client, limit):
+    for path in ("/api/historical", "/api/alerts", "/api/locations/Kyanja Reservoir/history"):
+        response = client.get(path, query_string={"limit": limit})
+        assert response.status_code == 400, path
+
+
+def test_historical_range_query(client):
+    upload(client, 10, 11, 12, 13)
+    response = client.get("/api/historical", query_string={
+        "from": "2026-03-01T12:10:00", "to": "2026-03-01T12:13:00", "limit": 2})
+    assert response.status_code == 200
+    assert [r["timestamp"] for r in response.get_json()] == ["2026-03-01T12:11:00", "2026-03-01T12:12:00"]
+    assert response.headers["X-Next-Cursor"]
+
+
+@pytest.mark.parametrize("timeout", ["nan", "inf", "-inf", "soon"])
+def test_long_poll_rejects_non_finite_timeouts(client, timeout):
+    response = client.get("/api/events", query_string={"timeout": timeout})
+    assert response.status_code == 400
+
+
+def test_long_poll_timeout_is_clamped(client):
+    started = time.monotonic()
+    response = client.get("/api/events", query_string={"timeout": "-3"})
+    assert response.status_code == 200
+    assert response.get_json()["events"] == []
+    assert time.monotonic() - started < 1
+
+    started = time.monotonic()
+    assert client.get("/api/events", query_string={"timeout": "0.3"}).status_code == 200
+    assert 0.3 <= time.monotonic() - started < 2
+
+
+def test_long_poll_returns_new_events(api, client):
+    since = api.data_store.last_seq
+    poster = threading.Timer(0.2, upload, (api.app.test_client(), 30))
+    poster.start()
+    response = client.get("/api/events", query_string={"since": since, "timeout": "10",
+                                                        "events": "readings"})
+    poster.join()
+    events = response.get_json()["events"]
+    assert [e["data"]["timestamp"] for e in events] == ["2026-03-01T12:30:00"]
+    assert response.get_json()["last_event_id"] == events[-1]["id"]
+
+
+def test_health_reports_liveness(client):
+    response = client.get("/api/health")
+    assert response.status_code == 200
+    assert response.get_json()["ready"] is True
@@ -0,0 +1,139 @@
+"""
+Tests for DataStore writer election, follower tailing, queries and durability
+"""
+
+import glob
+import time
+
+import pytest
+
+from data_store import DataStore
+from storage import AppendLogBackend
+
+
+def reading(minute, location="Kyanja Reservoir", ph=7.0):
+    return {
+        "location": location,
+        "timestamp": f"2026-03-01T12:{minute:02d}:00",
+        "data": {"ph": ph, "turbidity_ntu": 2.5},
+    }
+
+
+def close(store):
+    store._writer_lock.release()
+
+
+def logged_entries(path):
+    count = 0
+    for log in glob.glob(f"{path}.log.*"):
+        with open(log, "rb") as f:
+            count += f.read().count(b"\n")
+    return count
+
+
+def test_follower_tails_the_writer(tmp_path):
+    path = str(tmp_path / "data.json")
+    writer = DataStore(path, backend=AppendLogBackend(path, compact_every=5))
+    follower = DataStore(path, follower=True, refresh_interval=0)
+    for minute in range(12):
+        writer.add_reading(reading(minute))
+        readings, _ = follower.query_readings(limit=100)
+        # Caught up after every append, across compactions into new snapshots
+        assert len(readings) == minute + 1
+    assert follower.get_latest_reading() == writer.get_latest_reading()
+    with pytest.raises(RuntimeError):
+        follower.add_reading(reading(59))
+
+
+def test_only_one_writer_at_a_time(tmp_path):
+    path = str(tmp_path / "data.json")
+    writer = DataStore(path)
+    writer.add_reading(reading(0))
+    with pytest.raises(RuntimeError):
+        DataStore(path)
+    follower = DataStore(path, follower=True, refresh_interval=0)
+    assert not follower.try_become_writer()
+
+    writer.add_reading(reading(1))
+    close(writer)
+    assert follower.try_become_writer()
+    follower.add_reading(reading(2))
+    readings, _ = follower.query_readings(limit=100)
+    assert [r["timestamp"][-5:-3] for r in readings] == ["00", "01", "02"]
+
+
+@pytest.fixture
+def populated(tmp_path):
+    store = DataStore(str(tmp_path / "data.json"))
+    for minute in range(20):
+        store.add_reading(reading(minute, "Kyanja Reservoir" if minute % 2 else "Ggaba III Plant"))
+    return store
+
+
+def test_range_query_is_paged_newest_first(populated):
+    pages = []
+    cursor = None
+    while True:
+        readings, cursor = populated.query_readings(
+            since="2026-03-01T12:05:00", until="2026-03-01T12:15:00", limit=3, cursor=cursor)
+        pages.append([int(r["timestamp"][-5:-3]) for r in readings])
+        if cursor is None:
+            break
+    assert pages == [[12, 13, 14], [9, 10, 11], [6, 7, 8], [5]]
+
+
+def test_location_query_with_params(populated):
+    readings, cursor = populated.query_readings(location="Kyanja Reservoir", params=["ph"], limit=4)
+    assert [r["timestamp"][-5:-3] for r in readings] == ["13", "15", "17", "19"]
+    assert all(r["location"] == "Kyanja Reservoir" and list(r["data"]) == ["ph"] for r in readings)
+    assert cursor is not None
+
+
+def test_bad_query_arguments_raise_value_error(populated):
+    with pytest.raises(ValueError):
+        populated.query_readings(cursor="not-a-cursor")
+    with pytest.raises(ValueError):
+        populated.query_readings(params=["no_such_parameter"])
+    with pytest.raises(ValueError):
+        populated.query_alerts(limit=0)
+
+
+def test_wait_returns_only_once_the_batch_is_logged(tmp_path):
+    path = str(tmp_path / "data.json")
+    store = DataStore(path, flush_interval=60)
+    store.add_readings([reading(0), reading(1)])
+    assert logged_entries(path) == 0
+    store.add_readings([reading(2)], wait=True)
+    assert logged_entries(path) == 3
+    assert store.dirty_count == 0
+
+
+def test_wait_raises_when_the_batch_cannot_be_written(tmp_path):
+    class FailingBackend(AppendLogBackend):
+        def append(self, entries):
+            raise OSError("disk full")
+
+    path = str(tmp_path / "data.json")
+    store = DataStore(path, backend=FailingBackend(path))
+    with pytest.raises(IOError):
+        store.add_readings([reading(0)], wait=True)
+    # Kept for the next flush
+    assert store.dirty_count == 1
+
+
+def test_failed_background_load_is_reported(tmp_path):
+    class BrokenBackend(AppendLogBackend):
+        def load(self):
+            raise OSError("unreadable")
+
+    path = str(tmp_path / "data.json")
+    errors = []
+    store = DataStore(path, backend=BrokenBackend(path), follower=True, lazy_load=True,
+                      on_load_error=errors.append)
+    deadline = time.monotonic() + 5
+    while not errors and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [str(e) for e in errors] == ["unreadable"]
+    assert store.load_error is errors[0]
+    assert not store.ready
+    assert not store.try_become_writer()
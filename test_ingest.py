@@ -0,0 +1,53 @@
+"""
+Tests for the validation of uploaded readings
+"""
+
+import os
+
+import pytest
+
+from ingest import ReadingInbox, ReadingSchema
+
+VALID = {
+    "location": "Kyanja Reservoir",
+    "timestamp": "2026-03-01T12:00:00",
+    "data": {"ph": 7.1, "turbidity_ntu": 2.5},
+}
+
+
+@pytest.mark.parametrize("timestamp", ["0001-01-01T00:00:00+14:00", "9999-12-31T23:59:59-14:00"])
+def test_out_of_range_offset_timestamp_is_rejected(timestamp):
+    with pytest.raises(ValueError, match="Invalid timestamp"):
+        ReadingSchema().validate({**VALID, "timestamp": timestamp})
+
+
+def test_out_of_range_timestamp_fails_only_its_item():
+    readings, errors = ReadingSchema().validate_many(
+        [VALID, {**VALID, "timestamp": "9999-12-31T23:59:59-14:00"}])
+    assert len(readings) == 1
+    assert errors == [{"index": 1, "error": "Invalid timestamp: 9999-12-31T23:59:59-14:00"}]
+
+
+def test_inbox_batch_is_removed_only_after_it_is_stored(tmp_path):
+    inbox = ReadingInbox(str(tmp_path / "inbox"))
+    first = inbox.put([VALID])
+    second = inbox.put([{**VALID, "timestamp": "2026-03-01T12:01:00"}])
+
+    drain = inbox.drain()
+    name, readings = next(drain)
+    assert (name, readings) == (first, [VALID])
+    # The writer dies while storing the first batch: both are still spooled
+    drain.close()
+    assert inbox.pending() == [first, second]
+
+    stored = [name for name, _ in inbox.drain()]
+    assert stored == [first, second]
+    assert inbox.pending() == []
+
+
+def test_inbox_ignores_partly_written_batches(tmp_path):
+    inbox = ReadingInbox(str(tmp_path / "inbox"))
+    name = inbox.put([VALID])
+    with open(os.path.join(inbox.directory, ".unfinished.ndjson.tmp"), "w") as f:
+        f.write('{"location": "Kya')
+    assert inbox.pending() == [name]
@@ -42,6 +42,9 @@ echo ""
 echo "💡 Tip: Open another terminal and run:"
 echo "   curl http://localhost:5000/api/latest"
 echo ""
+echo "📈 To benchmark the storage and API paths offline:"
+echo "   python3 benchmark.py --quick"
+echo ""
 echo "========================================"
 echo ""
 
@@ -0,0 +1,108 @@
+"""
+Tests for log replay and torn-tail recovery of the append-only storage
+"""
+
+import glob
+import json
+
+from data_store import DataStore
+from storage import AppendLogBackend
+
+
+def reading(minute, ph=7.0, location="Kyanja Reservoir"):
+    return {
+        "location": location,
+        "timestamp": f"2026-03-01T12:{minute:02d}:00",
+        "data": {"ph": ph, "turbidity_ntu": 2.5},
+    }
+
+
+def open_store(path, **kwargs):
+    return DataStore(path, backend=AppendLogBackend(path, **kwargs))
+
+
+def close(store):
+    store._writer_lock.release()
+
+
+def test_log_entries_are_replayed_on_load(tmp_path):
+    path = str(tmp_path / "data.json")
+    store = open_store(path)
+    for minute in range(10):
+        store.add_reading(reading(minute, ph=4.0 if minute == 7 else 7.0))
+    alerts = store.get_alerts()
+    close(store)
+
+    reloaded = open_store(path)
+    assert len(reloaded.history) == 10
+    assert reloaded.get_latest_reading()["timestamp"] == "2026-03-01T12:09:00"
+    assert "ph_critical" in [a["rule"] for a in alerts]
+    assert reloaded.get_alerts() == alerts
+
+
+def test_snapshot_and_later_log_are_both_loaded(tmp_path):
+    path = str(tmp_path / "data.json")
+    store = open_store(path, compact_every=4)
+    for minute in range(10):
+        store.add_reading(reading(minute))
+    close(store)
+
+    reloaded = open_store(path, compact_every=4)
+    readings, _ = reloaded.query_readings(limit=100)
+    assert [r["timestamp"][-5:-3] for r in readings] == [f"{m:02d}" for m in range(10)]
+
+
+def test_torn_log_tail_is_dropped_and_appends_continue(tmp_path):
+    path = str(tmp_path / "data.json")
+    store = open_store(path)
+    for minute in range(3):
+        store.add_reading(reading(minute))
+    close(store)
+    [log] = glob.glob(f"{path}.log.*")
+    with open(log, "ab") as f:
+        f.write(b'{"seq":3,"reading":{"loca')
+
+    store = open_store(path)
+    assert len(store.history) == 3
+    store.add_reading(reading(3))
+    close(store)
+
+    with open(log, "rb") as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line)["seq"] for line in lines] == [0, 1, 2, 3]
+    assert len(open_store(path).history) == 4
+
+
+def test_torn_rollups_tail_is_repaired_before_appending(tmp_path):
+    path = str(tmp_path / "data.json")
+    store = open_store(path, compact_every=5)
+    for minute in range(12):
+        store.add_reading(reading(minute))
+    close(store)
+    with open(f"{path}.rollups", "ab") as f:
+        f.write(b'["1m","Kyanja Reservoir",17')
+
+    store = open_store(path, compact_every=5)
+    for minute in range(12, 24):
+        store.add_reading(reading(minute))
+    expected = store.get_aggregates("1m")
+    close(store)
+
+    with open(f"{path}.rollups", "rb") as f:
+        body = f.read()
+    assert body.endswith(b"\n")
+    assert all(json.loads(line) for line in body.splitlines())
+    assert open_store(path, compact_every=5).get_aggregates("1m") == expected
+
+
+def test_undecodable_rollup_rows_are_skipped(tmp_path):
+    path = str(tmp_path / "data.json")
+    store = open_store(path, compact_every=5)
+    for minute in range(12):
+        store.add_reading(reading(minute))
+    expected = store.get_aggregates("1m")
+    close(store)
+    with open(f"{path}.rollups", "ab") as f:
+        f.write(b"not json\n")
+
+    assert open_store(path, compact_every=5).get_aggregates("1m") == expected
@@ -3,11 +3,24 @@ Water Quality Sensor Data Simulator
 Generates synthetic water quality sensor readings with realistic variations
 """
 
+import hashlib
+import logging
 import random
 import time
-from typing import Dict, Any, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Union
 import kisa_utils as kutils
 
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; batches fall back to pure Python
+    np = None
+
+logger = logging.getLogger(__name__)
+
 class WaterSensorSimulator:
     """Simulates water quality sensor readings"""
 
@@ -204,9 +217,32 @@ class WaterSensorSimulator:
         }
     }
 
-    def __init__(self, noise_level: float = 0.05):
-        """Initialize the simulator with noise level and scenario weights"""
+    # Parameter names shared by every scenario, in reading order
+    PARAMETERS = tuple(SCENARIOS["clean"]["ranges"])
+
+    # Parameters reported as whole-number colony counts
+    INTEGER_PARAMETERS = frozenset({'e_coli_ctu_100ml', 'faecal_coliforms_ctu_100ml', 'total_coliforms_ctu_100ml'})
+
+    # Parameters reported with one decimal place (everything else uses two)
+    ONE_DECIMAL_PARAMETERS = frozenset({'ph', 'turbidity_ntu', 'temperature_c'})
+
+    # Ticks generated per backfill work unit; fixed so output never depends
+    # on how the units are spread over worker processes
+    BACKFILL_BLOCK_TICKS = 1440
+    # Blocks per worker process submitted ahead of the consumer
+    BACKFILL_PREFETCH = 2
+
+    def __init__(self, noise_level: float = 0.05, seed: Optional[int] = None):
+        """
+        Initialize the simulator with noise level and scenario weights.
+
+        With a ``seed`` every reading is reproducible: scenario selection and
+        each location's values are drawn from their own seeded streams.
+        """
         self.noise_level = noise_level
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self._streams: Dict[str, random.Random] = {}
         self.weights = {
             "clean": 0.25,           # 25% chance
             "turbid": 0.15,          # 15% chance
@@ -216,21 +252,59 @@ class WaterSensorSimulator:
             "pump_kurambiro": 0.10,  # 10% chance
             "pump_lubigi": 0.05      # 5% chance
         }
+        self._scenario_keys = list(self.weights)
+        self._cum_weights = list(accumulate(self.weights[s] for s in self._scenario_keys))
+
+        # Precompiled tables for batch generation, aligned with PARAMETERS
+        self._precision = tuple(
+            0 if p in self.INTEGER_PARAMETERS else 1 if p in self.ONE_DECIMAL_PARAMETERS else 2
+            for p in self.PARAMETERS
+        )
+        self._bound_keys = list(self.SCENARIOS)
+        self._bounds = {
+            key: (tuple(self.SCENARIOS[key]["ranges"][p][0] for p in self.PARAMETERS),
+                  tuple(self.SCENARIOS[key]["ranges"][p][1] for p in self.PARAMETERS))
+            for key in self._bound_keys
+        }
+        if np is not None:
+            self._low_matrix = np.array([self._bounds[k][0] for k in self._bound_keys])
+            self._high_matrix = np.array([self._bounds[k][1] for k in self._bound_keys])
+
+    @staticmethod
+    def derive_seed(*parts) -> int:
+        """Stable 64-bit seed derived from a base seed and identifying parts"""
+        digest = hashlib.sha256(":".join(map(str, parts)).encode()).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def _stream(self, location: str) -> random.Random:
+        """Random stream owned by one location"""
+        stream = self._streams.get(location)
+        if stream is None:
+            if self.seed is None:
+                stream = random.Random(self.rng.getrandbits(64))
+            else:
+                stream = random.Random(self.derive_seed(self.seed, location))
+            self._streams[location] = stream
+        return stream
 
     def select_random_scenario(self) -> str:
         """Select a random scenario based on weights"""
-        scenarios = list(self.weights.keys())
-        weights = [self.weights[s] for s in scenarios]
-        return random.choices(scenarios, weights=weights)[0]
+        return self.rng.choices(self._scenario_keys, cum_weights=self._cum_weights)[0]
 
-    def _add_noise(self, value: float, min_val: float, max_val: float) -> float:
+    def _add_noise(self, value: float, min_val: float, max_val: float,
+                   rng: Optional[random.Random] = None) -> float:
         """Add realistic sensor noise to a value"""
-        noise = random.uniform(-self.noise_level, self.noise_level)
+        noise = (rng or self.rng).uniform(-self.noise_level, self.noise_level)
         noisy_value = value * (1 + noise)
         return max(min_val, min(noisy_value, max_val))
 
-    def generate_reading(self, scenario: Optional[str] = None) -> Dict[str, Any]:
-        """Generate a reading for the specified scenario or random if none specified"""
+    def generate_reading(self, scenario: Optional[str] = None,
+                         location: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate a reading for the specified scenario or random if none specified.
+        ``location`` overrides the scenario's location, to simulate many sensors
+        with the same water profile.
+        """
         if scenario is None:
             scenario = self.select_random_scenario()
         elif scenario not in self.SCENARIOS:
@@ -242,22 +316,227 @@ class WaterSensorSimulator:
         reading = {
             'scenario': scenario,
             'name': scenario_data['name'],
-            'location': scenario_data['location'],
+            'location': location or scenario_data['location'],
             'timestamp': timestamp,
             'data': {}
         }
 
         # Generate values for each parameter
+        # Sensors sharing a scenario profile still draw independent values
+        rng = self._stream(reading['location'])
         for param, (min_val, max_val) in scenario_data['ranges'].items():
-            base_value = random.uniform(min_val, max_val)
+            base_value = rng.uniform(min_val, max_val)
             # Round to different precision based on parameter type
-            if param in ['e_coli_ctu_100ml', 'faecal_coliforms_ctu_100ml', 'total_coliforms_ctu_100ml']:
-                value = int(round(self._add_noise(base_value, min_val, max_val), 0))
-            elif param in ['ph', 'turbidity_ntu', 'temperature_c']:
-                value = round(self._add_noise(base_value, min_val, max_val), 1)
+            if param in self.INTEGER_PARAMETERS:
+                value = int(round(self._add_noise(base_value, min_val, max_val, rng), 0))
+            elif param in self.ONE_DECIMAL_PARAMETERS:
+                value = round(self._add_noise(base_value, min_val, max_val, rng), 1)
             else:
-                value = round(self._add_noise(base_value, min_val, max_val), 2)
+                value = round(self._add_noise(base_value, min_val, max_val, rng), 2)
             reading['data'][param] = value
 
         return reading
 
+    def _resolve_batch_scenarios(self, n: int, scenarios, rng) -> List[str]:
+        """Expand the ``scenarios`` argument of generate_batch to one key per row"""
+        if scenarios is None:
+            return rng.choices(self._scenario_keys, cum_weights=self._cum_weights, k=n)
+        if isinstance(scenarios, str):
+            scenarios = [scenarios] * n
+        elif len(scenarios) != n:
+            raise ValueError(f"Expected {n} scenarios, got {len(scenarios)}")
+        unknown = set(scenarios) - set(self.SCENARIOS)
+        if unknown:
+            raise ValueError(f"Unknown scenario: {sorted(unknown)}. Available: {list(self.SCENARIOS.keys())}")
+        return list(scenarios)
+
+    def generate_batch(self, n: int, scenarios: Union[str, Sequence[str], None] = None,
+                       seed: Optional[int] = None,
+                       timestamps: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        Generate ``n`` readings at once, returned column by column.
+
+        ``scenarios`` is a single scenario key, one key per row, or None for
+        weighted random selection. Values follow the same distribution and
+        per-parameter precision as ``generate_reading``. Uses NumPy when it is
+        installed. The result has ``scenario``, ``name``, ``location`` and
+        ``timestamp`` lists plus ``data`` mapping each parameter to a column.
+        """
+        rng = random.Random(seed if seed is not None else self.rng.getrandbits(64))
+        keys = self._resolve_batch_scenarios(n, scenarios, rng)
+        if timestamps is None:
+            timestamps = [kutils.dates.currentTimestamp()] * n
+        elif len(timestamps) != n:
+            raise ValueError(f"Expected {n} timestamps, got {len(timestamps)}")
+
+        if np is not None:
+            data = self._batch_values_numpy(keys, rng.getrandbits(64))
+        else:
+            data = self._batch_values_python(keys, rng)
+
+        return {
+            'scenario': keys,
+            'name': [self.SCENARIOS[k]['name'] for k in keys],
+            'location': [self.SCENARIOS[k]['location'] for k in keys],
+            'timestamp': list(timestamps),
+            'data': data
+        }
+
+    def _batch_values_numpy(self, keys: List[str], seed: int) -> Dict[str, Any]:
+        """Draw every value of the batch with NumPy, one matrix per bound"""
+        row_of = {k: i for i, k in enumerate(self._bound_keys)}
+        rows = np.fromiter((row_of[k] for k in keys), dtype=np.intp, count=len(keys))
+        lo, hi = self._low_matrix[rows], self._high_matrix[rows]
+
+        gen = np.random.default_rng(seed)
+        base = gen.uniform(lo, hi)
+        noise = gen.uniform(-self.noise_level, self.noise_level, size=base.shape)
+        values = np.clip(base * (1 + noise), lo, hi)
+
+        data = {}
+        for i, (param, precision) in enumerate(zip(self.PARAMETERS, self._precision)):
+            column = np.round(values[:, i], precision)
+            data[param] = column.astype(np.int64) if precision == 0 else column
+        return data
+
+    def _batch_values_python(self, keys: List[str], rng: random.Random) -> Dict[str, List[Any]]:
+        """Pure-Python fallback using the precompiled bounds and precision tables"""
+        columns = [[] for _ in self.PARAMETERS]
+        draw = rng.random
+        noise_low = -self.noise_level
+        noise_span = 2 * self.noise_level
+        tables = {
+            key: list(zip(columns, lows, highs, [h - l for l, h in zip(lows, highs)], self._precision))
+            for key, (lows, highs) in self._bounds.items()
+        }
+        for key in keys:
+            # Same draws as random.uniform(lo, hi) and uniform(-noise, noise)
+            for column, lo, hi, span, precision in tables[key]:
+                value = (lo + span * draw()) * (1 + noise_low + noise_span * draw())
+                if value < lo:
+                    value = lo
+                elif value > hi:
+                    value = hi
+                column.append(int(round(value)) if precision == 0 else round(value, precision))
+        return dict(zip(self.PARAMETERS, columns))
+
+    @staticmethod
+    def batch_to_readings(batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Turn a columnar batch from ``generate_batch`` into reading dicts"""
+        params = list(batch['data'])
+        columns = [batch['data'][p] for p in params]
+        if np is not None:
+            columns = [c.tolist() if isinstance(c, np.ndarray) else c for c in columns]
+        return [
+            {
+                'scenario': scenario,
+                'name': name,
+                'location': location,
+                'timestamp': timestamp,
+                'data': dict(zip(params, values))
+            }
+            for scenario, name, location, timestamp, *values in zip(
+                batch['scenario'], batch['name'], batch['location'], batch['timestamp'], *columns)
+        ]
+
+    def backfill(self, start: Union[str, datetime], end: Union[str, datetime],
+                 interval: Union[float, timedelta], workers: int = 1,
+                 scenarios: Optional[Sequence[str]] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Generate one reading per scenario every ``interval`` from ``start``
+        (inclusive) to ``end`` (exclusive), yielding them in time-ordered
+        batches (e.g. for ``DataStore.add_readings``).
+
+        The range is cut into fixed blocks of ticks, and every block and
+        scenario draws from its own seed derived from the simulator seed, so
+        the output is identical for any number of ``workers``. At most
+        ``BACKFILL_PREFETCH`` blocks per worker are generated ahead of the
+        consumer, so memory stays bounded however long the range.
+        """
+        start = datetime.fromisoformat(start) if isinstance(start, str) else start
+        end = datetime.fromisoformat(end) if isinstance(end, str) else end
+        step = interval if isinstance(interval, timedelta) else timedelta(seconds=interval)
+        if step <= timedelta(0):
+            raise ValueError("Backfill interval must be positive")
+        scenarios = list(scenarios) if scenarios is not None else list(self.SCENARIOS)
+        self._resolve_batch_scenarios(len(scenarios), scenarios, self.rng)
+
+        total_ticks = max(0, -(-(end - start) // step))
+        base_seed = self.seed if self.seed is not None else self.rng.getrandbits(64)
+        block = self.BACKFILL_BLOCK_TICKS
+        blocks = -(-total_ticks // block)
+        units = (
+            (self.noise_level, base_seed, index, start + index * block * step, step,
+             min(block, total_ticks - index * block), scenarios)
+            for index in range(blocks)
+        )
+
+        if workers <= 1 or blocks <= 1:
+            for unit in units:
+                yield _backfill_block(unit)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # pool.map would submit every block up front and hold all finished
+            # ones until consumed; keep a bounded window of blocks in flight
+            in_flight = deque()
+            for unit in units:
+                in_flight.append(pool.submit(_backfill_block, unit))
+                if len(in_flight) >= self.BACKFILL_PREFETCH * workers:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+
+def _backfill_block(unit) -> List[Dict[str, Any]]:
+    """Generate one backfill block (module-level so worker processes can run it)"""
+    noise_level, base_seed, index, block_start, step, ticks, scenarios = unit
+    simulator = WaterSensorSimulator(noise_level=noise_level)
+    timestamps = [(block_start + i * step).isoformat() for i in range(ticks)]
+    per_scenario = [
+        WaterSensorSimulator.batch_to_readings(simulator.generate_batch(
+            ticks, scenario,
+            seed=WaterSensorSimulator.derive_seed(base_seed, "backfill", index,
+                                                  WaterSensorSimulator.SCENARIOS[scenario]["location"]),
+            timestamps=timestamps))
+        for scenario in scenarios
+    ]
+    # Interleave so readings come out tick by tick, like the live loop
+    return [reading for tick in zip(*per_scenario) for reading in tick]
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    from data_store import DataStore
+    from logging_config import configure_logging
+    from storage import create_backend
+
+    parser = argparse.ArgumentParser(description="Backfill synthetic readings into the data store")
+    parser.add_argument("start", help="ISO timestamp of the first reading")
+    parser.add_argument("end", help="ISO timestamp to stop before")
+    parser.add_argument("--interval", type=float, default=60.0, help="Seconds between readings (default 60)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (default 1)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible output")
+    parser.add_argument("--data-file", default="sensor_data.json", help="Data store file")
+    parser.add_argument("--sqlite-file", default=None, help="Write to this SQLite database instead")
+    parser.add_argument("--history-capacity", type=int,
+                        default=int(os.environ.get("HISTORY_CAPACITY", "1000")),
+                        help="Readings the data store keeps in memory (default HISTORY_CAPACITY or 1000)")
+    args = parser.parse_args()
+    configure_logging()
+
+    # Same storage as the server (STORAGE_BACKEND, SEGMENTS, RETENTION_DAYS, ...),
+    # so readings evicted from memory during a long backfill are archived
+    backend = create_backend(args.data_file, args.history_capacity, args.sqlite_file)
+    store = DataStore(args.data_file, backend=backend, follower=True,
+                      history_capacity=args.history_capacity)
+    if not store.try_become_writer():
+        raise SystemExit("❌ Another process is writing to the data store; stop it before backfilling")
+
+    simulator = WaterSensorSimulator(seed=args.seed)
+    started = time.monotonic()
+    count = 0
+    for batch in simulator.backfill(args.start, args.end, args.interval, workers=args.workers):
+        store.add_readings(batch)
+        count += len(batch)
+    logger.info("✅ Backfilled %d readings in %.1fs", count, time.monotonic() - started)
@@ -0,0 +1,126 @@
+"""
+Compact representations of reading lists for storage and API responses
+"""
+
+import gzip
+import json
+from typing import Dict, List, Any, Optional
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional; columnar JSON is always available
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip is always available
+    zstandard = None
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.waterquality.columnar+json"
+MSGPACK = "application/msgpack"
+# Older clients still send the unregistered name
+MSGPACK_ALIASES = (MSGPACK, "application/x-msgpack")
+
+COLUMNAR_FORMAT = "columnar-v1"
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+def to_columnar(readings: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Convert readings to a "keys once" layout: one array per field and per
+    parameter, with the repeated scenario/name/location strings stored once
+    in ``sources`` and referenced by index. Missing parameters are null.
+    """
+    sources: List[List[str]] = []
+    source_ids: Dict[tuple, int] = {}
+    source_column = []
+    timestamps = []
+    data: Dict[str, List[Any]] = {}
+    for i, reading in enumerate(readings):
+        key = (reading.get("scenario"), reading.get("name"), reading["location"])
+        source_id = source_ids.get(key)
+        if source_id is None:
+            source_id = source_ids[key] = len(sources)
+            sources.append(list(key))
+        source_column.append(source_id)
+        timestamps.append(reading["timestamp"])
+        for param, value in reading["data"].items():
+            column = data.get(param)
+            if column is None:
+                column = data[param] = [None] * i
+            column.append(value)
+        for column in data.values():
+            if len(column) <= i:
+                column.append(None)
+    return {
+        "format": COLUMNAR_FORMAT,
+        "count": len(readings),
+        "sources": sources,
+        "source": source_column,
+        "timestamp": timestamps,
+        "data": data,
+    }
+
+
+def is_columnar(value: Any) -> bool:
+    return isinstance(value, dict) and value.get("format") == COLUMNAR_FORMAT
+
+
+def from_columnar(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Rebuild the list of reading dicts from ``to_columnar`` output"""
+    sources = doc["sources"]
+    columns = list(doc["data"].items())
+    readings = []
+    for i, (source_id, timestamp) in enumerate(zip(doc["source"], doc["timestamp"])):
+        scenario, name, location = sources[source_id]
+        readings.append({
+            "scenario": scenario,
+            "name": name,
+            "location": location,
+            "timestamp": timestamp,
+            "data": {param: column[i] for param, column in columns if column[i] is not None},
+        })
+    return readings
+
+
+def response_mimetypes() -> List[str]:
+    """Media types reading lists can be served as, most preferred first"""
+    types = [JSON, COLUMNAR_JSON]
+    if msgpack is not None:
+        types.extend(MSGPACK_ALIASES)
+    return types
+
+
+def negotiate_encoding(accept_encoding) -> Optional[str]:
+    """Pick the best supported content coding from an ``Accept-Encoding`` header"""
+    if accept_encoding is None:
+        return None
+    offered = ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+    return accept_encoding.best_match(offered)
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "gzip":
+        # mtime=0 keeps the output (and so the ETag) identical across workers
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+def encode(payload: Any, mimetype: str, dumps=None) -> bytes:
+    """
+    Serialize ``payload`` for ``mimetype``. Reading lists are converted to
+    the columnar layout for the compact types. ``dumps`` is the JSON encoder
+    to use for plain JSON (defaults to ``json.dumps``).
+    """
+    if mimetype != JSON and isinstance(payload, list):
+        payload = to_columnar(payload)
+    if mimetype in MSGPACK_ALIASES:
+        return msgpack.packb(payload, use_bin_type=True)
+    if dumps is None:
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return dumps(payload).encode('utf-8')